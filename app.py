@@ -1,13 +1,38 @@
-import sqlite3
 import pandas as pd
 import streamlit as st
-import io
 import os
-from datetime import datetime
+import itertools
+from datetime import date, datetime
+
+from comics import colonnare, profilo
+from comics.db import DB_NAME, elimina_database, versione_dati
+from comics.backup import crea_backup, crea_delta, modifiche_in_sospeso, ripristina
+from comics.archivio import (FILTRI_PER_ID, RIGHE_PAGINA, aggiungi_albo, aggiungi_opzione, aggiungi_serie,
+                             aggiungi_subserie, conta, coppie_serie_subserie, costruisci_filtro, elimina_albo,
+                             get_list_options, get_series_list, get_subseries_list, intervallo_date, leggi_pagina,
+                             metriche, salva_modifiche, svuota_serie, valori_distinti)
+from comics.collezione import MESI_OPZIONI
+from comics.foglio import apri_foglio
+from comics.importer import COLONNE_EXPORT, esportazione, import_csv_multipli
+from comics.sincronizza import sincronizza, ultimo_checkpoint
+from comics.statistiche import numeri_mancanti, ricostruisci, riepilogo_serie, riepilogo_subserie
 
 # --- CONFIGURAZIONE PAGINA ---
 st.set_page_config(page_title="Comic Manager Pro", page_icon="📖", layout="wide")
 
+# --- PROFILO PRESTAZIONI ---
+# Attivabile dalla sidebar (o di default con COMICS_PROFILO=1); con COMICS_PROFILO_LOG=percorso
+# il riepilogo di ogni rerun viene aggiunto anche a un file JSONL.
+PROFILO_LOG = os.environ.get("COMICS_PROFILO_LOG")
+# Un registro rimasto in sessione appartiene a un rerun interrotto da st.rerun() (es. dopo un salvataggio)
+registro_interrotto = st.session_state.pop("profilo_registro", None)
+if registro_interrotto is not None:
+    st.session_state["profilo_interrotto"] = registro_interrotto.riepilogo(interrotto=True)
+    if PROFILO_LOG: profilo.scrivi_jsonl(PROFILO_LOG, st.session_state["profilo_interrotto"])
+profilo_attivo = st.session_state.get("profilo_attivo", bool(os.environ.get("COMICS_PROFILO")))
+registro = profilo.attiva(profilo.Registro() if profilo_attivo else None)
+if registro is not None: st.session_state["profilo_registro"] = registro
+
 # --- CSS PERSONALIZZATO ---
 st.markdown("""
     <style>
@@ -19,203 +44,102 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-DB_NAME = 'comics_pro.db'
-
 # --- COSTANTI ---
-MESI_OPZIONI = [
-    "gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno",
-    "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"
-]
-
 OPZIONI_COLORE = ["B/N", "Colore"]
 OPZIONI_VALUTA = ["Euro", "Lira"]
+RIGHE_ANTEPRIMA_LOG = 200
 
-COLUMNS_ORDER = [
-    "id", "serie", "subserie", "numero", "variante", "titolo", "editore", 
-    "formato", "frequenza", "colore", "pagine", "prezzo_copertina", "valuta",
-    "giorno_uscita", "mese_uscita", "anno_uscita", 
-    "codice", "isbn", "stato", "storage_box", "note"
-]
+MANCANTE = object()
 
 # --- FUNZIONI DATABASE ---
-def init_db():
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS comics
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, 
-                  serie TEXT, subserie TEXT, numero INTEGER, variante TEXT, titolo TEXT, editore TEXT, 
-                  prezzo_copertina REAL, valuta TEXT, 
-                  giorno_uscita INTEGER, mese_uscita TEXT, anno_uscita INTEGER,
-                  codice TEXT, isbn TEXT, note TEXT, stato TEXT, formato TEXT, storage_box TEXT,
-                  frequenza TEXT, colore TEXT, pagine INTEGER)''')
-    
-    c.execute("PRAGMA table_info(comics)")
-    columns = [column[1] for column in c.fetchall()]
-    cols_to_check = ['stato', 'codice', 'isbn', 'note', 'formato', 'editore', 'variante', 'storage_box', 
-                     'giorno_uscita', 'mese_uscita', 'frequenza', 'colore', 'pagine', 'valuta']
-    for col in cols_to_check:
-        if col not in columns:
-            c.execute(f"ALTER TABLE comics ADD COLUMN {col} TEXT")
-            
-    c.execute('''CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY AUTOINCREMENT, nome_serie TEXT UNIQUE)''')
-    c.execute('''CREATE TABLE IF NOT EXISTS subseries 
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT, nome_subserie TEXT, serie_id INTEGER,
-                  FOREIGN KEY(serie_id) REFERENCES series(id))''')
-    
-    c.execute('''CREATE TABLE IF NOT EXISTS list_options (id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT, valore TEXT, UNIQUE(tipo, valore))''')
-    defaults = [('frequenza', 'Mensile'), ('frequenza', 'Bimestrale'), ('frequenza', 'Settimanale')]
-    c.executemany("INSERT OR IGNORE INTO list_options (tipo, valore) VALUES (?,?)", defaults)
-    
-    conn.commit()
-    conn.close()
-
-def get_list_options(tipo):
-    conn = sqlite3.connect(DB_NAME)
-    res = pd.read_sql_query("SELECT valore FROM list_options WHERE tipo = ? ORDER BY valore", conn, params=(tipo,))
-    conn.close()
-    return res['valore'].tolist()
+def update_db_from_editor(pagina, edited_dict):
+    """Salva solo le celle cambiate rispetto all'ultimo salvataggio di questa pagina.
 
-def update_db_from_editor(df_original, edited_dict):
+    Le righe cambiate da altri dopo la lettura della pagina non vengono sovrascritte: sono segnalate
+    e la pagina viene riletta.
+    """
     if not edited_dict or "edited_rows" not in edited_dict:
-        return
-    conn = sqlite3.connect(DB_NAME)
-    c = conn.cursor()
+        return 0
+    applicate = pagina["applicate"]
+    nuove = {}
+    for row_idx, updated_values in edited_dict["edited_rows"].items():
+        diff = {col: v for col, v in updated_values.items() if applicate.get(row_idx, {}).get(col, MANCANTE) != v}
+        if diff: nuove[row_idx] = diff
+    if not nuove:
+        return 0
     try:
-        for row_idx, updated_values in edited_dict["edited_rows"].items():
-            row_idx = int(row_idx)
-            record_id = int(df_original.iloc[row_idx]['id'])
-            for column, value in updated_values.items():
-                c.execute(f"UPDATE comics SET {column} = ? WHERE id = ?", (value, record_id))
-        conn.commit()
+        n, conflitti = salva_modifiche(pagina["df"], nuove)
     except Exception as e:
         st.error(f"Errore durante il salvataggio: {e}")
-    finally:
-        conn.close()
+        return 0
+    for row_idx, diff in nuove.items():
+        applicate.setdefault(row_idx, {}).update(diff)
+    if conflitti:
+        st.warning(f"⚠️ Modifiche non salvate: gli albi con ID {', '.join(map(str, conflitti))} sono stati cambiati "
+                   "da un'altra sessione. La pagina è stata ricaricata, riapplica le modifiche se servono.")
+        pagina["versione"] = None
+    else:
+        pagina["versione"] = versione_dati()
+    return n
+
+def consegna_backup(backup):
+    """I byte del backup per st.download_button: il checkpoint si registra quando sono pronti per il download."""
+    with backup:
+        dati = backup.read()
+    backup.conferma()
+    return dati
+
+
+def mostra_profilo(riepilogo, titolo):
+    with st.expander(titolo, expanded=not riepilogo["interrotto"]):
+        c1, c2, c3 = st.columns(3)
+        c1.metric("Tempo", f"{riepilogo['secondi'] * 1000:.0f} ms")
+        c2.metric("Query", riepilogo["query"])
+        c3.metric("Righe", riepilogo["righe"])
+        st.caption(f"SQL: {riepilogo['secondi_sql'] * 1000:.0f} ms · tempi delle sezioni inclusivi")
+        if riepilogo["sezioni"]:
+            st.dataframe(pd.DataFrame(riepilogo["sezioni"]), hide_index=True)
+        if riepilogo["sql"]:
+            st.dataframe(pd.DataFrame(riepilogo["sql"]), hide_index=True)
+
+# [sincronizzazione] nei secrets: foglio (URL del foglio Google o file .csv/.db che lo sostituisce,
+# default: lo spreadsheet di [connections.gsheets]) e worksheet. Le credenziali sono quelle di [connections.gsheets].
+@st.cache_resource
+def foglio_sincronizzazione():
+    try:
+        cfg = dict(st.secrets.get("sincronizzazione", {}))
+        credenziali = dict(st.secrets.get("connections", {}).get("gsheets", {}))
+    except Exception:
+        return None
+    indirizzo = cfg.get("foglio") or credenziali.get("spreadsheet")
+    if not indirizzo:
+        return None
+    return apri_foglio(indirizzo, credenziali, cfg.get("worksheet") or credenziali.get("worksheet"))
 
 def format_it_comma(valore):
     try: return "{:,.2f}".format(float(valore)).replace(',', 'X').replace('.', ',').replace('X', '.')
     except: return "0,00"
 
-def get_subseries_list(serie_nome):
-    conn = sqlite3.connect(DB_NAME)
-    query = "SELECT nome_subserie FROM subseries JOIN series ON subseries.serie_id = series.id WHERE series.nome_serie = ? ORDER BY nome_subserie"
-    df = pd.read_sql_query(query, conn, params=(serie_nome,))
-    conn.close()
-    return df['nome_subserie'].tolist()
-
-def import_csv_logic(uploaded_file):
-    logs = []
-    summary = {"added": 0, "updated": 0, "skipped": 0}
-    try:
-        raw_data = uploaded_file.read()
-        content = None
-        for enc in ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252']:
-            try:
-                content = raw_data.decode(enc)
-                break
-            except: continue
-        
-        if content is None:
-            return False, 0, 0, ["Impossibile leggere il file: errore di codifica."]
-        
-        first_line = content.splitlines()[0]
-        sep = ';' if ';' in first_line else ','
-        
-        df_import = pd.read_csv(io.StringIO(content), sep=sep, dtype=str).fillna("")
-        df_import.columns = [str(c).lower().strip().replace(' ', '_') for c in df_import.columns]
-        
-        if 'serie' not in df_import.columns:
-            return False, 0, 0, [f"Errore: Colonna 'serie' mancante. Colonne trovate: {list(df_import.columns)}"]
-
-        conn = sqlite3.connect(DB_NAME)
-        c = conn.cursor()
-        
-        for index, row in df_import.iterrows():
-            line_num = index + 2
-            serie = str(row.get('serie', "")).strip()
-            
-            if not serie or serie.lower() == "nan": 
-                logs.append(f"❌ Riga {line_num}: Saltata (Serie vuota).")
-                summary["skipped"] += 1
-                continue
-                
-            try:
-                try: num_val = int(float(str(row.get('numero', '0')).replace(',', '.')))
-                except: num_val = 0
-                
-                variante = str(row.get('variante', "")).strip()
-                codice = str(row.get('codice', "")).strip()
-                subserie = str(row.get('subserie', "Nessuna")).strip()
-                titolo = str(row.get('titolo', "")).strip()
-                
-                c.execute("""SELECT id FROM comics WHERE LOWER(serie)=LOWER(?) AND numero=? AND LOWER(variante)=LOWER(?) AND LOWER(codice)=LOWER(?) AND LOWER(subserie)=LOWER(?) AND LOWER(titolo)=LOWER(?)""", 
-                          (serie, num_val, variante, codice, subserie, titolo))
-                existing = c.fetchone()
-                
-                editore = str(row.get('editore', "")).strip()
-                formato = str(row.get('formato', "")).strip()
-                frequenza = str(row.get('frequenza', "Mensile")).strip()
-                colore = str(row.get('colore', "B/N")).strip()
-                valuta = str(row.get('valuta', "Euro")).strip()
-                
-                try: pagine = int(float(str(row.get('pagine', '0')).replace(',', '.')))
-                except: pagine = 0
-                
-                stato = str(row.get('stato', "stock")).strip().lower()
-                box = str(row.get('storage_box', "")).strip()
-                note = str(row.get('note', "")).strip()
-                isbn = str(row.get('isbn', "")).strip()
-                mese = str(row.get('mese_uscita', "gennaio")).strip().lower()
-                
-                try: prezzo = float(str(row.get('prezzo_copertina', '0')).replace(',', '.'))
-                except: prezzo = 0.0
-                try: giorno = int(float(str(row.get('giorno_uscita', '0'))))
-                except: giorno = 0
-                try: anno = int(float(str(row.get('anno_uscita', '2025'))))
-                except: anno = 2025
-
-                if existing:
-                    c.execute("""UPDATE comics SET editore=?, formato=?, frequenza=?, colore=?, pagine=?, prezzo_copertina=?, valuta=?, giorno_uscita=?, mese_uscita=?, anno_uscita=?, isbn=?, note=?, stato=?, storage_box=? WHERE id=?""", 
-                              (editore, formato, frequenza, colore, pagine, prezzo, valuta, giorno, mese, anno, isbn, note, stato, box, existing[0]))
-                    summary["updated"] += 1
-                    logs.append(f"🔄 Riga {line_num}: Aggiornato '{serie} n.{num_val}'")
-                else:
-                    c.execute("""INSERT INTO comics (serie, subserie, numero, variante, titolo, editore, formato, frequenza, colore, pagine, prezzo_copertina, valuta, giorno_uscita, mese_uscita, anno_uscita, codice, isbn, stato, storage_box, note) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", 
-                              (serie, subserie, num_val, variante, titolo, editore, formato, frequenza, colore, pagine, prezzo, valuta, giorno, mese, anno, codice, isbn, stato, box, note))
-                    summary["added"] += 1
-                    logs.append(f"✅ Riga {line_num}: Aggiunto '{serie} n.{num_val}'")
-            except Exception as e_row:
-                logs.append(f"⚠️ Riga {line_num}: Errore -> {str(e_row)}")
-        
-        conn.commit()
-        conn.close()
-        return True, summary["added"], summary["updated"], logs
-    except Exception as e: 
-        return False, 0, 0, [f"Errore critico: {str(e)}"]
-
-init_db()
-
 scelta = st.sidebar.radio("Vai a:", ["📚 Archivio", "📊 Statistiche", "➕ Aggiungi", "✏️ Modifica", "⚙️ Configurazione"])
+st.sidebar.toggle("⏱️ Profilo prestazioni", value=profilo_attivo, key="profilo_attivo")
+pannello_profilo = st.sidebar.container()
+if registro is not None: registro.etichetta = scelta
 
 # --- 1. ARCHIVIO ---
 if scelta == "📚 Archivio":
     st.title("📚 Archivio Fumetti")
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query(f"SELECT {', '.join(COLUMNS_ORDER)} FROM comics", conn)
-    conn.close()
-
-    if not df.empty:
-        df['numero'] = pd.to_numeric(df['numero'], errors='coerce').fillna(0).astype('Int64')
-        df['anno_uscita'] = pd.to_numeric(df['anno_uscita'], errors='coerce').fillna(2025).astype('Int64')
-        df['pagine'] = pd.to_numeric(df['pagine'], errors='coerce').fillna(0).astype('Int64')
-        df['giorno_uscita'] = pd.to_numeric(df['giorno_uscita'], errors='coerce').fillna(0).astype('Int64')
-        
-        df = df.sort_values(by=['serie', 'subserie', 'numero'], ascending=[True, True, True])
-
-        tot_albi = len(df)
-        in_stock = len(df[df['stato'] == 'stock'])
+    # Le modifiche dell'editor arrivano con il rerun che provocano: salvate prima di tutto il resto,
+    # così metriche e pagina le vedono subito e una pagina da rileggere non le perde
+    pagina = st.session_state.get("archivio_pagina")
+    if pagina and pagina["editor"] in st.session_state:
+        with profilo.sezione("archivio.salvataggio"):
+            if update_db_from_editor(pagina, st.session_state[pagina["editor"]]):
+                st.toast("✅ Database aggiornato!")
+    with profilo.sezione("archivio.metriche"):
+        tot_albi, in_stock, valore_euro = metriche()
+
+    if tot_albi > 0:
         percentuale_stock = (in_stock / tot_albi * 100) if tot_albi > 0 else 0
-        valore_euro = df[df['valuta'] == 'Euro']['prezzo_copertina'].sum()
 
         m1, m2, m3, m4 = st.columns(4)
         m1.metric("Totale Albi", tot_albi)
@@ -224,106 +148,142 @@ if scelta == "📚 Archivio":
         m4.metric("Valore Totale", f"€ {format_it_comma(valore_euro)}")
         
         st.markdown("---")
-        with st.expander("🔍 Filtri Avanzati", expanded=True):
+        with st.expander("🔍 Filtri Avanzati", expanded=True), profilo.sezione("archivio.filtri"):
             r1c1, r1c2, r1c3, r1c4 = st.columns(4)
             f_search = r1c1.text_input("Cerca testo...")
-            f_serie = r1c2.selectbox("Serie", ["Tutte"] + sorted(df['serie'].unique().tolist()))
+            f_serie = r1c2.selectbox("Serie", ["Tutte"] + valori_distinti('serie', vuoti=True))
             sub_opts = ["Tutte"]
-            if f_serie != "Tutte": sub_opts += sorted(df[df['serie'] == f_serie]['subserie'].unique().tolist())
-            else: sub_opts += sorted(df['subserie'].unique().tolist())
+            if f_serie != "Tutte": sub_opts += valori_distinti('subserie', FILTRI_PER_ID['serie'], (f_serie,), vuoti=True)
+            else: sub_opts += valori_distinti('subserie', vuoti=True)
             f_sub = r1c3.selectbox("Sub-serie", sub_opts)
-            f_form = r1c4.selectbox("Formato", ["Tutti"] + sorted([f for f in df['formato'].unique() if f]))
+            f_form = r1c4.selectbox("Formato", ["Tutti"] + valori_distinti('formato'))
 
             r2c1, r2c2, r2c3, r2c4 = st.columns(4)
             f_stat = r2c1.selectbox("Stato", ["Tutti", "stock", "wish list"])
-            f_box = r2c2.selectbox("Storage Box", ["Tutti"] + sorted([b for b in df['storage_box'].unique() if b]))
+            f_box = r2c2.selectbox("Storage Box", ["Tutti"] + valori_distinti('storage_box'))
             f_valuta = r2c3.selectbox("Valuta", ["Tutte"] + OPZIONI_VALUTA)
             f_mese = r2c4.selectbox("Mese", ["Tutti"] + MESI_OPZIONI)
 
             r3c1, r3c2, r3c3, r3c4 = st.columns(4)
-            f_anno = r3c1.selectbox("Anno", ["Tutti"] + sorted([int(a) for a in df['anno_uscita'].dropna().unique()], reverse=True))
-            f_freq = r3c2.selectbox("Frequenza", ["Tutte"] + sorted([x for x in df['frequenza'].unique() if x]))
+            f_anno = r3c1.selectbox("Anno", ["Tutti"] + sorted([int(a) for a in valori_distinti('anno_uscita')], reverse=True))
+            f_freq = r3c2.selectbox("Frequenza", ["Tutte"] + valori_distinti('frequenza'))
             f_col = r3c3.selectbox("Colore", ["Tutti"] + OPZIONI_COLORE)
-            pagine_presenti = sorted([int(p) for p in df['pagine'].dropna().unique()])
+            pagine_presenti = sorted({int(p) for p in valori_distinti('pagine')})
             f_pag = r3c4.selectbox("Pagine", ["Tutte"] + [str(p) for p in pagine_presenti])
 
-        filt_df = df.copy().reset_index(drop=True)
-        if f_search: filt_df = filt_df[filt_df.apply(lambda row: f_search.lower() in str(row).lower(), axis=1)]
-        if f_serie != "Tutte": filt_df = filt_df[filt_df['serie'] == f_serie]
-        if f_sub != "Tutte": filt_df = filt_df[filt_df['subserie'] == f_sub]
-        if f_form != "Tutti": filt_df = filt_df[filt_df['formato'] == f_form]
-        if f_stat != "Tutti": filt_df = filt_df[filt_df['stato'] == f_stat]
-        if f_box != "Tutti": filt_df = filt_df[filt_df['storage_box'] == f_box]
-        if f_valuta != "Tutte": filt_df = filt_df[filt_df['valuta'] == f_valuta]
-        if f_mese != "Tutti": filt_df = filt_df[filt_df['mese_uscita'] == f_mese]
-        if f_anno != "Tutti": filt_df = filt_df[filt_df['anno_uscita'] == int(f_anno)]
-        if f_freq != "Tutte": filt_df = filt_df[filt_df['frequenza'] == f_freq]
-        if f_col != "Tutti": filt_df = filt_df[filt_df['colore'] == f_col]
-        if f_pag != "Tutte": filt_df = filt_df[filt_df['pagine'] == int(f_pag)]
+            r4c1, _ = st.columns([1, 3])
+            # Vuoto = nessun filtro; un solo giorno scelto = da quel giorno in poi
+            f_date = r4c1.date_input("Uscita (dal - al)", value=(), min_value=date(1900, 1, 1),
+                                     max_value=date(2100, 12, 31), format="DD/MM/YYYY")
+
+        filtri = {}
+        if f_serie != "Tutte": filtri['serie'] = f_serie
+        if f_sub != "Tutte": filtri['subserie'] = f_sub
+        if f_form != "Tutti": filtri['formato'] = f_form
+        if f_stat != "Tutti": filtri['stato'] = f_stat
+        if f_box != "Tutti": filtri['storage_box'] = f_box
+        if f_valuta != "Tutte": filtri['valuta'] = f_valuta
+        if f_mese != "Tutti": filtri['mese_uscita'] = f_mese
+        if f_anno != "Tutti": filtri['anno_uscita'] = int(f_anno)
+        if f_freq != "Tutte": filtri['frequenza'] = f_freq
+        if f_col != "Tutti": filtri['colore'] = f_col
+        if f_pag != "Tutte": filtri['pagine'] = int(f_pag)
+        if f_date: filtri['data_uscita'] = intervallo_date(*f_date)
+        where, params = costruisci_filtro(filtri, f_search)
+
+        # Paginazione a cursore: si riparte dalla prima pagina quando cambiano i filtri
+        firma = (where, tuple(params))
+        if st.session_state.get("archivio_firma") != firma:
+            st.session_state["archivio_firma"] = firma
+            st.session_state["archivio_cursori"] = [None]
+        cursori = st.session_state["archivio_cursori"]
+
+        # La pagina resta in sessione finché filtri, cursore e versione dei dati non cambiano
+        chiave_pagina = (firma, cursori[-1])
+        if not pagina or pagina["chiave"] != chiave_pagina or pagina["versione"] != versione_dati():
+            n_letture = st.session_state.get("archivio_letture", 0) + 1
+            st.session_state["archivio_letture"] = n_letture
+            df_pag, succ = leggi_pagina(where, params, cursori[-1], testo=f_search)
+            pagina = {"chiave": chiave_pagina, "versione": versione_dati(), "df": df_pag, "successivo": succ,
+                      "editor": f"archivio_editor_{n_letture}", "applicate": {}}
+            st.session_state["archivio_pagina"] = pagina
+        filt_df, successivo = pagina["df"], pagina["successivo"]
+
+        p1, p2, p3 = st.columns([1, 4, 1])
+        if p1.button("◀ Precedente", disabled=len(cursori) == 1):
+            cursori.pop(); st.rerun()
+        p2.caption(f"Pagina {len(cursori)} · {conta(where, params)} albi trovati · {RIGHE_PAGINA} per pagina")
+        if p3.button("Successiva ▶", disabled=successivo is None):
+            cursori.append(successivo); st.rerun()
         
-        edited_data = st.data_editor(
-            filt_df, use_container_width=True, hide_index=True, height=600, key="archivio_editor",
-            column_config={
-                "id": st.column_config.Column("ID", width="small", disabled=True),
-                "numero": st.column_config.NumberColumn("N.", format="%d"),
-                "anno_uscita": st.column_config.NumberColumn("Anno", format="%d"),
-                "giorno_uscita": st.column_config.NumberColumn("Gg", format="%d"),
-                "pagine": st.column_config.NumberColumn("Pagine", format="%d"),
-                "prezzo_copertina": st.column_config.NumberColumn("Prezzo", format="%.2f"),
-                "valuta": st.column_config.SelectboxColumn("Valuta", options=OPZIONI_VALUTA),
-                "frequenza": st.column_config.SelectboxColumn("Frequenza", options=get_list_options('frequenza')),
-                "colore": st.column_config.SelectboxColumn("Colore", options=OPZIONI_COLORE),
-                "mese_uscita": st.column_config.SelectboxColumn("Mese", options=MESI_OPZIONI),
-                "stato": st.column_config.SelectboxColumn("Stato", options=["stock", "wish list"]),
-            }
-        )
-
-        if st.session_state["archivio_editor"]["edited_rows"]:
-            update_db_from_editor(filt_df, st.session_state["archivio_editor"])
-            st.toast("✅ Database aggiornato!")
-            st.rerun()
+        with profilo.sezione("archivio.data_editor"):
+            edited_data = st.data_editor(
+                filt_df, use_container_width=True, hide_index=True, height=600, key=pagina["editor"],
+                column_config={
+                    "id": st.column_config.Column("ID", width="small", disabled=True),
+                    "versione": None,
+                    "numero": st.column_config.NumberColumn("N.", format="%d"),
+                    "anno_uscita": st.column_config.NumberColumn("Anno", format="%d"),
+                    "giorno_uscita": st.column_config.NumberColumn("Gg", format="%d"),
+                    "pagine": st.column_config.NumberColumn("Pagine", format="%d"),
+                    "prezzo_copertina": st.column_config.NumberColumn("Prezzo", format="%.2f"),
+                    "valuta": st.column_config.SelectboxColumn("Valuta", options=OPZIONI_VALUTA),
+                    "frequenza": st.column_config.SelectboxColumn("Frequenza", options=get_list_options('frequenza')),
+                    "colore": st.column_config.SelectboxColumn("Colore", options=OPZIONI_COLORE),
+                    "mese_uscita": st.column_config.SelectboxColumn("Mese", options=MESI_OPZIONI),
+                    "stato": st.column_config.SelectboxColumn("Stato", options=["stock", "wish list"]),
+                }
+            )
+
     else: st.info("Archivio vuoto.")
 
 # --- 2. STATISTICHE ---
 elif scelta == "📊 Statistiche":
     st.title("📊 Statistiche Collezione")
-    conn = sqlite3.connect(DB_NAME)
-    df = pd.read_sql_query("SELECT serie, subserie, stato FROM comics", conn)
-    conn.close()
+    stats_serie = riepilogo_serie()
 
-    if not df.empty:
+    if not stats_serie.empty:
         # --- TABELLA PER SERIE ---
         st.subheader("📚 Riepilogo per Serie")
-        stats_serie = df.groupby('serie').agg(
-            Totale_Albi=('serie', 'count'),
-            In_Stock=('stato', lambda x: (x == 'stock').sum())
-        ).reset_index()
-        stats_serie['%_Completamento'] = (stats_serie['In_Stock'] / stats_serie['Totale_Albi'] * 100).round(1).astype(str) + '%'
-        st.dataframe(stats_serie.sort_values(by='Totale_Albi', ascending=False), use_container_width=True, hide_index=True)
+        st.dataframe(stats_serie, use_container_width=True, hide_index=True)
 
         st.markdown("---")
 
         # --- TABELLA PER SOTTOSERIE ---
         st.subheader("📑 Dettaglio per Sottoserie")
-        stats_sub = df.groupby(['serie', 'subserie']).agg(
-            Totale_Albi=('subserie', 'count'),
-            In_Stock=('stato', lambda x: (x == 'stock').sum())
-        ).reset_index()
-        stats_sub['%_Completamento'] = (stats_sub['In_Stock'] / stats_sub['Totale_Albi'] * 100).round(1).astype(str) + '%'
-        st.dataframe(stats_sub.sort_values(by=['serie', 'Totale_Albi'], ascending=[True, False]), use_container_width=True, hide_index=True)
+        st.dataframe(riepilogo_subserie(), use_container_width=True, hide_index=True)
+
+        st.markdown("---")
+
+        # --- NUMERI MANCANTI ---
+        st.subheader("🕳️ Numeri Mancanti")
+        c_m1, c_m2 = st.columns(2)
+        solo_stock = c_m1.checkbox("Conta come posseduti solo gli albi in stock", value=True)
+        mancanti = numeri_mancanti(solo_stock)
+        s_manc = c_m2.selectbox("Serie", ["Tutte"] + sorted(mancanti['serie'].unique().tolist()), key="serie_mancanti")
+        if s_manc != "Tutte": mancanti = mancanti[mancanti['serie'] == s_manc]
+        if mancanti.empty:
+            st.success("Nessun buco nella numerazione.")
+        else:
+            st.caption(f"{int(mancanti['mancanti'].sum())} numeri mancanti in {len(mancanti)} intervalli "
+                       "(tra il primo e l'ultimo numero presenti di ogni sottoserie)")
+            st.dataframe(mancanti, use_container_width=True, hide_index=True,
+                         column_config={"da": st.column_config.NumberColumn("Dal n.", format="%d"),
+                                        "a": st.column_config.NumberColumn("Al n.", format="%d"),
+                                        "mancanti": st.column_config.NumberColumn("Mancanti", format="%d")})
     else:
         st.info("Nessun dato disponibile per le statistiche.")
 
 # --- 3. AGGIUNGI ---
 elif scelta == "➕ Aggiungi":
     st.title("➕ Aggiungi Nuovo Albo")
-    conn = sqlite3.connect(DB_NAME); df_s = pd.read_sql_query("SELECT nome_serie FROM series ORDER BY nome_serie", conn); conn.close()
-    if df_s.empty: st.warning("Crea prima una Serie in Configurazione!")
+    serie_presenti = get_series_list()
+    if not serie_presenti: st.warning("Crea prima una Serie in Configurazione!")
     else:
         with st.form("add_form", clear_on_submit=True):
             c1, c2, c3 = st.columns(3)
-            s_sel = c1.selectbox("Serie", df_s['nome_serie'].tolist())
-            sub_sel = c2.selectbox("Sub-Serie", ["Nessuna"] + get_subseries_list(s_sel))
+            s_sel = c1.selectbox("Serie", serie_presenti)
+            sub_sel = c2.selectbox("Sub-Serie", ["Nessuna"] + [sub for sub in get_subseries_list(s_sel) if sub != "Nessuna"])
             box_in = c3.text_input("Storage Box")
             tit_in = st.text_input("Titolo")
             ca, cb, cc, cd = st.columns(4)
@@ -341,18 +301,20 @@ elif scelta == "➕ Aggiungi":
             cod_in = ci.text_input("Codice"); isbn_in = cl.text_input("ISBN"); st_in = cm.selectbox("Stato", ["stock", "wish list"])
             note_in = st.text_area("Note")
             if st.form_submit_button("🚀 Salva"):
-                conn = sqlite3.connect(DB_NAME); c = conn.cursor()
-                c.execute("""INSERT INTO comics (serie, subserie, numero, variante, titolo, editore, formato, frequenza, colore, pagine, prezzo_copertina, valuta, giorno_uscita, mese_uscita, anno_uscita, codice, isbn, stato, storage_box, note) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)""", (s_sel, sub_sel, int(n_in), v_in, tit_in, ed_in, form_in, freq_in, col_in, int(pag_in), pr_in, val_in, int(g_in), m_in, int(a_in), cod_in, isbn_in, st_in, box_in, note_in))
-                conn.commit(); conn.close(); st.success("Aggiunto!"); st.rerun()
+                aggiungi_albo({"serie": s_sel, "subserie": sub_sel, "numero": int(n_in), "variante": v_in, "titolo": tit_in,
+                               "editore": ed_in, "formato": form_in, "frequenza": freq_in, "colore": col_in, "pagine": int(pag_in),
+                               "prezzo_copertina": pr_in, "valuta": val_in, "giorno_uscita": int(g_in), "mese_uscita": m_in,
+                               "anno_uscita": int(a_in), "codice": cod_in, "isbn": isbn_in, "stato": st_in,
+                               "storage_box": box_in, "note": note_in})
+                st.success("Aggiunto!"); st.rerun()
 
 # --- 4. MODIFICA ---
 elif scelta == "✏️ Modifica":
     st.title("🗑️ Rimozione Record Singolo")
     id_del = st.number_input("Inserisci ID Record da eliminare", min_value=1, step=1)
     if st.button("🗑️ Elimina Definitivamente"):
-        conn = sqlite3.connect(DB_NAME); c = conn.cursor()
-        c.execute("DELETE FROM comics WHERE id=?", (id_del,))
-        conn.commit(); conn.close(); st.success("Record rimosso."); st.rerun()
+        elimina_albo(int(id_del))
+        st.success("Record rimosso."); st.rerun()
 
 # --- 5. CONFIGURAZIONE ---
 elif scelta == "⚙️ Configurazione":
@@ -362,45 +324,110 @@ elif scelta == "⚙️ Configurazione":
     c_bak1, c_bak2 = st.columns(2)
     with c_bak1:
         if os.path.exists(DB_NAME):
-            with open(DB_NAME, "rb") as f:
-                st.download_button(label="📥 Scarica Backup Database (.db)", data=f, file_name=f"comics_backup.db", mime="application/x-sqlite3")
+            comprimi = st.checkbox("Comprimi backup (gzip)", value=True)
+            nome_backup = f"comics_backup_{datetime.now():%Y%m%d_%H%M}.db" + (".gz" if comprimi else "")
+            # Lo snapshot viene creato solo al click, con l'API di backup di SQLite (nessun blocco per chi scrive)
+            st.download_button(label="📥 Scarica Backup Database", data=lambda: consegna_backup(crea_backup(comprimi)),
+                               file_name=nome_backup, mime="application/gzip" if comprimi else "application/x-sqlite3")
+            # Incrementale: solo le modifiche registrate nel giornale dall'ultimo backup
+            st.download_button(label="📥 Scarica Backup Incrementale", data=lambda: consegna_backup(crea_delta(comprimi)),
+                               file_name=f"comics_delta_{datetime.now():%Y%m%d_%H%M}.jsonl" + (".gz" if comprimi else ""),
+                               mime="application/gzip" if comprimi else "application/jsonl")
+            st.caption(f"{modifiche_in_sospeso()} modifiche dall'ultimo backup. "
+                       "Per ricostruire: `python -m comics replay BASE.db.gz DELTA... -o nuovo.db [--fino-a SEQ]`")
     with c_bak2:
-        restore_file = st.file_uploader("Carica un file .db per ripristinare", type=['db'])
+        restore_file = st.file_uploader("Carica un backup (.db o .db.gz) per ripristinare", type=['db', 'gz'])
         if restore_file is not None and st.button("🔄 Ripristina ora"):
-            with open(DB_NAME, "wb") as f: f.write(restore_file.getbuffer())
-            st.rerun()
+            try:
+                ripristina(restore_file)
+            except ValueError as e:
+                st.error(f"Ripristino annullato: {e}")
+            else:
+                st.rerun()
 
     st.markdown("---")
     st.subheader("📦 Import/Export CSV")
     c_imp1, c_imp2 = st.columns(2)
     with c_imp1:
-        df_mod = pd.DataFrame(columns=COLUMNS_ORDER[1:])
+        df_mod = pd.DataFrame(columns=COLONNE_EXPORT)
         st.download_button("📥 Scarica Modello CSV", df_mod.to_csv(index=False, sep=';').encode('utf-8'), "modello.csv", "text/csv")
+        if colonnare.disponibile():
+            # Collezione intera con i tipi (categorie, interi, prezzi decimali): generata al click, una volta per versione dei dati
+            for formato, estensione in colonnare.FORMATI.items():
+                st.download_button(f"📥 Esporta Collezione {formato.capitalize()}", data=lambda f=formato: esportazione(f),
+                                   file_name=f"collezione_{datetime.now():%Y%m%d_%H%M}{estensione}", mime=colonnare.MIME[formato])
     with c_imp2:
-        f_up = st.file_uploader("Carica file CSV", type=['csv'])
-        if f_up and st.button("🚀 Avvia Import"):
-            ok, n_add, n_up, log_entries = import_csv_logic(f_up)
-            if ok: 
-                st.success(f"Fatto! Aggiunti: {n_add} | Aggiornati: {n_up}")
-                with st.expander("📄 Log Operazioni (Verifica qui i tuoi record)", expanded=True):
-                    for entry in log_entries:
-                        if "✅" in entry: st.write(entry)
-                        elif "🔄" in entry: st.info(entry)
-                        else: st.error(entry)
+        tipi_import = ['csv'] + (['parquet', 'arrow', 'feather'] if colonnare.disponibile() else [])
+        with st.form("form_import", clear_on_submit=True):
+            f_up = st.file_uploader("Carica file CSV (o Parquet/Arrow)", type=tipi_import, accept_multiple_files=True)
+            avvia = st.form_submit_button("🚀 Avvia Import")
+        if avvia and f_up:
+            for precedente in st.session_state.pop("ultimo_import", (None, 0, 0, []))[3]:
+                if os.path.exists(precedente["log"]): os.remove(precedente["log"])
+            barra = st.progress(0.0, text=f"Import di {len(f_up)} file in corso...")
+            def aggiorna_barra(scritti, totali, righe, secondi, frazione):
+                barra.progress(frazione, text=f"{scritti}/{totali} file · {righe} righe · {righe / max(secondi, 1e-6):,.0f} righe/s")
+            st.session_state["ultimo_import"] = import_csv_multipli(f_up, aggiorna_barra)
+            barra.empty()
+
+        # Il risultato resta in sessione: il click su "Scarica Log" provoca un rerun
+        if "ultimo_import" in st.session_state:
+            ok, n_add, n_up, esiti = st.session_state["ultimo_import"]
+            riepilogo = f"{len(esiti)} file | Aggiunti: {n_add} | Aggiornati: {n_up}"
+            if ok: st.success(f"Fatto! {riepilogo}")
+            else: st.error(f"Errori in {sum(not e['ok'] for e in esiti)} file su {len(esiti)} | {riepilogo}")
+            for i, esito in enumerate(esiti):
+                if not os.path.exists(esito["log"]): continue
+                stato = "✅" if esito["ok"] else "❌"
+                with st.expander(f"{stato} {esito['file']}: +{esito['added']} · 🔄 {esito['updated']} · saltati {esito['skipped']}", expanded=not esito["ok"]):
+                    with open(esito["log"], "rb") as f_log:
+                        st.download_button("📄 Scarica Log Operazioni", f_log, file_name=f"log_import_{os.path.splitext(esito['file'])[0]}.txt", mime="text/plain", key=f"log_import_{i}")
+                    st.caption(f"Prime {RIGHE_ANTEPRIMA_LOG} righe")
+                    with open(esito["log"], encoding="utf-8") as f_log:
+                        for entry in itertools.islice(f_log, RIGHE_ANTEPRIMA_LOG):
+                            if "✅" in entry: st.write(entry)
+                            elif "🔄" in entry: st.info(entry)
+                            else: st.error(entry)
+
+    st.markdown("---")
+    st.subheader("🔗 Sincronizzazione con il Foglio")
+    try:
+        foglio_sync = foglio_sincronizzazione()
+    except ValueError as e:
+        foglio_sync = None
+        st.error(str(e))
+    if foglio_sync is None:
+        st.caption("Indica il foglio in `[sincronizzazione] foglio = ...` nei secrets (URL del foglio Google o file .csv/.db).")
+    else:
+        ultimo = ultimo_checkpoint(foglio_sync.nome)
+        if ultimo:
+            st.caption(f"Ultima sincronizzazione {datetime.fromtimestamp(ultimo['istante']):%d/%m/%Y %H:%M}: "
+                       f"inviate {ultimo['inviate']} · ricevute {ultimo['ricevute']} · conflitti {ultimo['conflitti']}")
+        vince = st.radio("Se un albo è cambiato sia qui sia nel foglio, vince:", ["archivio", "foglio"], horizontal=True)
+        if st.button("🔗 Sincronizza ora"):
+            try:
+                with st.spinner("Sincronizzazione in corso..."):
+                    esito = sincronizza(foglio_sync, vince)
+            except Exception as e:
+                st.error(f"Sincronizzazione non riuscita: {e}")
             else:
-                st.error("Errore fatale")
-                for e in log_entries: st.error(e)
+                st.success(f"Al foglio: {esito['inviate']} righe scritte, {esito['eliminate_foglio']} tolte | "
+                           f"Dal foglio: {esito['ricevute']} albi salvati, {esito['eliminate_archivio']} eliminati | "
+                           f"Conflitti: {esito['conflitti']} | Richieste al foglio: {esito['richieste']}")
+                if esito["scartate"]:
+                    st.warning(f"{esito['scartate']} righe del foglio senza serie non sono state importate.")
 
     st.markdown("---")
     st.subheader("🧹 Pulizia Dati")
-    conn = sqlite3.connect(DB_NAME); df_data = pd.read_sql_query("SELECT DISTINCT serie, subserie FROM comics", conn); conn.close()
+    df_data = coppie_serie_subserie()
     if not df_data.empty:
         col_del1, col_del2 = st.columns(2)
         with col_del1:
             s_to_clean = st.selectbox("Svuota Serie (tutti i fumetti):", ["-"] + sorted(df_data['serie'].unique().tolist()))
             confirm_s = st.text_input("Scrivi 'ELIMINA' per confermare (Serie):", key="conf_s")
             if s_to_clean != "-" and confirm_s == "ELIMINA" and st.button(f"🚨 ELIMINA RECORD SERIE: {s_to_clean}"):
-                conn = sqlite3.connect(DB_NAME); c = conn.cursor(); c.execute("DELETE FROM comics WHERE serie=?", (s_to_clean,)); conn.commit(); conn.close(); st.rerun()
+                svuota_serie(s_to_clean)
+                st.rerun()
         with col_del2:
             s_ref = st.selectbox("Scegli Serie per vedere sottoserie:", ["-"] + sorted(df_data['serie'].unique().tolist()), key="ref_sub_clean")
             if s_ref != "-":
@@ -408,34 +435,55 @@ elif scelta == "⚙️ Configurazione":
                 sub_to_clean = st.selectbox("Svuota Sottoserie:", ["-"] + sub_available)
                 confirm_sub = st.text_input("Scrivi 'ELIMINA' per confermare (Sottoserie):", key="conf_sub")
                 if sub_to_clean != "-" and confirm_sub == "ELIMINA" and st.button(f"🚨 ELIMINA RECORD SOTTOSERIE: {sub_to_clean}"):
-                    conn = sqlite3.connect(DB_NAME); c = conn.cursor(); c.execute("DELETE FROM comics WHERE serie=? AND subserie=?", (s_ref, sub_to_clean)); conn.commit(); conn.close(); st.rerun()
+                    svuota_serie(s_ref, sub_to_clean)
+                    st.rerun()
 
     st.markdown("---")
     st.subheader("🛠️ Gestione Liste e Menu")
     c1, c2 = st.columns(2)
     with c1:
         st.markdown("#### 📚 Serie e Sottoserie")
-        conn = sqlite3.connect(DB_NAME); df_series = pd.read_sql_query("SELECT id, nome_serie FROM series ORDER BY nome_serie", conn); conn.close()
         ns = st.text_input("Aggiungi Serie")
         if st.button("Aggiungi Serie"):
-            conn = sqlite3.connect(DB_NAME); c = conn.cursor()
-            try: c.execute("INSERT INTO series (nome_serie) VALUES (?)", (ns,)); conn.commit()
+            try:
+                aggiungi_serie(ns)
             except: st.error("Esiste già")
-            conn.close(); st.rerun()
-        s_target = st.selectbox("Seleziona Serie per Sottoserie:", ["-"] + df_series['nome_serie'].tolist())
+            st.rerun()
+        s_target = st.selectbox("Seleziona Serie per Sottoserie:", ["-"] + get_series_list())
         if s_target != "-":
             nss = st.text_input("Aggiungi Sottoserie")
             if st.button("Aggiungi Sottoserie"):
-                conn = sqlite3.connect(DB_NAME); c = conn.cursor()
-                s_id = df_series[df_series['nome_serie'] == s_target]['id'].values[0]
-                c.execute("INSERT INTO subseries (nome_subserie, serie_id) VALUES (?,?)", (nss, s_id)); conn.commit(); conn.close(); st.rerun()
+                try:
+                    aggiungi_subserie(s_target, nss)
+                except: st.error("Esiste già")
+                st.rerun()
     
     with c2:
         st.markdown("#### ⏳ Frequenza")
         f_add = st.text_input("Nuova Frequenza")
         if st.button("Salva Frequenza"):
-            conn = sqlite3.connect(DB_NAME); c = conn.cursor(); c.execute("INSERT OR IGNORE INTO list_options (tipo, valore) VALUES ('frequenza', ?)", (f_add,)); conn.commit(); conn.close(); st.rerun()
+            aggiungi_opzione('frequenza', f_add)
+            st.rerun()
+
+    st.markdown("---")
+    st.subheader("🔁 Riepiloghi Statistiche")
+    st.caption("I riepiloghi si aggiornano da soli a ogni modifica: ricalcolali solo dopo interventi manuali sul file .db.")
+    if st.button("🔁 Ricalcola Statistiche"):
+        ricostruisci(); st.success("Statistiche ricalcolate.")
 
     st.markdown("---")
     if st.button("🚨 RESET TOTALE DATABASE"):
-        if os.path.exists(DB_NAME): os.remove(DB_NAME); st.rerun()
\ No newline at end of file
+        elimina_database()
+        st.rerun()
+
+# --- PANNELLO PROFILO ---
+if registro is not None:
+    st.session_state.pop("profilo_registro", None)
+    profilo.attiva(None)
+    riepilogo = registro.riepilogo()
+    if PROFILO_LOG: profilo.scrivi_jsonl(PROFILO_LOG, riepilogo)
+    with pannello_profilo:
+        mostra_profilo(riepilogo, f"⏱️ Ultimo rerun · {riepilogo['secondi'] * 1000:.0f} ms")
+        if "profilo_interrotto" in st.session_state:
+            interrotto = st.session_state["profilo_interrotto"]
+            mostra_profilo(interrotto, f"⏹️ Rerun interrotto · {interrotto['secondi'] * 1000:.0f} ms")
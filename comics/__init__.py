@@ -0,0 +1,3 @@
+# --- NUCLEO DELLA COLLEZIONE ---
+# Database, import/export, statistiche e backup senza dipendenze da Streamlit:
+# app.py e fumetti.py sono solo viste, python -m comics è la riga di comando.
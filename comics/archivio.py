@@ -0,0 +1,357 @@
+import re
+import sqlite3
+
+import pandas as pd
+
+from .collezione import applica_schema_editor
+from .db import leggi_df, per_versione
+from .migrations import NOMI_COLONNE_COMICS
+from .profilo import cronometrato
+from .scrittore import esegui
+
+# --- QUERY ARCHIVIO ---
+RIGHE_PAGINA = 500
+
+# Colonne ammesse nei filtri (i nomi finiscono nell'SQL: mai accettarne altri)
+COLONNE_FILTRABILI = [
+    "serie", "subserie", "formato", "stato", "storage_box", "valuta",
+    "mese_uscita", "anno_uscita", "frequenza", "colore", "pagine", "data_uscita"
+]
+
+# Pesi bm25 nell'ordine di COLONNE_FTS: serie, subserie, titolo, editore, codice, isbn, note, storage_box
+PESI_FTS = "10.0, 5.0, 8.0, 2.0, 4.0, 4.0, 1.0, 1.0"
+
+# Ordinamento della tabella: nomi di serie e sottoserie, poi idx_comics_serie (+ rowid); usato anche come cursore
+CHIAVE_PAGINA = ["serie", "subserie", "numero", "id"]
+
+# La pagina porta con sé la versione di ogni riga: serve a salva_modifiche per riconoscere i conflitti
+COLONNE_PAGINA = NOMI_COLONNE_COMICS + ["versione"]
+
+
+# Nomi di serie e sottoserie risolti senza distinzione di maiuscole, come nell'import (indici
+# idx_series_lower e idx_subseries_lower): tra nomi che differiscono solo per le maiuscole vale il primo
+SERIE_PER_NOME = "(SELECT MIN(id) FROM series WHERE lower(nome_serie) = lower(?))"
+SUBSERIE_PER_NOME = "(SELECT MIN(id) FROM subseries WHERE serie_id = ? AND lower(nome_subserie) = lower(?))"
+
+# Serie e sottoserie si filtrano per id: il nome viene risolto una volta sola dalla sottoquery
+# (un nome di sottoserie può esistere sotto più serie)
+FILTRI_PER_ID = {
+    "serie": f"comics.serie_id = {SERIE_PER_NOME}",
+    "subserie": """(comics.serie_id, comics.subserie_id) IN (SELECT serie_id, MIN(id) FROM subseries
+                                                              WHERE lower(nome_subserie) = lower(?) GROUP BY serie_id)""",
+}
+
+# Oltre queste righe filtrate conviene leggere già in ordine da vista_comics_ordinata e fermarsi alla
+# pagina; sotto, meglio partire dagli indici del filtro e ordinare i pochi risultati (vista_comics)
+SOGLIA_LETTURA_ORDINATA = 5000
+
+
+def espressione_fts(testo):
+    """Trasforma il testo cercato in una query FTS5: tutti i termini, ciascuno anche come prefisso."""
+    termini = re.findall(r"\w+", testo)
+    return " ".join(f'"{t}"*' for t in termini)
+
+
+def intervallo_date(da=None, a=None):
+    """Limiti (da, a) su data_uscita (AAAAMMGG) per due datetime.date, None = senza limite.
+
+    Un intervallo che parte dal primo del mese comprende anche gli albi con solo mese e anno;
+    dal primo gennaio anche quelli con il solo anno.
+    """
+    inizio = fine = None
+    if da is not None:
+        mese = 0 if (da.month, da.day) == (1, 1) else da.month
+        inizio = da.year * 10000 + mese * 100 + (0 if da.day == 1 else da.day)
+    if a is not None:
+        fine = a.year * 10000 + a.month * 100 + a.day
+    return inizio, fine
+
+
+def costruisci_filtro(filtri, testo=""):
+    """Traduce i filtri attivi e il testo cercato in una clausola WHERE parametrica.
+
+    filtri: {colonna: valore} per l'uguaglianza, {colonna: (da, a)} per un intervallo (estremi inclusi, None = aperto).
+    """
+    condizioni, params = [], []
+    for col, valore in filtri.items():
+        if col not in COLONNE_FILTRABILI:
+            raise ValueError(f"Colonna non filtrabile: {col}")
+        if isinstance(valore, tuple):
+            for operatore, limite in zip((">=", "<="), valore):
+                if limite is not None:
+                    condizioni.append(f"comics.{col} {operatore} ?")
+                    params.append(limite)
+            continue
+        if col in FILTRI_PER_ID:
+            condizioni.append(FILTRI_PER_ID[col])
+        else:
+            condizioni.append(f"comics.{col} = ?")
+        params.append(valore)
+    fts = espressione_fts(testo)
+    if fts:
+        condizioni.append("comics.id IN (SELECT rowid FROM comics_fts WHERE comics_fts MATCH ?)")
+        params.append(fts)
+    return " AND ".join(condizioni) or "1", params
+
+
+def _scalare(valore):
+    # sqlite3 non sa legare gli scalari numpy
+    return valore.item() if hasattr(valore, "item") else valore
+
+
+def _vista_per_filtro(where, params):
+    if where == "1":
+        return "vista_comics_ordinata"
+    # Conteggio limitato alla soglia: costa al massimo SOGLIA_LETTURA_ORDINATA righe d'indice
+    n = leggi_df(f"SELECT COUNT(*) AS n FROM (SELECT 1 FROM comics WHERE {where} LIMIT ?)",
+                 list(params) + [SOGLIA_LETTURA_ORDINATA])['n'].iloc[0]
+    return "vista_comics_ordinata" if n >= SOGLIA_LETTURA_ORDINATA else "vista_comics"
+
+
+@cronometrato
+def leggi_pagina(where, params, cursore=None, limite=RIGHE_PAGINA, testo=""):
+    """Legge una pagina partendo dopo il cursore.
+
+    Senza testo l'ordine è (serie, subserie, numero, id); con un testo cercato i risultati sono ordinati per rilevanza bm25 e il cursore diventa (punteggio, id).
+    Restituisce il DataFrame della pagina e il cursore della pagina successiva (None se è l'ultima).
+    """
+    colonne = ", ".join(f"comics.{col}" for col in COLONNE_PAGINA)
+    params = list(params)
+    fts = espressione_fts(testo)
+    if fts:
+        chiave = ["punteggio", "id"]
+        sql = f"""SELECT * FROM (SELECT {colonne}, bm25(comics_fts, {PESI_FTS}) AS punteggio
+                                 FROM comics_fts JOIN vista_comics AS comics ON comics.id = comics_fts.rowid
+                                 WHERE comics_fts MATCH ? AND ({where})) WHERE 1"""
+        params = [fts] + params
+    else:
+        chiave = CHIAVE_PAGINA
+        sql = f"SELECT {colonne} FROM {_vista_per_filtro(where, params)} AS comics WHERE ({where})"
+    if cursore is not None:
+        sql += f" AND ({', '.join(chiave)}) > ({', '.join('?' * len(chiave))})"
+        params += list(cursore)
+    sql += f" ORDER BY {', '.join(chiave)} LIMIT ?"
+    df = leggi_df(sql, params + [limite + 1])
+
+    successivo = None
+    if len(df) > limite:
+        df = df.iloc[:limite]
+        successivo = tuple(_scalare(v) for v in df.iloc[-1][chiave])
+    df = applica_schema_editor(df[COLONNE_PAGINA])
+    return df.reset_index(drop=True), successivo
+
+
+# --- SCRITTURA DALL'EDITOR ---
+# Tutte le scritture passano dallo scrittore unico (scrittore.py): le funzioni _ qui sotto girano nel
+# suo thread, dentro la transazione del gruppo.
+COLONNE_MODIFICABILI = [col for col in NOMI_COLONNE_COMICS if col != "id"]
+
+# Colonne del cursore di pagina: un NULL farebbe sparire la riga dalla paginazione
+VUOTI_AMMESSI = {"subserie": "", "numero": 0}
+
+
+def _id_serie(conn, nome):
+    """Id della serie con questo nome (maiuscole ignorate), creata se non esiste ancora."""
+    serie_id = conn.execute(f"SELECT {SERIE_PER_NOME}", (nome,)).fetchone()[0]
+    if serie_id is None:
+        serie_id = conn.execute("INSERT INTO series (nome_serie) VALUES (?)", (nome,)).lastrowid
+    return serie_id
+
+
+def _id_subserie(conn, serie_id, nome):
+    subserie_id = conn.execute(f"SELECT {SUBSERIE_PER_NOME}", (serie_id, nome)).fetchone()[0]
+    if subserie_id is None:
+        subserie_id = conn.execute("INSERT INTO subseries (serie_id, nome_subserie) VALUES (?, ?)",
+                                   (serie_id, nome)).lastrowid
+    return subserie_id
+
+
+def _con_id(conn, valori, serie="", subserie=""):
+    """valori con i nomi di serie e sottoserie sostituiti dai loro id; serie e subserie: i nomi attuali della riga."""
+    valori = dict(valori)
+    serie_id = _id_serie(conn, valori.pop("serie", serie))
+    valori["serie_id"] = serie_id
+    valori["subserie_id"] = _id_subserie(conn, serie_id, valori.pop("subserie", subserie))
+    return valori
+
+
+def _aggiorna_righe(conn, righe):
+    """righe: [(id, versione letta, {colonna: valore})]. Aggiorna solo le righe ancora a quella versione.
+
+    Restituisce gli id non aggiornati perché cambiati (o eliminati) da altri nel frattempo.
+    """
+    conflitti = []
+    for record_id, versione, valori in righe:
+        if "serie" in valori or "subserie" in valori:
+            attuale = conn.execute("SELECT serie, subserie FROM vista_comics WHERE id = ? AND versione = ?",
+                                   (record_id, versione)).fetchone()
+            if attuale is None:
+                conflitti.append(record_id)
+                continue
+            valori = _con_id(conn, valori, *attuale)
+        assegnazioni = ", ".join(f"{col} = ?" for col in valori)
+        cur = conn.execute(f"UPDATE comics SET {assegnazioni}, versione = versione + 1 WHERE id = ? AND versione = ?",
+                           (*valori.values(), record_id, versione))
+        if cur.rowcount == 0:
+            conflitti.append(record_id)
+    return conflitti
+
+
+@cronometrato
+def salva_modifiche(df_pagina, modifiche):
+    """Scrive le celle modificate {posizione: {colonna: valore}} tramite lo scrittore unico, in un'unica transazione.
+
+    Ogni riga è aggiornata solo se la sua versione è ancora quella letta con la pagina: le righe
+    cambiate da altri nel frattempo non vengono toccate. Le righe scritte sono aggiornate sul posto
+    nel DataFrame della pagina, senza rileggerlo. Restituisce (righe scritte, id in conflitto).
+    """
+    righe, patch = [], {}
+    for posizione, valori in modifiche.items():
+        non_valide = [col for col in valori if col not in COLONNE_MODIFICABILI]
+        if non_valide:
+            raise ValueError(f"Colonne non modificabili: {non_valide}")
+        if "serie" in valori and not valori["serie"]:
+            raise ValueError("La serie non può essere vuota")
+        # Colonne ordinate: righe con le stesse colonne riusano lo statement in cache
+        valori = {col: VUOTI_AMMESSI[col] if valori[col] is None and col in VUOTI_AMMESSI else valori[col]
+                  for col in sorted(valori)}
+        record_id = int(df_pagina['id'].iloc[int(posizione)])
+        righe.append((record_id, int(df_pagina['versione'].iloc[int(posizione)]), valori))
+        patch[record_id] = (int(posizione), valori)
+    if not righe:
+        return 0, []
+
+    conflitti = esegui(_aggiorna_righe, righe)
+    for record_id in conflitti:
+        del patch[record_id]
+    for posizione, valori in patch.values():
+        for col, v in valori.items():
+            df_pagina.iat[posizione, df_pagina.columns.get_loc(col)] = pd.NA if v is None else v
+        df_pagina.iat[posizione, df_pagina.columns.get_loc('versione')] += 1
+    return len(patch), conflitti
+
+
+def _inserisci_albo(conn, valori):
+    valori = _con_id(conn, valori)
+    colonne = list(valori)
+    return conn.execute(f"INSERT INTO comics ({', '.join(colonne)}) VALUES ({', '.join('?' * len(colonne))})",
+                        [valori[col] for col in colonne]).lastrowid
+
+
+def aggiungi_albo(valori):
+    """Inserisce un albo {colonna: valore} e ne restituisce l'id."""
+    non_valide = [col for col in valori if col not in COLONNE_MODIFICABILI]
+    if non_valide:
+        raise ValueError(f"Colonne non valide: {non_valide}")
+    if not valori.get("serie"):
+        raise ValueError("La serie non può essere vuota")
+    return esegui(_inserisci_albo, valori)
+
+
+def _elimina(conn, sql, params):
+    return conn.execute(sql, params).rowcount
+
+
+def elimina_albo(record_id):
+    return esegui(_elimina, "DELETE FROM comics WHERE id = ?", (record_id,))
+
+
+def svuota_serie(serie, subserie=None):
+    """Elimina tutti gli albi di una serie (o di una sua sottoserie). Restituisce quanti ne ha tolti.
+
+    Serie e sottoserie restano in series e subseries: la cancellazione è per id.
+    """
+    if subserie is None:
+        return esegui(_elimina, f"DELETE FROM comics WHERE serie_id = {SERIE_PER_NOME}", (serie,))
+    return esegui(_elimina, f"""DELETE FROM comics
+                                WHERE serie_id = {SERIE_PER_NOME}
+                                  AND subserie_id = (SELECT MIN(id) FROM subseries
+                                                     WHERE serie_id = {SERIE_PER_NOME}
+                                                       AND lower(nome_subserie) = lower(?))""",
+                  (serie, serie, subserie))
+
+
+@cronometrato
+def conta(where, params):
+    return int(leggi_df(f"SELECT COUNT(*) AS n FROM comics WHERE {where}", params)['n'].iloc[0])
+
+
+@per_versione
+def metriche():
+    """Totale albi, albi in stock e valore di copertina in euro, dai riepiloghi per serie."""
+    res = leggi_df("""SELECT IFNULL(SUM(totale), 0) AS tot_albi,
+                             IFNULL(SUM(in_stock), 0) AS in_stock,
+                             TOTAL(valore_euro) AS valore_euro
+                      FROM stat_serie""")
+    riga = res.iloc[0]
+    return int(riga['tot_albi']), int(riga['in_stock']), float(riga['valore_euro'])
+
+
+@per_versione
+def valori_distinti(col, where="1", params=(), vuoti=False):
+    """Valori distinti e ordinati di una colonna: alimentano le selectbox dei filtri."""
+    if col not in COLONNE_FILTRABILI:
+        raise ValueError(f"Colonna non filtrabile: {col}")
+    escludi = "" if vuoti else f" AND {col} != ''"
+    df = leggi_df(f"""SELECT DISTINCT {col} AS v FROM vista_comics AS comics
+                      WHERE ({where}) AND {col} IS NOT NULL{escludi} ORDER BY v""", params)
+    return [_scalare(v) for v in df['v']]
+
+
+# --- LISTE E OPZIONI ---
+@per_versione
+def get_list_options(tipo):
+    res = leggi_df("SELECT valore FROM list_options WHERE tipo = ? ORDER BY valore", (tipo,))
+    return res['valore'].tolist()
+
+
+@per_versione
+def get_series_list():
+    return leggi_df("SELECT nome_serie FROM series ORDER BY nome_serie")['nome_serie'].tolist()
+
+
+@per_versione
+def get_subseries_list(serie_nome):
+    query = f"SELECT nome_subserie FROM subseries WHERE serie_id = {SERIE_PER_NOME} ORDER BY nome_subserie"
+    df = leggi_df(query, (serie_nome,))
+    return df['nome_subserie'].tolist()
+
+
+@per_versione
+def coppie_serie_subserie():
+    """Coppie (serie, subserie) presenti in comics (dal riepilogo per sottoserie): alimentano la pulizia dati."""
+    return leggi_df("""SELECT s.nome_serie AS serie, ss.nome_subserie AS subserie FROM stat_subserie st
+                       JOIN series s ON s.id = st.serie_id JOIN subseries ss ON ss.id = st.subserie_id""")
+
+
+def _inserisci_serie(conn, nome):
+    if conn.execute(f"SELECT {SERIE_PER_NOME}", (nome,)).fetchone()[0] is not None:
+        raise sqlite3.IntegrityError(f"Serie già presente: {nome}")
+    conn.execute("INSERT INTO series (nome_serie) VALUES (?)", (nome,))
+
+
+def aggiungi_serie(nome):
+    """Solleva sqlite3.IntegrityError se la serie esiste già (anche con altre maiuscole)."""
+    esegui(_inserisci_serie, nome)
+
+
+def _inserisci_subserie(conn, serie_nome, nome):
+    serie_id = conn.execute(f"SELECT {SERIE_PER_NOME}", (serie_nome,)).fetchone()[0]
+    if serie_id is None:
+        raise ValueError(f"Serie sconosciuta: {serie_nome}")
+    if conn.execute(f"SELECT {SUBSERIE_PER_NOME}", (serie_id, nome)).fetchone()[0] is not None:
+        raise sqlite3.IntegrityError(f"Sottoserie già presente: {nome}")
+    conn.execute("INSERT INTO subseries (nome_subserie, serie_id) VALUES (?,?)", (nome, serie_id))
+
+
+def aggiungi_subserie(serie_nome, nome):
+    """Solleva sqlite3.IntegrityError se la serie ha già quella sottoserie (anche con altre maiuscole)."""
+    esegui(_inserisci_subserie, serie_nome, nome)
+
+
+def _inserisci_opzione(conn, tipo, valore):
+    conn.execute("INSERT OR IGNORE INTO list_options (tipo, valore) VALUES (?, ?)", (tipo, valore))
+
+
+def aggiungi_opzione(tipo, valore):
+    esegui(_inserisci_opzione, tipo, valore)
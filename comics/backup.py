@@ -0,0 +1,318 @@
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+
+from . import db
+from .db import chiudi_connessioni, connessione
+from .migrations import ADESSO, TABELLE_GIORNALE, VERSIONE_SCHEMA, migra, versione
+from .profilo import cronometrato
+from .scrittore import esegui, esegui_esclusiva
+
+# --- BACKUP ONLINE ---
+# La copia passa dall'API di backup di SQLite a passi di poche pagine, dentro una transazione di
+# lettura: in WAL gli scrittori non vengono bloccati e il file copiato è sempre uno snapshot coerente.
+PAGINE_PER_PASSO = 256
+PAUSA_PASSO = 0.001         # secondi ceduti agli altri thread tra un passo e l'altro
+BLOCCO = 1024 * 1024        # byte letti/scritti per volta nelle copie di file
+FIRMA_GZIP = b"\x1f\x8b"
+LIVELLO_GZIP = 6            # il 9 predefinito costa molto più tempo per pochi punti di compressione
+
+
+def _temporaneo(suffisso):
+    # Nella stessa cartella del db: os.replace resta un rename atomico
+    cartella = os.path.dirname(os.path.abspath(db.DB_NAME))
+    fd, percorso = tempfile.mkstemp(prefix="comics_", suffix=suffisso, dir=cartella)
+    os.close(fd)
+    return percorso
+
+
+@cronometrato
+def snapshot(destinazione, progresso=None):
+    """Copia il database aperto in destinazione (percorso di un file .db) senza fermare le scritture.
+
+    progresso(copiate, totali) viene chiamata dopo ogni passo.
+    Restituisce l'ultima voce del giornale compresa nello snapshot.
+    """
+    def passo(_stato, rimanenti, totali):
+        if progresso:
+            progresso(totali - rimanenti, totali)
+        time.sleep(PAUSA_PASSO)
+
+    dest = sqlite3.connect(destinazione)
+    try:
+        with connessione() as conn:
+            # La transazione di lettura fissa lo snapshot WAL per tutti i passi del backup
+            conn.execute("BEGIN")
+            seq = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM giornale").fetchone()[0]
+            conn.backup(dest, pages=PAGINE_PER_PASSO, progress=passo)
+        # Il backup eredita journal_mode=WAL: un file unico è più comodo da scaricare e ripristinare
+        dest.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        dest.close()
+    return seq
+
+
+def _inserisci_checkpoint(conn, seq, tipo):
+    conn.execute(f"INSERT INTO checkpoint_backup (seq, tipo, istante) VALUES (?, ?, {ADESSO})", (seq, tipo))
+
+
+def _segna_checkpoint(seq, tipo):
+    esegui(_inserisci_checkpoint, seq, tipo)
+
+
+class FileBackup:
+    """Backup pronto per il download: si legge come un file binario aperto, posizionato all'inizio.
+
+    Il checkpoint da cui parte il prossimo backup incrementale si registra solo con conferma(),
+    quando il contenuto è stato salvato per intero: un backup perso o interrotto non fa saltare
+    le sue modifiche al delta successivo.
+    """
+
+    def __init__(self, f, seq, tipo):
+        self._f = f
+        self.seq = seq
+        self.tipo = tipo
+
+    def __getattr__(self, nome):
+        return getattr(self._f, nome)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self._f.close()
+
+    def conferma(self):
+        """Registra il checkpoint del backup (una volta sola; niente per un delta vuoto)."""
+        if self.seq is not None:
+            _segna_checkpoint(self.seq, self.tipo)
+            self.seq = None
+
+
+def crea_backup(comprimi=False, progresso=None):
+    """Backup completo in un FileBackup anonimo (cancellato alla chiusura); con comprimi=True il contenuto è gzip.
+
+    Confermato, lo snapshot diventa il punto di partenza del prossimo backup incrementale.
+    """
+    percorso = _temporaneo(".db")
+    try:
+        seq = snapshot(percorso, progresso)
+        if not comprimi:
+            return FileBackup(open(percorso, "rb"), seq, "completo")
+        out = tempfile.TemporaryFile()
+        with open(percorso, "rb") as src, gzip.GzipFile(fileobj=out, mode="wb", compresslevel=LIVELLO_GZIP) as gz:
+            shutil.copyfileobj(src, gz, BLOCCO)
+        out.seek(0)
+        return FileBackup(out, seq, "completo")
+    finally:
+        # Su POSIX un file già aperto resta leggibile anche dopo la cancellazione
+        os.remove(percorso)
+
+
+# --- RIPRISTINO VALIDATO ---
+def _scrivi_caricato(sorgente, percorso):
+    sorgente.seek(0)
+    testa = sorgente.read(len(FIRMA_GZIP))
+    sorgente.seek(0)
+    with open(percorso, "wb") as out:
+        if testa == FIRMA_GZIP:
+            with gzip.GzipFile(fileobj=sorgente, mode="rb") as gz:
+                shutil.copyfileobj(gz, out, BLOCCO)
+        else:
+            shutil.copyfileobj(sorgente, out, BLOCCO)
+
+
+def _valida(percorso):
+    conn = sqlite3.connect(percorso)
+    try:
+        esito = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+        if esito != ["ok"]:
+            raise ValueError(f"Controllo di integrità fallito: {'; '.join(esito[:5])}")
+        tabelle = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        if "comics" not in tabelle:
+            raise ValueError("Il file non contiene la tabella comics.")
+        if versione(conn) > VERSIONE_SCHEMA:
+            raise ValueError("Il backup proviene da una versione più recente dell'app.")
+        migra(conn)
+        conn.execute("PRAGMA journal_mode=DELETE")
+    except sqlite3.DatabaseError as e:
+        raise ValueError(f"File non valido: {e}") from e
+    finally:
+        conn.close()
+
+
+def _sostituisci(percorso):
+    chiudi_connessioni()
+    # Il vecchio -wal non deve finire applicato al nuovo file
+    if os.path.exists(db.DB_NAME):
+        conn = sqlite3.connect(db.DB_NAME)
+        try:
+            conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            conn.close()
+    for f_wal in (db.DB_NAME + "-wal", db.DB_NAME + "-shm"):
+        if os.path.exists(f_wal):
+            os.remove(f_wal)
+    os.replace(percorso, db.DB_NAME)
+
+
+def ripristina(sorgente):
+    """Sostituisce il database con il backup caricato (.db o .db.gz).
+
+    Il file viene scritto a parte, controllato con integrity_check e migrato all'ultimo schema;
+    solo allora prende il posto del db corrente con un rename atomico.
+    Se il file non è valido solleva ValueError e il db corrente resta intatto.
+    """
+    percorso = _temporaneo(".db")
+    try:
+        try:
+            _scrivi_caricato(sorgente, percorso)
+        except (OSError, EOFError) as e:
+            raise ValueError(f"File non leggibile: {e}") from e
+        _valida(percorso)
+        # Nel thread scrittore, tra un gruppo e l'altro: nessuna scrittura a metà sul file sostituito
+        esegui_esclusiva(_sostituisci, percorso)
+    finally:
+        if os.path.exists(percorso):
+            os.remove(percorso)
+
+
+# --- BACKUP INCREMENTALI ---
+# Un delta è un file JSON Lines (eventualmente gzip): un'intestazione {"da", "a", "schema"} e poi
+# le voci del giornale con seq in (da, a], nell'ordine in cui sono state scritte.
+def ultimo_checkpoint():
+    with connessione() as conn:
+        return conn.execute("SELECT IFNULL(MAX(seq), 0) FROM checkpoint_backup").fetchone()[0]
+
+
+def modifiche_in_sospeso():
+    """Voci del giornale non ancora coperte da un backup (completo o incrementale)."""
+    with connessione() as conn:
+        return conn.execute("""SELECT COUNT(*) FROM giornale
+                               WHERE seq > (SELECT IFNULL(MAX(seq), 0) FROM checkpoint_backup)""").fetchone()[0]
+
+
+def crea_delta(comprimi=True):
+    """Backup incrementale: le voci del giornale dall'ultimo checkpoint, in un FileBackup anonimo.
+
+    Finché non viene confermato, il delta successivo riparte dallo stesso checkpoint.
+    """
+    da = ultimo_checkpoint()
+    out = tempfile.TemporaryFile()
+    grezzo = gzip.GzipFile(fileobj=out, mode="wb", compresslevel=LIVELLO_GZIP) if comprimi else out
+    testo = io.TextIOWrapper(grezzo, encoding="utf-8")
+    with connessione() as conn:
+        # Intestazione e voci dallo stesso snapshot di lettura
+        conn.execute("BEGIN")
+        a = conn.execute("SELECT IFNULL(MAX(seq), ?) FROM giornale", (da,)).fetchone()[0]
+        testo.write(json.dumps({"da": da, "a": a, "schema": VERSIONE_SCHEMA}) + "\n")
+        voci = conn.execute("""SELECT seq, tabella, operazione, riga, dati, istante FROM giornale
+                               WHERE seq > ? AND seq <= ? ORDER BY seq""", (da, a))
+        for seq, tabella, operazione, riga, dati, istante in voci:
+            testo.write(json.dumps({"seq": seq, "tabella": tabella, "operazione": operazione, "riga": riga,
+                                    "dati": json.loads(dati), "istante": istante}, ensure_ascii=False) + "\n")
+    testo.detach()
+    if comprimi:
+        grezzo.close()
+    out.seek(0)
+    return FileBackup(out, a if a > da else None, "incrementale")
+
+
+def _pota(conn, fino_a):
+    completo = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM checkpoint_backup WHERE tipo = 'completo'").fetchone()[0]
+    if fino_a > completo:
+        raise ValueError(f"Le voci fino a {fino_a} non sono in un backup completo (l'ultimo arriva a {completo}).")
+    # Restano l'ultima voce (il MAX(seq) da cui riapplica riconosce il punto di partenza di una base)
+    # e quelle che la sincronizzazione di un foglio non ha ancora visto
+    return conn.execute("""DELETE FROM giornale
+                           WHERE seq <= ? AND seq < (SELECT MAX(seq) FROM giornale)
+                             AND seq <= (SELECT IFNULL(MIN(seq), ?)
+                                         FROM (SELECT MAX(seq) AS seq FROM checkpoint_foglio GROUP BY foglio))""",
+                        (fino_a, fino_a)).rowcount
+
+
+def pota_giornale(fino_a):
+    """Toglie dal giornale le voci fino a fino_a, già coperte da un backup completo confermato e verificato.
+
+    Manutenzione esplicita: il giornale è l'unica traccia per recuperare cancellazioni accidentali,
+    non viene mai accorciato da solo. Restituisce le voci tolte.
+    """
+    return esegui(_pota, fino_a)
+
+
+def _leggi_delta(percorso):
+    with open(percorso, "rb") as f:
+        compresso = f.read(len(FIRMA_GZIP)) == FIRMA_GZIP
+    grezzo = gzip.open(percorso, "rb") if compresso else open(percorso, "rb")
+    return io.TextIOWrapper(grezzo, encoding="utf-8")
+
+
+def _applica_voce(conn, voce, colonne):
+    tabella, operazione, riga, dati = voce["tabella"], voce["operazione"], voce["riga"], voce["dati"]
+    if tabella not in TABELLE_GIORNALE or not set(dati) <= colonne[tabella]:
+        raise ValueError(f"Voce {voce['seq']} non valida per questo schema.")
+    if operazione == "I":
+        cur = conn.execute(f"INSERT INTO {tabella} ({', '.join(dati)}) VALUES ({', '.join('?' * len(dati))})",
+                           list(dati.values()))
+    elif operazione == "U":
+        assegnazioni = ", ".join(f"{col} = ?" for col in dati)
+        cur = conn.execute(f"UPDATE {tabella} SET {assegnazioni} WHERE id = ?", list(dati.values()) + [riga])
+    else:
+        cur = conn.execute(f"DELETE FROM {tabella} WHERE id = ?", (riga,))
+    if cur.rowcount != 1:
+        raise ValueError(f"Voce {voce['seq']} non coerente con la base: riga {tabella} {riga}.")
+
+
+def riapplica(base, delta, destinazione, fino_a=None):
+    """Ricostruisce in destinazione il database: lo snapshot base (.db o .db.gz) più i delta in ordine.
+
+    Con fino_a si ferma alla voce del giornale indicata (es. subito prima di una cancellazione).
+    Restituisce il numero di voci applicate.
+    """
+    if os.path.abspath(destinazione) == os.path.abspath(db.DB_NAME):
+        raise ValueError("La destinazione non può essere il database in uso: usa ripristina sul file ricostruito.")
+    with open(base, "rb") as f:
+        _scrivi_caricato(f, destinazione)
+    _valida(destinazione)
+    # File nuovo che nessuna sessione usa: connessione e transazione proprie, fuori dallo scrittore unico
+    conn = sqlite3.connect(destinazione)
+    file_delta = []
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        corrente = inizio = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM giornale").fetchone()[0]
+        colonne = {t: {r[1] for r in conn.execute(f"PRAGMA table_info({t})")} for t in TABELLE_GIORNALE}
+        file_delta.extend(_leggi_delta(p) for p in delta)
+        intestazioni = [json.loads(f.readline()) for f in file_delta]
+        applicate = []
+        for intestazione, f in sorted(zip(intestazioni, file_delta), key=lambda x: x[0]["da"]):
+            if intestazione["da"] > corrente:
+                raise ValueError(f"Manca il delta con le voci da {corrente + 1} a {intestazione['da']}.")
+            for linea in f:
+                voce = json.loads(linea)
+                if voce["seq"] <= corrente:
+                    continue
+                if fino_a is not None and voce["seq"] > fino_a:
+                    break
+                _applica_voce(conn, voce, colonne)
+                applicate.append(voce)
+                corrente = voce["seq"]
+        # I trigger hanno registrato le voci con nuovi seq: il giornale riprende quello originale
+        conn.execute("DELETE FROM giornale WHERE seq > ?", (inizio,))
+        conn.executemany("INSERT INTO giornale (seq, tabella, operazione, riga, dati, istante) VALUES (?, ?, ?, ?, ?, ?)",
+                         [(v["seq"], v["tabella"], v["operazione"], v["riga"],
+                           json.dumps(v["dati"], ensure_ascii=False), v["istante"]) for v in applicate])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        for f in file_delta:
+            f.close()
+        conn.close()
+    return len(applicate)
+
@@ -0,0 +1,269 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import colonnare, db
+from .archivio import COLONNE_FILTRABILI, conta, costruisci_filtro, leggi_pagina, salva_modifiche, valori_distinti
+from .backup import crea_backup, crea_delta
+from .collezione import MESI_OPZIONI, aggiungi_chiave_ricerca, applica_schema, maschera_testo
+from .importer import esporta_colonnare, importa_file
+from .statistiche import numeri_mancanti, ricostruisci, riepilogo_serie, riepilogo_subserie
+
+# --- BENCHMARK SENZA INTERFACCIA ---
+# Genera collezioni sintetiche realistiche e misura gli stessi percorsi usati da app.py e fumetti.py,
+# fuori da Streamlit. Il risultato è un JSON confrontabile tra esecuzioni:
+#   python -m comics.benchmark --righe 10000 100000 --output risultati.json
+RIGHE_DEFAULT = [10000, 100000]
+RIPETIZIONI_DEFAULT = 3
+SESSIONI_CONCORRENTI = 8
+SEME_DEFAULT = 42
+
+SERIE_NOTE = ["Tex", "Dylan Dog", "Zagor", "Martin Mystère", "Nathan Never", "Topolino", "Diabolik",
+              "Julia", "Mister No", "Dampyr", "Legs Weaver", "Nick Raider", "Brendon", "Magico Vento"]
+EDITORI = ["Sergio Bonelli Editore", "Panini Comics", "Astorina", "Star Comics", "Mondadori", "RW Edizioni"]
+FORMATI = ["Brossurato", "Spillato", "Cartonato", "Tascabile"]
+SUBSERIE = ["Nessuna", "Gigante", "Speciale", "Color", "Maxi", "Almanacco"]
+PESI_SUBSERIE = [0.82, 0.06, 0.05, 0.03, 0.02, 0.02]
+VARIANTI = ["Variant A", "Variant B", "Cover Lucca", "Edizione Limitata"]
+FREQUENZE = ["Mensile", "Bimestrale", "Settimanale"]
+PAROLE_TITOLO = ["notte", "ombra", "ritorno", "vendetta", "città", "fuoco", "deserto", "segreto",
+                 "lupo", "caccia", "mistero", "incubo", "frontiera", "tesoro", "ultimo", "sangue"]
+
+
+# --- GENERATORE ---
+def genera_collezione(righe, seme=SEME_DEFAULT):
+    """Collezione sintetica nel formato del CSV di import (testi, virgola decimale).
+
+    Le serie seguono una distribuzione di Zipf (poche serie lunghissime, molte brevi); i numeri
+    sono progressivi dentro ogni (serie, subserie), le lire compaiono solo prima del 2002.
+    """
+    rng = np.random.default_rng(seme)
+    n_serie = max(len(SERIE_NOTE), righe // 200)
+    nomi_serie = np.array(SERIE_NOTE + [f"Serie {i:05d}" for i in range(n_serie - len(SERIE_NOTE))], dtype=object)
+    pesi = 1.0 / np.arange(1, n_serie + 1) ** 1.1
+    serie = nomi_serie[rng.choice(n_serie, righe, p=pesi / pesi.sum())]
+    subserie = np.array(SUBSERIE, dtype=object)[rng.choice(len(SUBSERIE), righe, p=PESI_SUBSERIE)]
+
+    df = pd.DataFrame({"serie": serie, "subserie": subserie})
+    df["numero"] = df.groupby(["serie", "subserie"]).cumcount() + 1
+    variante = np.full(righe, "", dtype=object)
+    con_variante = rng.random(righe) < 0.05
+    variante[con_variante] = np.array(VARIANTI, dtype=object)[rng.integers(0, len(VARIANTI), con_variante.sum())]
+    df["variante"] = variante
+
+    parole = np.array(PAROLE_TITOLO, dtype=object)
+    df["titolo"] = [f"{a.capitalize()} {b}" for a, b in zip(parole[rng.integers(0, len(parole), righe)],
+                                                            parole[rng.integers(0, len(parole), righe)])]
+    df["editore"] = np.array(EDITORI, dtype=object)[rng.integers(0, len(EDITORI), righe)]
+    df["formato"] = np.array(FORMATI, dtype=object)[rng.integers(0, len(FORMATI), righe)]
+    df["frequenza"] = np.array(FREQUENZE, dtype=object)[rng.choice(3, righe, p=[0.8, 0.15, 0.05])]
+    df["colore"] = np.where(rng.random(righe) < 0.7, "B/N", "Colore")
+    df["pagine"] = rng.choice([64, 96, 128, 160, 240, 320], righe)
+
+    anno = rng.integers(1960, 2026, righe)
+    lira = (anno < 2002) & (rng.random(righe) < 0.9)
+    prezzo = np.where(lira, rng.integers(2, 80, righe) * 100, rng.integers(250, 1500, righe) / 100)
+    df["prezzo_copertina"] = [f"{p:.0f}" if l else f"{p:.2f}".replace(".", ",") for p, l in zip(prezzo, lira)]
+    df["valuta"] = np.where(lira, "Lira", "Euro")
+    df["giorno_uscita"] = rng.integers(1, 29, righe)
+    df["mese_uscita"] = np.array(MESI_OPZIONI, dtype=object)[rng.integers(0, 12, righe)]
+    df["anno_uscita"] = anno
+    df["codice"] = [f"C{x:07d}" for x in rng.integers(0, 10**7, righe)]
+    df["isbn"] = np.where(rng.random(righe) < 0.3, [f"978{x:010d}" for x in rng.integers(0, 10**10, righe)], "")
+    df["stato"] = np.where(rng.random(righe) < 0.85, "stock", "wish list")
+    df["storage_box"] = [f"Box {x:03d}" for x in rng.integers(1, max(2, righe // 400), righe)]
+    df["note"] = np.where(rng.random(righe) < 0.1, "prima edizione", "")
+    return df
+
+
+def scrivi_csv(df, percorso, sep=";"):
+    """CSV come quelli esportati dal foglio: tutto testo, intestazione con i nomi delle colonne."""
+    df.to_csv(percorso, sep=sep, index=False)
+    return percorso
+
+
+# --- MISURE ---
+def _picco_rss_mb():
+    picco = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux in KB, macOS in byte
+    return picco / (1024 * 1024) if sys.platform == "darwin" else picco / 1024
+
+
+def misura(nome, fn, ripetizioni, prepara=None):
+    """Tempo (ripetizioni esecuzioni) e picco di memoria Python (un'esecuzione a parte con tracemalloc)."""
+    tempi = []
+    for _ in range(ripetizioni):
+        stato = prepara() if prepara else None
+        gc.collect()
+        inizio = time.perf_counter()
+        fn(stato) if prepara else fn()
+        tempi.append(time.perf_counter() - inizio)
+
+    stato = prepara() if prepara else None
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn(stato) if prepara else fn()
+        picco = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"scenario": nome, "secondi_min": min(tempi), "secondi_mediana": statistics.median(tempi),
+            "secondi": tempi, "picco_mb": picco / (1024 * 1024)}
+
+
+def _importa(percorso):
+    esito, = importa_file([percorso])
+    os.remove(esito["log"])
+    if not esito["ok"]:
+        raise RuntimeError("Import fallito durante il benchmark")
+    return esito["added"], esito["updated"]
+
+
+def scenari(percorso_csv, righe, ripetizioni):
+    """Esegue tutti gli scenari su una collezione importata da percorso_csv (nella cartella corrente)."""
+    risultati = [misura("import_csv", lambda _: _importa(percorso_csv), ripetizioni, prepara=db.elimina_database)]
+    # L'ultimo import ha lasciato il db pieno: da qui in poi si lavora su quello
+    risultati.append(misura("reimport_csv", lambda: _importa(percorso_csv), ripetizioni))
+    if colonnare.disponibile():
+        # Stessa collezione esportata e reimportata in Parquet: nessun parsing di testo in lettura
+        risultati.append(misura("esporta_parquet", lambda: esporta_colonnare("collezione.parquet"), ripetizioni))
+        risultati.append(misura("reimport_parquet", lambda: _importa("collezione.parquet"), ripetizioni))
+
+    for col in COLONNE_FILTRABILI:
+        valore = valori_distinti(col)[0]
+
+        def filtra(col=col, valore=valore):
+            where, params = costruisci_filtro({col: valore})
+            conta(where, params)
+            leggi_pagina(where, params)
+        risultati.append(misura(f"filtro_{col}", filtra, ripetizioni))
+
+    def filtra_date():
+        where, params = costruisci_filtro({"data_uscita": (19950101, 19991231)})
+        conta(where, params)
+        leggi_pagina(where, params)
+    risultati.append(misura("filtro_intervallo_date", filtra_date, ripetizioni))
+
+    def cerca():
+        where, params = costruisci_filtro({}, "notte lup")
+        conta(where, params)
+        leggi_pagina(where, params, testo="notte lup")
+    risultati.append(misura("ricerca_testo", cerca, ripetizioni))
+
+    # Percorso di fumetti.py: snapshot tipizzato con chiave di ricerca, poi filtro in memoria
+    grezzi = pd.read_csv(percorso_csv, sep=";", dtype=str)
+    risultati.append(misura("snapshot_prepara", lambda: aggiungi_chiave_ricerca(applica_schema(grezzi),
+                                                                                 list(grezzi.columns)), ripetizioni))
+    preparati = aggiungi_chiave_ricerca(applica_schema(grezzi), list(grezzi.columns))
+    risultati.append(misura("snapshot_ricerca", lambda: preparati[maschera_testo(preparati, "notte lup")], ripetizioni))
+    if colonnare.disponibile():
+        # Riavvio di fumetti.py da uno snapshot Arrow: memory map, tipi già applicati
+        colonnare.scrivi("snapshot.arrow", [grezzi], list(grezzi.columns), "arrow")
+
+        def carica_snapshot():
+            dati, _ = colonnare.leggi("snapshot.arrow")
+            return aggiungi_chiave_ricerca(applica_schema(dati), list(dati.columns))
+        risultati.append(misura("snapshot_arrow_carica", carica_snapshot, ripetizioni))
+
+    def statistiche():
+        riepilogo_serie.svuota()
+        riepilogo_subserie.svuota()
+        riepilogo_serie()
+        riepilogo_subserie()
+    risultati.append(misura("statistiche", statistiche, ripetizioni))
+    risultati.append(misura("statistiche_ricalcolo", ricostruisci, ripetizioni))
+
+    def mancanti():
+        numeri_mancanti.svuota()
+        numeri_mancanti()
+        numeri_mancanti(solo_stock=True)
+    risultati.append(misura("numeri_mancanti", mancanti, ripetizioni))
+
+    # Stesso carico di update_db_from_editor: una pagina intera modificata su due colonne
+    def prepara_modifiche():
+        pagina, _ = leggi_pagina("1", [])
+        modifiche = {i: {"note": f"bench {time.time_ns()}", "stato": "wish list" if i % 2 else "stock"}
+                     for i in range(len(pagina))}
+        return pagina, modifiche
+    risultati.append(misura("modifica_massiva", lambda s: salva_modifiche(*s), ripetizioni, prepara=prepara_modifiche))
+
+    # Più sessioni che salvano insieme piccole modifiche dall'editor, ciascuna su righe sue
+    def prepara_concorrenti():
+        pagina, _ = leggi_pagina("1", [])
+        return [pagina.iloc[i::SESSIONI_CONCORRENTI].reset_index(drop=True) for i in range(SESSIONI_CONCORRENTI)]
+
+    def modifica_concorrente(pagine):
+        def sessione(pagina):
+            for i in range(len(pagina)):
+                salva_modifiche(pagina, {i: {"note": f"bench {time.time_ns()}"}})
+        with ThreadPoolExecutor(SESSIONI_CONCORRENTI) as pool:
+            list(pool.map(sessione, pagine))
+    risultati.append(misura("modifica_concorrente", modifica_concorrente, ripetizioni, prepara=prepara_concorrenti))
+
+    def backup(crea):
+        with crea(comprimi=True) as f:
+            f.conferma()
+    risultati.append(misura("backup_completo", lambda: backup(crea_backup), ripetizioni))
+    # Delta dopo un backup completo e una pagina modificata: il caso del backup notturno
+    risultati.append(misura("backup_incrementale", lambda _: backup(crea_delta), ripetizioni,
+                            prepara=lambda: salva_modifiche(*prepara_modifiche())))
+    for r in risultati:
+        r["righe"] = righe
+    return risultati
+
+
+def esegui(elenco_righe, ripetizioni=RIPETIZIONI_DEFAULT, seme=SEME_DEFAULT):
+    """Benchmark completo per ogni dimensione, ciascuna in una cartella temporanea con il suo db."""
+    partenza = os.getcwd()
+    risultati = []
+    try:
+        for righe in elenco_righe:
+            with tempfile.TemporaryDirectory(prefix="bench_") as cartella:
+                os.chdir(cartella)
+                percorso_csv = scrivi_csv(genera_collezione(righe, seme), "collezione.csv")
+                risultati.extend(scenari(percorso_csv, righe, ripetizioni))
+                db.elimina_database()
+                os.chdir(partenza)
+    finally:
+        os.chdir(partenza)
+    return {
+        "ambiente": {"python": platform.python_version(), "pandas": pd.__version__,
+                     "sqlite": sqlite3.sqlite_version, "piattaforma": platform.platform()},
+        "seme": seme,
+        "ripetizioni": ripetizioni,
+        "rss_max_mb": _picco_rss_mb(),
+        "risultati": risultati,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark della collezione su dati sintetici.")
+    parser.add_argument("--righe", type=int, nargs="+", default=RIGHE_DEFAULT, help="dimensioni da provare")
+    parser.add_argument("--ripetizioni", type=int, default=RIPETIZIONI_DEFAULT)
+    parser.add_argument("--seme", type=int, default=SEME_DEFAULT)
+    parser.add_argument("--output", help="file JSON dei risultati (default: stdout)")
+    parser.add_argument("--solo-csv", metavar="PERCORSO", help="genera solo il CSV sintetico (con la prima dimensione)")
+    args = parser.parse_args()
+    if args.solo_csv:
+        scrivi_csv(genera_collezione(args.righe[0], args.seme), args.solo_csv)
+        sys.exit(0)
+    report = esegui(args.righe, args.ripetizioni, args.seme)
+    testo = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(testo)
+    else:
+        print(testo)
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import sys
+
+from . import db
+
+# --- RIGA DI COMANDO ---
+# python -m comics <comando>: le stesse operazioni delle pagine Streamlit, per cron e script batch.
+# Ogni comando importa solo i moduli che gli servono.
+
+
+def _progresso_file(scritti, totali, righe, secondi, frazione):
+    print(f"\r{frazione:4.0%} · {scritti}/{totali} file · {righe} righe · {righe / max(secondi, 1e-6):,.0f} righe/s",
+          end="", file=sys.stderr)
+
+
+def cmd_import(args):
+    from .importer import importa_file
+
+    esiti = importa_file(args.file, processi=args.processi, dimensione_blocco=args.blocco,
+                         progresso=None if args.silenzioso else _progresso_file)
+    if not args.silenzioso:
+        print(file=sys.stderr)
+    log = open(args.log, "a", encoding="utf-8") if args.log else None
+    try:
+        for e in esiti:
+            if log:
+                log.write(f"# {e['file']}\n")
+                with open(e["log"], encoding="utf-8") as f:
+                    shutil.copyfileobj(f, log)
+            os.remove(e["log"])
+            print(f"{e['file']}: {'ok' if e['ok'] else 'ERRORE'} · aggiunti {e['added']} · "
+                  f"aggiornati {e['updated']} · saltati {e['skipped']}")
+    finally:
+        if log:
+            log.close()
+    if len(esiti) > 1:
+        print(f"Totale: {sum(e['ok'] for e in esiti)}/{len(esiti)} file ok · aggiunti {sum(e['added'] for e in esiti)} · "
+              f"aggiornati {sum(e['updated'] for e in esiti)} · saltati {sum(e['skipped'] for e in esiti)}")
+    return 0 if all(e["ok"] for e in esiti) else 1
+
+
+def cmd_export(args):
+    from .colonnare import formato_percorso
+    from .importer import esporta_colonnare, esporta_csv
+
+    formato = args.formato or ("csv" if args.file == "-" else formato_percorso(args.file) or "csv")
+    if formato != "csv":
+        n = esporta_colonnare(sys.stdout.buffer if args.file == "-" else args.file, formato)
+    elif args.file == "-":
+        n = esporta_csv(sys.stdout, sep=args.sep)
+    else:
+        with open(args.file, "w", encoding="utf-8", newline="") as f:
+            n = esporta_csv(f, sep=args.sep)
+    print(f"Esportati {n} albi", file=sys.stderr)
+    return 0
+
+
+def cmd_stats(args):
+    from .statistiche import numeri_mancanti, riepilogo_serie, riepilogo_subserie
+
+    if args.mancanti:
+        df = numeri_mancanti(args.solo_stock)
+    else:
+        df = riepilogo_subserie() if args.subserie else riepilogo_serie()
+    if args.formato == "json":
+        print(df.to_json(orient="records", force_ascii=False))
+    elif args.formato == "csv":
+        df.to_csv(sys.stdout, sep=";", index=False)
+    else:
+        print(df.to_string(index=False))
+    return 0
+
+
+def cmd_backup(args):
+    from .backup import crea_backup, crea_delta
+
+    sorgente = crea_delta(args.gzip) if args.incrementale else crea_backup(args.gzip)
+    with sorgente, open(args.file, "wb") as out:
+        while blocco := sorgente.read(1024 * 1024):
+            out.write(blocco)
+        out.flush()
+        os.fsync(out.fileno())
+    # Solo ora il file è su disco: diventa il punto di partenza del prossimo incrementale
+    sorgente.conferma()
+    print(f"Backup {'incrementale' if args.incrementale else 'completo'} scritto in {args.file}", file=sys.stderr)
+    return 0
+
+
+def cmd_restore(args):
+    from .backup import ripristina
+
+    try:
+        with open(args.file, "rb") as f:
+            ripristina(f)
+    except ValueError as e:
+        print(f"Ripristino annullato: {e}", file=sys.stderr)
+        return 1
+    print(f"Database ripristinato da {args.file}", file=sys.stderr)
+    return 0
+
+
+def cmd_replay(args):
+    from .backup import riapplica
+
+    if os.path.exists(args.output):
+        print(f"{args.output} esiste già", file=sys.stderr)
+        return 1
+    try:
+        n = riapplica(args.base, args.delta, args.output, args.fino_a)
+    except ValueError as e:
+        print(f"Ricostruzione fallita: {e}", file=sys.stderr)
+        return 1
+    print(f"Applicate {n} modifiche: {args.output}", file=sys.stderr)
+    return 0
+
+
+def cmd_sync(args):
+    from .foglio import apri_foglio
+    from .sincronizza import sincronizza
+
+    credenziali = None
+    if args.credenziali:
+        with open(args.credenziali, encoding="utf-8") as f:
+            credenziali = json.load(f)
+    try:
+        esito = sincronizza(apri_foglio(args.foglio, credenziali, args.worksheet), vince=args.vince)
+    except ValueError as e:
+        print(f"Sincronizzazione non riuscita: {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(esito))
+    return 0
+
+
+def _ricostruisci(conn):
+    from .migrations import ricostruisci_statistiche
+    ricostruisci_statistiche(conn.cursor())
+    conn.execute("INSERT INTO comics_fts (comics_fts) VALUES ('rebuild')")
+
+
+def _ottimizza():
+    # VACUUM non può stare in una transazione: gira da solo nel thread scrittore, su una connessione sua
+    with db.connessione() as conn:
+        conn.execute("ANALYZE")
+        conn.execute("PRAGMA optimize")
+        conn.commit()
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def cmd_schema(args):
+    from .migrations import VERSIONE_SCHEMA, versione
+    from .scrittore import esegui, esegui_esclusiva
+
+    if args.azione == "stato":
+        # Connessione diretta: aprire il pool applicherebbe le migrazioni
+        if not os.path.exists(db.DB_NAME):
+            print(f"{db.DB_NAME}: non esiste (verrà creato al primo uso)")
+            return 0
+        conn = sqlite3.connect(db.DB_NAME)
+        try:
+            attuale = versione(conn)
+        finally:
+            conn.close()
+        print(json.dumps({"database": db.DB_NAME, "versione": attuale, "versione_app": VERSIONE_SCHEMA,
+                          "dimensione_mb": round(os.path.getsize(db.DB_NAME) / 1024 / 1024, 2)}))
+        return 0
+
+    with db.connessione() as conn:
+        if args.azione == "migra":
+            # Le migrazioni girano all'apertura della prima connessione
+            print(f"Schema alla versione {versione(conn)}")
+        elif args.azione == "verifica":
+            esito = [r[0] for r in conn.execute("PRAGMA integrity_check")]
+            try:
+                # Con l'indice di ricerca danneggiato FTS5 solleva l'errore invece di restituire righe
+                conn.execute("INSERT INTO comics_fts (comics_fts) VALUES ('integrity-check')")
+            except sqlite3.DatabaseError as e:
+                esito.append(f"comics_fts: {e}")
+            print("\n".join(esito))
+            return 0 if esito == ["ok"] else 1
+        elif args.azione == "ricostruisci":
+            esegui(_ricostruisci)
+            print("Riepiloghi e indice di ricerca ricostruiti")
+        elif args.azione == "ottimizza":
+            esegui_esclusiva(_ottimizza)
+            print("Database ottimizzato")
+        elif args.azione == "pota":
+            from .backup import pota_giornale
+            if args.fino_a is None:
+                print("pota richiede --fino-a SEQ", file=sys.stderr)
+                return 1
+            try:
+                tolte = pota_giornale(args.fino_a)
+            except ValueError as e:
+                print(f"Giornale non potato: {e}", file=sys.stderr)
+                return 1
+            print(f"Tolte {tolte} voci dal giornale")
+    return 0
+
+
+def costruisci_parser():
+    parser = argparse.ArgumentParser(prog="python -m comics", description="Gestione della collezione senza interfaccia.")
+    parser.add_argument("--db", default=db.DB_NAME, help=f"file del database (default: {db.DB_NAME})")
+    comandi = parser.add_subparsers(dest="comando", required=True)
+
+    p = comandi.add_parser("import", help="importa uno o più CSV o Parquet/Arrow (letti in parallelo, scritti in ordine, una transazione per blocco)")
+    p.add_argument("file", nargs="+")
+    p.add_argument("--log", help="file a cui aggiungere il log riga per riga")
+    p.add_argument("--blocco", type=int, default=5000, help="righe lette per volta")
+    p.add_argument("--processi", type=int, help="processi per la lettura (default: uno per file fino al numero di CPU)")
+    p.add_argument("--silenzioso", action="store_true", help="niente avanzamento su stderr")
+    p.set_defaults(fn=cmd_import)
+
+    p = comandi.add_parser("export", help="esporta la collezione in CSV, Parquet o Arrow ('-' per stdout)")
+    p.add_argument("file")
+    p.add_argument("--sep", default=";")
+    p.add_argument("--formato", choices=["csv", "parquet", "arrow"], help="default: dall'estensione del file (.parquet, .arrow)")
+    p.set_defaults(fn=cmd_export)
+
+    p = comandi.add_parser("stats", help="riepilogo per serie (o per sottoserie), oppure numeri mancanti")
+    p.add_argument("--subserie", action="store_true")
+    p.add_argument("--mancanti", action="store_true", help="buchi nella numerazione di ogni sottoserie")
+    p.add_argument("--solo-stock", action="store_true", help="con --mancanti: contano solo gli albi in stock")
+    p.add_argument("--formato", choices=["tabella", "json", "csv"], default="tabella")
+    p.set_defaults(fn=cmd_stats)
+
+    p = comandi.add_parser("backup", help="backup online completo o incrementale")
+    p.add_argument("file")
+    p.add_argument("--gzip", action="store_true")
+    p.add_argument("--incrementale", action="store_true", help="solo il giornale dall'ultimo backup")
+    p.set_defaults(fn=cmd_backup)
+
+    p = comandi.add_parser("restore", help="ripristina un backup completo (.db o .db.gz) dopo averlo verificato")
+    p.add_argument("file")
+    p.set_defaults(fn=cmd_restore)
+
+    p = comandi.add_parser("replay", help="ricostruisce un database da un backup completo e dai delta")
+    p.add_argument("base", help="backup completo (.db o .db.gz)")
+    p.add_argument("delta", nargs="*", help="backup incrementali (.jsonl o .jsonl.gz)")
+    p.add_argument("-o", "--output", required=True, help="database da creare")
+    p.add_argument("--fino-a", type=int, help="ultima voce del giornale da applicare")
+    p.set_defaults(fn=cmd_replay)
+
+    p = comandi.add_parser("sync", help="sincronizza la collezione con il foglio (solo le righe cambiate)")
+    p.add_argument("foglio", help="URL del foglio Google, oppure un file .csv o .db che lo sostituisce")
+    p.add_argument("--credenziali", help="JSON del service account (solo per il foglio Google)")
+    p.add_argument("--worksheet", help="scheda del foglio Google (default: la prima)")
+    p.add_argument("--vince", choices=["archivio", "foglio"], default="archivio",
+                   help="chi prevale sulle righe cambiate da entrambe le parti")
+    p.set_defaults(fn=cmd_sync)
+
+    p = comandi.add_parser("schema", help="manutenzione dello schema")
+    p.add_argument("azione", choices=["stato", "migra", "verifica", "ricostruisci", "ottimizza", "pota"])
+    p.add_argument("--fino-a", type=int,
+                   help="pota: ultima voce del giornale da togliere, già in un backup completo verificato")
+    p.set_defaults(fn=cmd_schema)
+    return parser
+
+
+def main(argv=None):
+    args = costruisci_parser().parse_args(argv)
+    db.DB_NAME = args.db
+    try:
+        return args.fn(args)
+    except BrokenPipeError:
+        # Output troncato da una pipe (es. | head): non è un errore del comando
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 0
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+
+from .profilo import cronometrato
+
+# --- SCHEMA DEL DATAFRAME DELLA COLLEZIONE ---
+# Un'unica definizione dei tipi in memoria, usata sia per i dati SQLite (app.py)
+# sia per quelli del foglio Google (fumetti.py).
+MESI_OPZIONI = [
+    "gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno",
+    "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"
+]
+
+# Poche modalità ripetute su molte righe: categorie (codici interi + un dizionario)
+COLONNE_CATEGORIA = [
+    "serie", "subserie", "editore", "formato", "frequenza", "colore", "valuta", "stato", "storage_box"
+]
+COLONNE_INTERE = ["id", "numero", "pagine", "giorno_uscita", "anno_uscita"]
+COLONNE_DECIMALI = ["prezzo_copertina"]
+COLONNE_TESTO = ["variante", "titolo", "codice", "isbn", "note"]
+
+TIPO_MESE = pd.CategoricalDtype(MESI_OPZIONI, ordered=True)
+
+
+def _numerico(s):
+    # I numeri letti come testo (CSV, foglio) possono usare la virgola decimale
+    if not pd.api.types.is_numeric_dtype(s):
+        s = s.astype("string").str.strip().str.replace(',', '.', regex=False)
+    return pd.to_numeric(s, errors='coerce')
+
+
+def _testo(s):
+    return s.astype("string").str.strip()
+
+
+def _gia_tipizzata(col, dtype):
+    # Colonne lette da Parquet/Arrow (comics.colonnare): hanno già il tipo dello schema, nessuna conversione
+    if col in COLONNE_CATEGORIA:
+        return isinstance(dtype, pd.CategoricalDtype)
+    if col in COLONNE_INTERE:
+        return dtype == "Int64"
+    if col in COLONNE_DECIMALI:
+        return dtype == "Float64"
+    if col == "mese_uscita":
+        return dtype == TIPO_MESE
+    return False
+
+
+def _applica(df, categorie):
+    out = df.copy()
+    for col in out.columns:
+        dtype = out[col].dtype
+        if _gia_tipizzata(col, dtype) and (categorie or not isinstance(dtype, pd.CategoricalDtype)):
+            continue
+        if col in COLONNE_CATEGORIA:
+            out[col] = _testo(out[col]).astype("category") if categorie else _testo(out[col])
+        elif col in COLONNE_INTERE:
+            out[col] = np.trunc(_numerico(out[col]).astype("Float64")).astype("Int64")
+        elif col in COLONNE_DECIMALI:
+            out[col] = _numerico(out[col]).astype("Float64")
+        elif col in COLONNE_TESTO:
+            out[col] = _testo(out[col])
+        elif col == "mese_uscita":
+            # Un mese fuori dall'elenco (o vuoto) diventa mancante, come farebbe la categoria
+            mese = _testo(out[col]).str.lower()
+            mese = mese.where(mese.isin(MESI_OPZIONI))
+            out[col] = mese.astype(TIPO_MESE) if categorie else mese
+    return out
+
+
+@cronometrato
+def applica_schema(df):
+    """Restituisce una copia del DataFrame con i tipi compatti dello schema (le colonne sconosciute restano invariate)."""
+    return _applica(df, categorie=True)
+
+
+@cronometrato
+def applica_schema_editor(df):
+    """Come applica_schema, ma le colonne categoria e il mese restano testo.
+
+    Serve alle pagine dell'editor: st.data_editor e salva_modifiche scrivono nelle celle anche
+    valori che non sono tra le categorie della pagina.
+    """
+    return _applica(df, categorie=False)
+
+
+def opzioni(df, col):
+    """Valori non vuoti di una colonna, ordinati; sulle categorie lavora solo sul dizionario."""
+    if df.empty or col not in df.columns:
+        return []
+    s = df[col]
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        valori = s.cat.remove_unused_categories().cat.categories
+    else:
+        valori = s.dropna().unique()
+    return sorted(str(v) for v in valori if str(v).strip() not in ("", "nan", "None"))
+
+
+# --- RICERCA TESTUALE VETTORIALE ---
+# Tutte le colonne testuali di una riga, in minuscolo, in un'unica stringa calcolata una volta per snapshot
+CHIAVE_RICERCA = "_cerca"
+SEPARATORE_RICERCA = "\x1f"
+
+
+def _testo_ricerca(s):
+    # Sulle categorie il minuscolo si calcola una volta per valore del dizionario, non per riga
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        valori = s.cat.categories.astype("string").str.lower().to_numpy(dtype=object)
+        return np.append(valori, "")[s.cat.codes.to_numpy()].tolist()
+    return s.astype("string").fillna("").str.lower().tolist()
+
+
+def aggiungi_chiave_ricerca(df, colonne):
+    """Aggiunge al DataFrame la colonna di ricerca costruita sulle colonne indicate."""
+    parti = [_testo_ricerca(df[col]) for col in colonne if col in df.columns]
+    if not parti:
+        df[CHIAVE_RICERCA] = pd.Series("", index=df.index, dtype="string")
+        return df
+    df[CHIAVE_RICERCA] = pd.Series([SEPARATORE_RICERCA.join(riga) for riga in zip(*parti)], index=df.index, dtype="string")
+    return df
+
+
+@cronometrato
+def maschera_testo(df, testo):
+    """Righe che contengono tutte le parole cercate (sottostringhe, senza distinzione di maiuscole)."""
+    maschera = pd.Series(True, index=df.index)
+    for parola in testo.lower().split():
+        maschera &= df[CHIAVE_RICERCA].str.contains(parola, regex=False).fillna(False).astype(bool)
+    return maschera
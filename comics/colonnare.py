@@ -0,0 +1,207 @@
+import importlib.util
+import os
+
+import numpy as np
+import pandas as pd
+
+from .collezione import COLONNE_CATEGORIA, COLONNE_DECIMALI, COLONNE_INTERE, MESI_OPZIONI, applica_schema
+from .profilo import cronometrato
+
+# --- FORMATI COLONNARI (PARQUET / ARROW IPC) ---
+# La collezione con i tipi dello schema di collezione.py invece che come testo: categorie come
+# dizionari, interi come interi, prezzi come decimali a due cifre. Arrow IPC non è compresso e si
+# legge in memory map senza copie (snapshot); Parquet è compresso (esportazioni e archivio).
+# pyarrow è opzionale: i moduli si importano solo quando servono e disponibile() dice se ci sono.
+FORMATI = {"parquet": ".parquet", "arrow": ".arrow"}
+MIME = {"parquet": "application/vnd.apache.parquet", "arrow": "application/vnd.apache.arrow.file"}
+
+# Primi byte dei file: così l'import riconosce il formato anche da un upload senza estensione
+_FIRME = {b"PAR1": "parquet", b"ARROW1": "arrow"}
+
+PRECISIONE_PREZZI = (12, 2)
+
+
+def disponibile():
+    return importlib.util.find_spec("pyarrow") is not None
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Per i formati Parquet e Arrow serve pyarrow (pip install pyarrow)") from e
+    return pyarrow
+
+
+def formato_file(intestazione):
+    """'parquet' o 'arrow' dai primi byte di un file, None per tutto il resto (es. CSV)."""
+    for firma, formato in _FIRME.items():
+        if intestazione.startswith(firma):
+            return formato
+    return None
+
+
+def formato_percorso(percorso):
+    """Formato colonnare indicato dall'estensione del file (.feather vale come Arrow), altrimenti None."""
+    estensione = os.path.splitext(percorso)[1].lower()
+    if estensione == ".feather":
+        return "arrow"
+    return next((f for f, e in FORMATI.items() if e == estensione), None)
+
+
+# --- SCHEMA ---
+def _tipo(pa, col):
+    if col in COLONNE_CATEGORIA:
+        return pa.dictionary(pa.int32(), pa.string())
+    if col == "mese_uscita":
+        # Dizionario fisso e ordinato: torna in pandas come collezione.TIPO_MESE
+        return pa.dictionary(pa.int8(), pa.string(), ordered=True)
+    if col in COLONNE_INTERE:
+        return pa.int64()
+    if col in COLONNE_DECIMALI:
+        return pa.decimal128(*PRECISIONE_PREZZI)
+    return pa.string()
+
+
+def schema(colonne, metadati=None):
+    """Schema Arrow esplicito per le colonne indicate; quelle fuori dallo schema della collezione sono testo."""
+    pa = _pyarrow()
+    return pa.schema([pa.field(col, _tipo(pa, col)) for col in colonne], metadata=metadati)
+
+
+class _Dizionario:
+    """Dizionario di una colonna categoria che cresce blocco dopo blocco senza mai cambiare i codici già dati.
+
+    Ogni blocco ne estende il precedente: Arrow IPC lo scrive come delta, Parquet tiene codici stabili.
+    """
+
+    def __init__(self):
+        self.valori = []
+        self._codici = {}
+
+    def codifica(self, pa, s):
+        categorie = s.cat.categories
+        mappa = np.empty(len(categorie) + 1, dtype=np.int32)
+        for i, valore in enumerate(categorie):
+            codice = self._codici.get(valore)
+            if codice is None:
+                codice = self._codici[valore] = len(self.valori)
+                self.valori.append(valore)
+            mappa[i] = codice
+        codici = s.cat.codes.to_numpy()
+        mappa[-1] = 0  # codice -1 (valore mancante): mascherato qui sotto
+        indici = pa.array(mappa[codici], type=pa.int32(), mask=codici < 0)
+        return pa.DictionaryArray.from_arrays(indici, pa.array(self.valori, type=pa.string()))
+
+
+def _array(pa, s, tipo, dizionario):
+    if pa.types.is_dictionary(tipo):
+        if s.name == "mese_uscita":
+            codici = s.cat.codes.to_numpy()
+            indici = pa.array(codici.astype(np.int8), type=pa.int8(), mask=codici < 0)
+            return pa.DictionaryArray.from_arrays(indici, pa.array(MESI_OPZIONI), ordered=True)
+        return dizionario.codifica(pa, s)
+    if pa.types.is_decimal(tipo):
+        return pa.compute.round(pa.array(s, type=pa.float64(), from_pandas=True), PRECISIONE_PREZZI[1]).cast(tipo)
+    if pa.types.is_string(tipo):
+        return pa.array(s.astype("string"), type=tipo, from_pandas=True)
+    return pa.array(s, type=tipo, from_pandas=True)
+
+
+@cronometrato
+def scrivi(destinazione, blocchi, colonne, formato="parquet", metadati=None):
+    """Scrive i DataFrame di blocchi uno alla volta (nessun file intero in memoria) e restituisce le righe scritte.
+
+    destinazione: percorso o file binario aperto; i blocchi possono avere testo o tipi già
+    applicati, passano comunque da applica_schema. metadati: {chiave: testo} salvati nello schema.
+    """
+    pa = _pyarrow()
+    sch = schema(colonne, {k: str(v) for k, v in (metadati or {}).items()})
+    dizionari = {col: _Dizionario() for col in colonne if col in COLONNE_CATEGORIA}
+    if formato == "parquet":
+        scrittore = pa.parquet.ParquetWriter(destinazione, sch, compression="zstd")
+        scrivi_blocco = scrittore.write_table
+    elif formato == "arrow":
+        opzioni = pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True)
+        scrittore = pa.ipc.new_file(destinazione, sch, options=opzioni)
+        scrivi_blocco = scrittore.write_table
+    else:
+        raise ValueError(f"Formato sconosciuto: {formato}")
+    righe = 0
+    with scrittore:
+        for blocco in blocchi:
+            blocco = applica_schema(blocco.reindex(columns=colonne))
+            tabella = pa.Table.from_arrays(
+                [_array(pa, blocco[campo.name], campo.type, dizionari.get(campo.name)) for campo in sch], schema=sch)
+            scrivi_blocco(tabella)
+            righe += len(blocco)
+    return righe
+
+
+# --- LETTURA ---
+def _apri(pa, sorgente):
+    # Un percorso va in memory map: le colonne Arrow restano nel page cache, senza copie
+    if isinstance(sorgente, (str, os.PathLike)):
+        return pa.memory_map(os.fspath(sorgente))
+    return sorgente
+
+
+def _tabella(pa, sorgente, formato):
+    sorgente = _apri(pa, sorgente)
+    if formato == "parquet":
+        return pa.parquet.read_table(sorgente, memory_map=True)
+    return pa.ipc.open_file(sorgente).read_all()
+
+
+@cronometrato
+def leggi(sorgente, formato=None):
+    """Legge un file Parquet o Arrow: (DataFrame con i tipi di applica_schema, metadati dello schema).
+
+    formato: default dall'estensione del percorso.
+    """
+    pa = _pyarrow()
+    tabella = _tabella(pa, sorgente, formato or formato_percorso(sorgente))
+    metadati = {k.decode(): v.decode() for k, v in (tabella.schema.metadata or {}).items()}
+    # I decimali diventerebbero oggetti Decimal: in memoria i prezzi sono Float64. Il cast diretto non
+    # arrotonda bene (7.85 -> 7.8500000000000005), centesimi interi / 100 invece sì
+    for i, campo in enumerate(tabella.schema):
+        if pa.types.is_decimal(campo.type):
+            scala = 10 ** campo.type.scale
+            centesimi = pa.compute.multiply(tabella.column(i), scala).cast(pa.int64()).cast(pa.float64())
+            tabella = tabella.set_column(i, campo.name, pa.compute.divide(centesimi, float(scala)))
+    tipi = {pa.int64(): pd.Int64Dtype(), pa.float64(): pd.Float64Dtype(), pa.string(): pd.StringDtype()}
+    df = tabella.to_pandas(types_mapper=tipi.get)
+    # Il dizionario è in ordine di comparsa: le categorie tornano ordinate e dello stesso tipo di applica_schema
+    for col in COLONNE_CATEGORIA:
+        if col in df.columns:
+            df[col] = df[col].cat.set_categories(df[col].cat.categories.astype("string").sort_values())
+    return df, metadati
+
+
+def blocchi_testo(sorgente, formato, dimensione_blocco):
+    """Il file a blocchi di righe, ogni valore come testo ('' per i mancanti): lo stesso formato di pd.read_csv(dtype=str)."""
+    pa = _pyarrow()
+    sorgente = _apri(pa, sorgente)
+    if formato == "parquet":
+        lotti = pa.parquet.ParquetFile(sorgente, memory_map=True).iter_batches(batch_size=dimensione_blocco)
+    else:
+        lettore = pa.ipc.open_file(sorgente)
+        lotti = (lettore.get_batch(i) for i in range(lettore.num_record_batches))
+    for lotto in lotti:
+        for inizio in range(0, lotto.num_rows, dimensione_blocco):
+            parte = lotto.slice(inizio, dimensione_blocco)
+            yield pd.DataFrame({nome: pa.compute.fill_null(pa.compute.cast(colonna, pa.string()), "").to_numpy(zero_copy_only=False)
+                                for nome, colonna in zip(parte.schema.names, parte.columns)})
+
+
+def righe_file(sorgente, formato):
+    """Righe totali dai metadati del file, senza leggerne i dati."""
+    pa = _pyarrow()
+    sorgente = _apri(pa, sorgente)
+    if formato == "parquet":
+        return pa.parquet.ParquetFile(sorgente).metadata.num_rows
+    lettore = pa.ipc.open_file(sorgente)
+    return sum(lettore.get_batch(i).num_rows for i in range(lettore.num_record_batches))
@@ -0,0 +1,188 @@
+import functools
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from . import profilo
+from .migrations import migra
+
+DB_NAME = 'comics_pro.db'
+
+# --- PARAMETRI CONNESSIONE ---
+BUSY_TIMEOUT_MS = 5000
+
+# WAL: i lettori non bloccano lo scrittore; synchronous=NORMAL è sicuro in WAL.
+PRAGMAS = [
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("cache_size", -32000),        # ~32 MB di page cache per connessione
+    ("mmap_size", 268435456),      # 256 MB mappati in memoria
+    ("busy_timeout", BUSY_TIMEOUT_MS),  # attende invece di "database is locked"
+    ("temp_store", "MEMORY"),
+]
+
+POOL_SIZE = 4
+STATEMENT_CACHE = 256
+ATTESA_POOL = 30
+
+# --- POOL DI PROCESSO ---
+# Il modulo viene importato una sola volta per processo: lo stato qui sotto
+# sopravvive ai rerun di Streamlit ed è condiviso da tutte le sessioni.
+_pool = queue.LifoQueue()
+_lock = threading.Lock()
+_lock_schema = threading.Lock()
+_aperte = 0
+_generazione = 0
+_schema_pronto = False
+
+
+def _apri_connessione():
+    conn = sqlite3.connect(DB_NAME, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False,
+                           cached_statements=STATEMENT_CACHE)
+    for nome, valore in PRAGMAS:
+        conn.execute(f"PRAGMA {nome}={valore}")
+    _assicura_schema(conn)
+    return conn
+
+
+@profilo.cronometrato
+def _assicura_schema(conn):
+    """Porta lo schema all'ultima versione: una sola volta per processo (e dopo ogni ripristino)."""
+    global _schema_pronto
+    if _schema_pronto:
+        return
+    with _lock_schema:
+        if not _schema_pronto:
+            migra(conn)
+            _schema_pronto = True
+
+
+def _prendi():
+    global _aperte
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        pass
+    with _lock:
+        if _aperte < POOL_SIZE:
+            _aperte += 1
+            gen = _generazione
+            nuova = True
+        else:
+            nuova = False
+    if not nuova:
+        return _pool.get(timeout=ATTESA_POOL)
+    try:
+        return (gen, _apri_connessione())
+    except Exception:
+        with _lock:
+            _aperte -= 1
+        raise
+
+
+def _restituisci(voce):
+    global _aperte
+    gen, conn = voce
+    with _lock:
+        valida = gen == _generazione
+        if not valida:
+            _aperte -= 1
+    if valida:
+        _pool.put(voce)
+    else:
+        conn.close()
+
+
+@contextmanager
+def connessione():
+    """Presta una connessione dal pool condiviso: commit all'uscita, rollback in caso di errore."""
+    voce = _prendi()
+    conn = voce[1]
+    registro = profilo.corrente()
+    if registro is not None:
+        conn.set_trace_callback(registro.traccia_sql)
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if registro is not None:
+            conn.set_trace_callback(None)
+            registro.fine_sql()
+        _restituisci(voce)
+
+
+def chiudi_connessioni():
+    """Chiude tutte le connessioni del pool (da chiamare prima di sostituire o cancellare il file .db)."""
+    global _aperte, _generazione, _schema_pronto
+    with _lock:
+        _generazione += 1
+        _schema_pronto = False
+        while True:
+            try:
+                _, conn = _pool.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            _aperte -= 1
+
+
+def elimina_database():
+    """Cancella il file .db (con -wal e -shm): alla prossima connessione lo schema viene ricreato vuoto."""
+    chiudi_connessioni()
+    for f_db in (DB_NAME, DB_NAME + "-wal", DB_NAME + "-shm"):
+        if os.path.exists(f_db):
+            os.remove(f_db)
+
+
+@profilo.cronometrato
+def leggi_df(query, params=()):
+    with connessione() as conn:
+        df = pd.read_sql_query(query, conn, params=params)
+    profilo.conta_righe(len(df))
+    return df
+
+
+# --- CACHE PER VERSIONE DEI DATI ---
+# versione_dati è incrementata dai trigger a ogni scrittura su comics, series, subseries e list_options:
+# finché non cambia, i risultati memorizzati sono ancora validi.
+def versione_dati():
+    with connessione() as conn:
+        versione = conn.execute("SELECT versione FROM versione_dati").fetchone()[0]
+    return (_generazione, versione)
+
+
+def per_versione(fn):
+    """Memoizza fn (argomenti hashable) finché la versione dei dati non cambia.
+
+    Va applicato a funzioni definite in moduli importati: app.py viene rieseguito a ogni rerun
+    e ricreerebbe la cache ogni volta. I valori restituiti sono condivisi, non vanno modificati.
+    """
+    cache = {}
+    stato = {"versione": None}
+    lock = threading.Lock()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        chiave = (args, tuple(sorted(kwargs.items())))
+        versione = versione_dati()
+        with lock:
+            if stato["versione"] != versione:
+                cache.clear()
+                stato["versione"] = versione
+            elif chiave in cache:
+                return cache[chiave]
+        valore = fn(*args, **kwargs)
+        with lock:
+            if stato["versione"] == versione:
+                cache[chiave] = valore
+        return valore
+
+    wrapper.svuota = cache.clear
+    return wrapper
@@ -0,0 +1,262 @@
+import csv
+import os
+import sqlite3
+
+import pandas as pd
+
+# --- BACKEND DEL FOGLIO ---
+# La sincronizzazione parla con il foglio solo attraverso questi metodi: il foglio Google vero
+# (gspread) o un sostituto locale, CSV o SQLite, per i test e l'uso offline. Le righe sono
+# indicate per posizione (0 = prima riga dopo l'intestazione) e scritte come liste di testi.
+# Ogni chiamata costa una richiesta, contata in `richieste`.
+
+
+class Foglio:
+    nome = ""
+
+    def __init__(self):
+        self.richieste = 0
+
+    def revisione(self):
+        """Marca che cambia a ogni modifica del foglio (None se il backend non la conosce)."""
+        return None
+
+    def leggi(self):
+        """Tutto il foglio come DataFrame di testi, colonne dall'intestazione (vuoto se il foglio non esiste)."""
+        raise NotImplementedError
+
+    def aggiorna(self, intervalli):
+        """intervalli: [(prima posizione, righe)] da sovrascrivere, in un'unica richiesta."""
+        raise NotImplementedError
+
+    def elimina(self, intervalli):
+        """intervalli: [(prima, ultima posizione)] da togliere, dal fondo verso l'inizio."""
+        raise NotImplementedError
+
+    def accoda(self, righe):
+        raise NotImplementedError
+
+    def riscrivi(self, colonne, righe):
+        """Sostituisce l'intero foglio, intestazione compresa."""
+        raise NotImplementedError
+
+
+def _revisione_file(percorso):
+    try:
+        st = os.stat(percorso)
+    except FileNotFoundError:
+        return None
+    return f"{st.st_mtime_ns}-{st.st_size}"
+
+
+class FoglioCSV(Foglio):
+    """Foglio sostituito da un file CSV (separatore riconosciuto in lettura e mantenuto in scrittura)."""
+
+    def __init__(self, percorso, sep=";"):
+        super().__init__()
+        self.nome = self.percorso = percorso
+        self.sep = sep
+
+    def revisione(self):
+        return _revisione_file(self.percorso)
+
+    def _carica(self):
+        if not os.path.exists(self.percorso):
+            return [], []
+        with open(self.percorso, encoding="utf-8", newline="") as f:
+            intestazione = f.readline()
+            f.seek(0)
+            try:
+                self.sep = csv.Sniffer().sniff(intestazione, delimiters=";,\t").delimiter
+            except csv.Error:
+                pass  # una sola colonna o file vuoto: resta il separatore attuale
+            righe = list(csv.reader(f, delimiter=self.sep))
+        return (righe[0], righe[1:]) if righe else ([], [])
+
+    def _salva(self, colonne, righe):
+        tmp = f"{self.percorso}.tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            scrittore = csv.writer(f, delimiter=self.sep)
+            scrittore.writerow(colonne)
+            scrittore.writerows(righe)
+        os.replace(tmp, self.percorso)
+
+    def leggi(self):
+        self.richieste += 1
+        colonne, righe = self._carica()
+        return pd.DataFrame([r + [""] * (len(colonne) - len(r)) for r in righe], columns=colonne, dtype=object)
+
+    def aggiorna(self, intervalli):
+        self.richieste += 1
+        colonne, righe = self._carica()
+        for inizio, nuove in intervalli:
+            righe[inizio:inizio + len(nuove)] = nuove
+        self._salva(colonne, righe)
+
+    def elimina(self, intervalli):
+        self.richieste += 1
+        colonne, righe = self._carica()
+        for prima, ultima in intervalli:
+            del righe[prima:ultima + 1]
+        self._salva(colonne, righe)
+
+    def accoda(self, righe):
+        self.richieste += 1
+        colonne, esistenti = self._carica()
+        self._salva(colonne, esistenti + righe)
+
+    def riscrivi(self, colonne, righe):
+        self.richieste += 1
+        self._salva(colonne, righe)
+
+
+class FoglioSQLite(Foglio):
+    """Foglio sostituito dalla tabella `foglio` di un file SQLite (lo stesso formato degli snapshot di fumetti.py)."""
+
+    def __init__(self, percorso):
+        super().__init__()
+        self.nome = self.percorso = percorso
+
+    def revisione(self):
+        return _revisione_file(self.percorso)
+
+    def _apri(self):
+        return sqlite3.connect(self.percorso)
+
+    @staticmethod
+    def _righe(conn):
+        return [r[0] for r in conn.execute("SELECT rowid FROM foglio ORDER BY rowid")]
+
+    def leggi(self):
+        self.richieste += 1
+        if not os.path.exists(self.percorso):
+            return pd.DataFrame()
+        conn = self._apri()
+        try:
+            if not conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'foglio'").fetchone():
+                return pd.DataFrame()
+            return pd.read_sql_query("SELECT * FROM foglio ORDER BY rowid", conn).fillna("").astype(object)
+        finally:
+            conn.close()
+
+    def aggiorna(self, intervalli):
+        self.richieste += 1
+        conn = self._apri()
+        try:
+            colonne = [r[1] for r in conn.execute("PRAGMA table_info(foglio)")]
+            rowid = self._righe(conn)
+            assegnazioni = ", ".join(f'"{col}" = ?' for col in colonne)
+            conn.executemany(f"UPDATE foglio SET {assegnazioni} WHERE rowid = ?",
+                             [(*riga, rowid[inizio + i]) for inizio, righe in intervalli for i, riga in enumerate(righe)])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def elimina(self, intervalli):
+        self.richieste += 1
+        conn = self._apri()
+        try:
+            rowid = self._righe(conn)
+            conn.executemany("DELETE FROM foglio WHERE rowid BETWEEN ? AND ?",
+                             [(rowid[prima], rowid[ultima]) for prima, ultima in intervalli])
+            conn.commit()
+        finally:
+            conn.close()
+
+    def accoda(self, righe):
+        self.richieste += 1
+        conn = self._apri()
+        try:
+            n = len(conn.execute("PRAGMA table_info(foglio)").fetchall())
+            conn.executemany(f"INSERT INTO foglio VALUES ({', '.join('?' * n)})", righe)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def riscrivi(self, colonne, righe):
+        self.richieste += 1
+        conn = self._apri()
+        try:
+            definizioni = ", ".join(f'"{col}" TEXT' for col in colonne)
+            conn.execute("DROP TABLE IF EXISTS foglio")
+            conn.execute(f"CREATE TABLE foglio ({definizioni})")
+            conn.executemany(f"INSERT INTO foglio VALUES ({', '.join('?' * len(colonne))})", righe)
+            conn.commit()
+        finally:
+            conn.close()
+
+
+class FoglioGoogle(Foglio):
+    """Foglio Google via gspread (dipendenza di st-gsheets-connection), con le credenziali di un service account."""
+
+    def __init__(self, url, credenziali, worksheet=None):
+        super().__init__()
+        self.nome = url if worksheet is None else f"{url}#{worksheet}"
+        self._url = url
+        self._credenziali = {k: v for k, v in credenziali.items() if k not in ("spreadsheet", "worksheet")}
+        self._nome_worksheet = worksheet
+        self._ws = None
+
+    def _worksheet(self):
+        if self._ws is None:
+            import gspread
+
+            self._sh = gspread.service_account_from_dict(self._credenziali).open_by_url(self._url)
+            self._ws = self._sh.worksheet(self._nome_worksheet) if self._nome_worksheet else self._sh.sheet1
+        return self._ws
+
+    def revisione(self):
+        self._worksheet()
+        self.richieste += 1
+        return self._sh.get_lastUpdateTime()
+
+    def leggi(self):
+        valori = self._worksheet().get_all_values()
+        self.richieste += 1
+        if not valori:
+            return pd.DataFrame()
+        colonne = valori[0]
+        return pd.DataFrame([r + [""] * (len(colonne) - len(r)) for r in valori[1:]], columns=colonne, dtype=object)
+
+    @staticmethod
+    def _intervallo(prima_riga, righe, colonne):
+        from gspread.utils import rowcol_to_a1
+
+        return f"{rowcol_to_a1(prima_riga, 1)}:{rowcol_to_a1(prima_riga + righe - 1, colonne)}"
+
+    def aggiorna(self, intervalli):
+        ws = self._worksheet()
+        # Riga del foglio = posizione + 2 (la prima è l'intestazione)
+        ws.batch_update([{"range": self._intervallo(inizio + 2, len(righe), len(righe[0])), "values": righe}
+                         for inizio, righe in intervalli], value_input_option="RAW")
+        self.richieste += 1
+
+    def elimina(self, intervalli):
+        ws = self._worksheet()
+        self._sh.batch_update({"requests": [
+            {"deleteDimension": {"range": {"sheetId": ws.id, "dimension": "ROWS",
+                                           "startIndex": prima + 1, "endIndex": ultima + 2}}}
+            for prima, ultima in intervalli]})
+        self.richieste += 1
+
+    def accoda(self, righe):
+        self._worksheet().append_rows(righe, value_input_option="RAW")
+        self.richieste += 1
+
+    def riscrivi(self, colonne, righe):
+        ws = self._worksheet()
+        ws.clear()
+        ws.resize(rows=len(righe) + 1, cols=len(colonne))
+        ws.update(range_name="A1", values=[colonne] + righe, value_input_option="RAW")
+        self.richieste += 3
+
+
+def apri_foglio(indirizzo, credenziali=None, worksheet=None):
+    """Backend adatto all'indirizzo: URL di un foglio Google, file .db o file CSV."""
+    if indirizzo.startswith(("http://", "https://")):
+        if not credenziali:
+            raise ValueError("Per scrivere sul foglio Google servono le credenziali di un service account")
+        return FoglioGoogle(indirizzo, credenziali, worksheet)
+    if indirizzo.endswith(".db"):
+        return FoglioSQLite(indirizzo)
+    return FoglioCSV(indirizzo)
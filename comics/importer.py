@@ -0,0 +1,446 @@
+import codecs
+import io
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from . import colonnare
+from .db import connessione, per_versione
+from .migrations import NOMI_COLONNE_COMICS
+from .profilo import cronometrato
+from .scrittore import esegui
+
+# --- COLONNE IMPORT ---
+# Chiave naturale di un albo: le stesse colonne (case-insensitive) usate da sempre per riconoscere i duplicati
+CHIAVE = ["serie", "numero", "variante", "codice", "subserie", "titolo"]
+
+# Colonne sovrascritte quando la riga esiste già
+COLONNE_AGGIORNATE = [
+    "editore", "formato", "frequenza", "colore", "pagine", "prezzo_copertina", "valuta",
+    "giorno_uscita", "mese_uscita", "anno_uscita", "isbn", "note", "stato", "storage_box"
+]
+
+COLONNE_IMPORT = [
+    "serie", "subserie", "numero", "variante", "titolo", "editore", "formato", "frequenza", "colore",
+    "pagine", "prezzo_copertina", "valuta", "giorno_uscita", "mese_uscita", "anno_uscita",
+    "codice", "isbn", "stato", "storage_box", "note"
+]
+
+# Valore usato quando la colonna manca del tutto nel CSV
+DEFAULT_TESTO = {"subserie": "Nessuna", "frequenza": "Mensile", "colore": "B/N", "valuta": "Euro",
+                 "stato": "stock", "mese_uscita": "gennaio"}
+
+# In comics serie e subserie sono id: in staging vengono risolti (senza distinzione di maiuscole) prima del confronto
+_ID = {"serie": "serie_id", "subserie": "subserie_id"}
+
+
+def _chiave_sql(col, r=""):
+    if col in _ID:
+        return f"{r}{_ID[col]}"
+    return f"{r}{col}" if col == "numero" else f"lower({r}{col})"
+
+
+_MATCH_CHIAVE = " AND ".join(f"{_chiave_sql(col, 'c.')} = {_chiave_sql(col, 's.')}" for col in CHIAVE)
+_PARTIZIONE_CHIAVE = ", ".join(_chiave_sql(col) for col in CHIAVE)
+
+
+# --- NORMALIZZAZIONE VETTORIALE ---
+def _colonna(df, col, default=""):
+    if col in df.columns:
+        return df[col].astype(str)
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _intero(testo, default, virgola=True):
+    """Equivalente vettoriale di int(float(x)) con ripiego su default quando la conversione fallisce."""
+    if virgola:
+        testo = testo.str.replace(',', '.', regex=False)
+    num = pd.to_numeric(testo.str.strip(), errors='coerce').replace([np.inf, -np.inf], np.nan)
+    return np.trunc(num).fillna(default).astype('int64')
+
+
+def normalizza_import(df_import):
+    """Applica a tutto il DataFrame le stesse conversioni che l'import faceva riga per riga."""
+    out = pd.DataFrame(index=df_import.index)
+    for col in COLONNE_IMPORT:
+        if col in ("numero", "pagine", "prezzo_copertina", "giorno_uscita", "anno_uscita"):
+            continue
+        out[col] = _colonna(df_import, col, DEFAULT_TESTO.get(col, "")).str.strip()
+    out["stato"] = out["stato"].str.lower()
+    out["mese_uscita"] = out["mese_uscita"].str.lower()
+
+    out["numero"] = _intero(_colonna(df_import, "numero", "0"), 0)
+    out["pagine"] = _intero(_colonna(df_import, "pagine", "0"), 0)
+    out["giorno_uscita"] = _intero(_colonna(df_import, "giorno_uscita", "0"), 0, virgola=False)
+    out["anno_uscita"] = _intero(_colonna(df_import, "anno_uscita", "2025"), 2025, virgola=False)
+    prezzo = _colonna(df_import, "prezzo_copertina", "0").str.replace(',', '.', regex=False).str.strip()
+    out["prezzo_copertina"] = pd.to_numeric(prezzo, errors='coerce').fillna(0.0).astype(float)
+
+    valide = (out["serie"] != "") & (out["serie"].str.lower() != "nan")
+    return out[COLONNE_IMPORT], valide
+
+
+# --- SCRITTURA SET-BASED ---
+def _risolvi_serie(c):
+    """Dà a ogni riga di staging gli id di serie e sottoserie, creando in blocco quelle nuove.
+
+    Il confronto dei nomi ignora le maiuscole, come la chiave naturale (indici idx_series_lower e
+    idx_subseries_lower); una serie nuova prende il nome scritto nella sua prima riga del file.
+    """
+    c.execute("""INSERT INTO series (nome_serie)
+                 SELECT serie FROM (SELECT serie, MIN(riga) FROM import_staging GROUP BY lower(serie)) n
+                 WHERE NOT EXISTS (SELECT 1 FROM series WHERE lower(nome_serie) = lower(n.serie))""")
+    c.execute("""UPDATE import_staging
+                 SET serie_id = (SELECT MIN(id) FROM series WHERE lower(nome_serie) = lower(import_staging.serie))""")
+    c.execute("""INSERT INTO subseries (serie_id, nome_subserie)
+                 SELECT serie_id, subserie
+                 FROM (SELECT serie_id, subserie, MIN(riga) FROM import_staging GROUP BY serie_id, lower(subserie)) n
+                 WHERE NOT EXISTS (SELECT 1 FROM subseries
+                                   WHERE serie_id = n.serie_id AND lower(nome_subserie) = lower(n.subserie))""")
+    c.execute("""UPDATE import_staging
+                 SET subserie_id = (SELECT MIN(id) FROM subseries
+                                    WHERE serie_id = import_staging.serie_id
+                                      AND lower(nome_subserie) = lower(import_staging.subserie))""")
+
+
+def _scrivi_staging(conn, df_validi, righe):
+    c = conn.cursor()
+    c.execute("DROP TABLE IF EXISTS temp.import_staging")
+    c.execute(f"""CREATE TEMP TABLE import_staging
+                  (riga INTEGER PRIMARY KEY, {', '.join(COLONNE_IMPORT)},
+                   serie_id INTEGER, subserie_id INTEGER, primo INTEGER, ultimo INTEGER, esistente INTEGER)""")
+    valori = zip(righe, *(df_validi[col].tolist() for col in COLONNE_IMPORT))
+    c.executemany(f"INSERT INTO import_staging (riga, {', '.join(COLONNE_IMPORT)}) "
+                  f"VALUES (?{', ?' * len(COLONNE_IMPORT)})", valori)
+
+    _risolvi_serie(c)
+
+    # Righe ripetute nello stesso file: la prima inserisce, le successive aggiornano (vince l'ultima)
+    c.execute(f"""WITH gruppi AS (
+                      SELECT riga,
+                             MIN(riga) OVER w AS primo,
+                             MAX(riga) OVER w AS ultimo
+                      FROM import_staging
+                      WINDOW w AS (PARTITION BY {_PARTIZIONE_CHIAVE}))
+                  UPDATE import_staging SET primo = gruppi.primo, ultimo = gruppi.ultimo
+                  FROM gruppi WHERE gruppi.riga = import_staging.riga""")
+    # Risoluzione sulla chiave naturale tramite l'indice idx_comics_chiave
+    c.execute(f"""UPDATE import_staging AS s
+                  SET esistente = (SELECT MIN(c.id) FROM comics c WHERE {_MATCH_CHIAVE})
+                  WHERE s.riga = s.primo""")
+
+
+def _applica_staging(conn):
+    colonne_chiave = [_ID.get(col, col) for col in COLONNE_IMPORT if col not in COLONNE_AGGIORNATE]
+    select = [f"p.{col}" for col in colonne_chiave] + [f"u.{col}" for col in COLONNE_AGGIORNATE]
+    # La versione della riga sale solo se l'import ne cambia davvero il contenuto
+    cambiata = " OR ".join(f"{col} IS NOT excluded.{col}" for col in COLONNE_AGGIORNATE)
+    conn.execute(f"""INSERT INTO comics (id, {', '.join(colonne_chiave + COLONNE_AGGIORNATE)})
+                     SELECT p.esistente, {', '.join(select)}
+                     FROM import_staging p JOIN import_staging u ON u.riga = p.ultimo
+                     WHERE p.riga = p.primo
+                     ORDER BY p.riga
+                     ON CONFLICT(id) DO UPDATE SET
+                     {', '.join(f'{col} = excluded.{col}' for col in COLONNE_AGGIORNATE)},
+                     versione = versione + ({cambiata})""")
+    conn.execute("DROP TABLE temp.import_staging")
+
+
+def _normalizza_blocco(df_import, riga_iniziale):
+    """Parte senza database dell'import di un blocco: (righe normalizzate, maschera delle valide, numeri di riga)."""
+    df_import = df_import.reset_index(drop=True)
+    df_norm, valide = normalizza_import(df_import)
+    return df_norm, valide, (df_import.index + riga_iniziale).tolist()
+
+
+def _scrivi_blocco(conn, df_norm, valide, righe):
+    """Scrive un blocco già normalizzato dentro la transazione aperta su conn (operazione per esegui).
+
+    Restituisce il riepilogo {added, updated, skipped} e le righe di log del blocco.
+    """
+    summary = {"added": 0, "updated": 0, "skipped": 0}
+    df_validi = df_norm[valide]
+    righe_valide = [r for r, ok in zip(righe, valide.tolist()) if ok]
+
+    aggiunte = set()
+    if righe_valide:
+        _scrivi_staging(conn, df_validi, righe_valide)
+        aggiunte = {r for (r,) in conn.execute(
+            "SELECT riga FROM import_staging WHERE riga = primo AND esistente IS NULL")}
+        _applica_staging(conn)
+
+    logs = []
+    serie, numeri = df_norm["serie"].tolist(), df_norm["numero"].tolist()
+    for riga, ok, s, n in zip(righe, valide.tolist(), serie, numeri):
+        if not ok:
+            logs.append(f"❌ Riga {riga}: Saltata (Serie vuota).")
+            summary["skipped"] += 1
+        elif riga in aggiunte:
+            logs.append(f"✅ Riga {riga}: Aggiunto '{s} n.{n}'")
+            summary["added"] += 1
+        else:
+            logs.append(f"🔄 Riga {riga}: Aggiornato '{s} n.{n}'")
+            summary["updated"] += 1
+    return summary, logs
+
+
+# --- LETTURA A FLUSSO DEL CSV ---
+CODIFICHE = ['utf-8-sig', 'latin-1', 'cp1252']
+DIMENSIONE_CAMPIONE = 64 * 1024
+DIMENSIONE_BLOCCO = 5000
+
+
+def rileva_formato(campione):
+    """Codifica e separatore dedotti dai primi byte del file: (None, None) se nessuna codifica funziona."""
+    for enc in CODIFICHE:
+        try:
+            # final=False: un carattere multibyte spezzato a fine campione non è un errore
+            testo = codecs.getincrementaldecoder(enc)().decode(campione, final=False)
+            break
+        except UnicodeDecodeError:
+            continue
+    else:
+        return None, None
+    righe = testo.splitlines()
+    first_line = righe[0] if righe else ""
+    return enc, ';' if ';' in first_line else ','
+
+
+def _intestazioni(blocchi):
+    """Blocchi con le intestazioni normalizzate; ValueError se manca la colonna serie."""
+    for blocco in blocchi:
+        blocco = blocco.fillna("")
+        blocco.columns = [str(c).lower().strip().replace(' ', '_') for c in blocco.columns]
+        if 'serie' not in blocco.columns:
+            raise ValueError(f"Errore: Colonna 'serie' mancante. Colonne trovate: {list(blocco.columns)}")
+        yield blocco
+
+
+def _blocchi_csv(testo, sep, dimensione_blocco):
+    return _intestazioni(pd.read_csv(testo, sep=sep, dtype=str, chunksize=dimensione_blocco))
+
+
+def _blocchi_colonnari(sorgente, formato, dimensione_blocco):
+    # Parquet/Arrow: stessi blocchi di testo del CSV, la normalizzazione a valle non cambia
+    return _intestazioni(colonnare.blocchi_testo(sorgente, formato, dimensione_blocco))
+
+
+# --- IMPORT DI PIÙ FILE ---
+# Decodifica, separatore e normalizzazione (la parte pesante in CPU) girano in un pool di processi,
+# un file per processo; la scrittura passa dallo scrittore unico, un file alla volta e nell'ordine
+# dato, un blocco per operazione: tra un blocco e l'altro entrano le scritture delle altre sessioni,
+# che così non aspettano la fine di un file grande. I blocchi normalizzati passano dal worker allo
+# scrittore tramite un file temporaneo, così nessuno dei due tiene in memoria un file intero.
+def _normalizza_blocchi(blocchi, uscita):
+    riga_iniziale = 2
+    for blocco in blocchi:
+        pickle.dump(_normalizza_blocco(blocco, riga_iniziale), uscita, protocol=pickle.HIGHEST_PROTOCOL)
+        riga_iniziale += len(blocco)
+    return riga_iniziale - 2
+
+
+def _normalizza_file(sorgente, enc, sep, uscita, dimensione_blocco):
+    testo = io.TextIOWrapper(sorgente, encoding=enc, newline="")
+    try:
+        return _normalizza_blocchi(_blocchi_csv(testo, sep, dimensione_blocco), uscita)
+    finally:
+        testo.detach()
+
+
+def _prepara_colonnare(percorso, formato, dimensione_blocco):
+    # Il file va in memory map: niente decodifica né parsing, solo la normalizzazione dei blocchi
+    fd, blocchi = tempfile.mkstemp(prefix="import_", suffix=".blocchi")
+    try:
+        with os.fdopen(fd, "wb") as uscita:
+            righe = _normalizza_blocchi(_blocchi_colonnari(percorso, formato, dimensione_blocco), uscita)
+        return {"ok": True, "errore": None, "righe": righe, "blocchi": blocchi}
+    except (ValueError, ImportError) as e:
+        os.remove(blocchi)
+        return {"ok": False, "errore": str(e), "righe": 0, "blocchi": None}
+
+
+def prepara_file(percorso, dimensione_blocco=DIMENSIONE_BLOCCO):
+    """Eseguita nei processi del pool: legge e normalizza un CSV (o un Parquet/Arrow) senza toccare il database.
+
+    Restituisce {"ok", "errore", "righe", "blocchi"}: blocchi è il file temporaneo con i blocchi
+    normalizzati, da passare a scrivi_file (che lo cancella).
+    """
+    with open(percorso, "rb") as sorgente:
+        campione = sorgente.read(DIMENSIONE_CAMPIONE)
+        formato = colonnare.formato_file(campione)
+        if formato:
+            return _prepara_colonnare(percorso, formato, dimensione_blocco)
+        enc, sep = rileva_formato(campione)
+        if enc is None:
+            return {"ok": False, "errore": "Impossibile leggere il file: errore di codifica.", "righe": 0, "blocchi": None}
+        for enc in CODIFICHE[CODIFICHE.index(enc):]:
+            sorgente.seek(0)
+            fd, blocchi = tempfile.mkstemp(prefix="import_", suffix=".blocchi")
+            try:
+                with os.fdopen(fd, "wb") as uscita:
+                    righe = _normalizza_file(sorgente, enc, sep, uscita, dimensione_blocco)
+                return {"ok": True, "errore": None, "righe": righe, "blocchi": blocchi}
+            except UnicodeDecodeError:
+                os.remove(blocchi)
+            except ValueError as e:
+                os.remove(blocchi)
+                return {"ok": False, "errore": str(e), "righe": 0, "blocchi": None}
+    return {"ok": False, "errore": "Impossibile leggere il file: errore di codifica.", "righe": 0, "blocchi": None}
+
+
+def scrivi_file(preparato, log, progresso=None):
+    """Scrive tramite lo scrittore unico i blocchi prodotti da prepara_file. Restituisce (ok, {added, updated, skipped}).
+
+    Ogni blocco è una transazione a sé: se uno fallisce, quelli precedenti restano scritti.
+    progresso(righe scritte del file) viene chiamata dopo ogni blocco.
+    """
+    summary = {"added": 0, "updated": 0, "skipped": 0}
+    if not preparato["ok"]:
+        log.write(f"{preparato['errore']}\n")
+        return False, summary
+    try:
+        with open(preparato["blocchi"], "rb") as f:
+            while True:
+                try:
+                    df_norm, valide, righe = pickle.load(f)
+                except EOFError:
+                    break
+                parziale, righe_log = esegui(_scrivi_blocco, df_norm, valide, righe)
+                for chiave in summary:
+                    summary[chiave] += parziale[chiave]
+                if righe_log:
+                    log.write("\n".join(righe_log) + "\n")
+                if progresso:
+                    progresso(sum(summary.values()))
+    finally:
+        os.remove(preparato["blocchi"])
+    return True, summary
+
+
+def _preparati(percorsi, processi, dimensione_blocco):
+    # Risultati nell'ordine dei file, ciascuno appena pronto: lo scrittore lavora mentre il pool legge i successivi
+    if processi <= 1:
+        for percorso in percorsi:
+            yield prepara_file(percorso, dimensione_blocco)
+        return
+    # spawn: il fork di un processo con thread attivi (il server Streamlit) non è sicuro
+    with ProcessPoolExecutor(processi, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futuri = [pool.submit(prepara_file, percorso, dimensione_blocco) for percorso in percorsi]
+        try:
+            for futuro in futuri:
+                yield futuro.result()
+        finally:
+            # Interruzione a metà: i blocchi già preparati e non scritti non devono restare su disco
+            for futuro in futuri:
+                if not futuro.cancel() and futuro.done() and futuro.exception() is None:
+                    blocchi = futuro.result()["blocchi"]
+                    if blocchi and os.path.exists(blocchi):
+                        os.remove(blocchi)
+
+
+@cronometrato
+def importa_file(percorsi, nomi=None, processi=None, progresso=None, dimensione_blocco=DIMENSIONE_BLOCCO):
+    """Importa più CSV: lettura in parallelo, scrittura ordinata (una transazione per blocco).
+
+    nomi: come mostrare i file nel riepilogo (default: i percorsi); processi: default un processo per
+    file fino al numero di CPU; progresso(file_scritti, file_totali, righe, secondi, frazione) dopo ogni
+    blocco scritto, con frazione la parte dell'import completata (anche dentro un solo file grande).
+    Restituisce un esito per file: {file, ok, added, updated, skipped, log} con log il percorso del
+    file di log temporaneo di quel file.
+    """
+    nomi = nomi or list(percorsi)
+    processi = processi or min(len(percorsi), os.cpu_count() or 1)
+    esiti, righe, inizio = [], 0, time.monotonic()
+
+    def avanzamento(righe_file):
+        if not progresso:
+            return None
+        scritti, righe_prima = len(esiti), righe
+
+        def avanza(scritte):
+            frazione = (scritti + (scritte / righe_file if righe_file else 1)) / len(nomi)
+            progresso(scritti, len(nomi), righe_prima + scritte, time.monotonic() - inizio, min(frazione, 1.0))
+        return avanza
+
+    preparati = _preparati(percorsi, processi, dimensione_blocco)
+    for nome in nomi:
+        log = tempfile.NamedTemporaryFile("w", encoding="utf-8", prefix="import_", suffix=".log", delete=False)
+        with log:
+            try:
+                preparato = next(preparati)
+                ok, summary = scrivi_file(preparato, log, avanzamento(preparato["righe"]))
+            except Exception as e:
+                log.write(f"Errore critico: {str(e)}\n")
+                ok, summary = False, {"added": 0, "updated": 0, "skipped": 0}
+        esiti.append({"file": nome, "ok": ok, **summary, "log": log.name})
+        righe += sum(summary.values())
+        if progresso:
+            progresso(len(esiti), len(nomi), righe, time.monotonic() - inizio, len(esiti) / len(nomi))
+    preparati.close()
+    return esiti
+
+
+def import_csv_multipli(uploaded_files, progresso=None):
+    """Import dalla pagina Configurazione (uno o più file): gli upload vengono copiati su disco per i worker.
+
+    Restituisce (tutti ok, aggiunti, aggiornati, esiti per file).
+    """
+    copie = []
+    try:
+        for f in uploaded_files:
+            fd, percorso = tempfile.mkstemp(prefix="upload_", suffix=".csv")
+            with os.fdopen(fd, "wb") as out:
+                f.seek(0)
+                shutil.copyfileobj(f, out, 1024 * 1024)
+            copie.append(percorso)
+        esiti = importa_file(copie, [f.name for f in uploaded_files], progresso=progresso)
+    finally:
+        for percorso in copie:
+            os.remove(percorso)
+    return (all(e["ok"] for e in esiti), sum(e["added"] for e in esiti),
+            sum(e["updated"] for e in esiti), esiti)
+
+
+# --- ESPORTAZIONE ---
+COLONNE_EXPORT = NOMI_COLONNE_COMICS[1:]
+
+
+def esporta_csv(destinazione, sep=";", dimensione_blocco=DIMENSIONE_BLOCCO):
+    """Scrive la collezione in un file CSV di testo già aperto, a blocchi, nel formato accettato dall'import.
+
+    Restituisce le righe scritte.
+    """
+    righe = 0
+    with connessione() as conn:
+        for blocco in _blocchi_export(conn, dimensione_blocco):
+            blocco.to_csv(destinazione, sep=sep, index=False, header=righe == 0)
+            righe += len(blocco)
+    if righe == 0:
+        pd.DataFrame(columns=COLONNE_EXPORT).to_csv(destinazione, sep=sep, index=False)
+    return righe
+
+
+def _blocchi_export(conn, dimensione_blocco):
+    return pd.read_sql_query(f"""SELECT {', '.join(COLONNE_EXPORT)} FROM vista_comics_ordinata
+                                 ORDER BY serie, subserie, numero, id""", conn, chunksize=dimensione_blocco)
+
+
+def esporta_colonnare(destinazione, formato="parquet", dimensione_blocco=DIMENSIONE_BLOCCO):
+    """Scrive la collezione in Parquet o Arrow (percorso o file binario), un blocco alla volta. Restituisce le righe."""
+    with connessione() as conn:
+        return colonnare.scrivi(destinazione, _blocchi_export(conn, dimensione_blocco), COLONNE_EXPORT, formato)
+
+
+@per_versione
+def esportazione(formato):
+    """Il file Parquet o Arrow dell'intera collezione (bytes), rigenerato solo quando cambiano i dati."""
+    destinazione = io.BytesIO()
+    esporta_colonnare(destinazione, formato)
+    return destinazione.getvalue()
@@ -0,0 +1,468 @@
+# --- MIGRAZIONI DELLO SCHEMA ---
+# Versionate con PRAGMA user_version: la migrazione N porta il database dalla
+# versione N-1 alla N, quelle già applicate non vengono più eseguite.
+
+COLONNE_COMICS = """id INTEGER PRIMARY KEY AUTOINCREMENT,
+    serie TEXT, subserie TEXT, numero INTEGER, variante TEXT, titolo TEXT, editore TEXT,
+    formato TEXT, frequenza TEXT, colore TEXT, pagine INTEGER, prezzo_copertina REAL, valuta TEXT,
+    giorno_uscita INTEGER, mese_uscita TEXT, anno_uscita INTEGER,
+    codice TEXT, isbn TEXT, stato TEXT, storage_box TEXT, note TEXT"""
+
+# Colonne di un albo come le vede l'app: dalla v9 serie e subserie sono i nomi esposti da vista_comics
+NOMI_COLONNE_COMICS = [
+    "id", "serie", "subserie", "numero", "variante", "titolo", "editore",
+    "formato", "frequenza", "colore", "pagine", "prezzo_copertina", "valuta",
+    "giorno_uscita", "mese_uscita", "anno_uscita",
+    "codice", "isbn", "stato", "storage_box", "note"
+]
+
+
+def _v1_schema_iniziale(c):
+    """Schema storico di init_db: tabelle base, colonne aggiunte nel tempo e frequenze di default."""
+    c.execute('''CREATE TABLE IF NOT EXISTS comics
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                  serie TEXT, subserie TEXT, numero INTEGER, variante TEXT, titolo TEXT, editore TEXT,
+                  prezzo_copertina REAL, valuta TEXT,
+                  giorno_uscita INTEGER, mese_uscita TEXT, anno_uscita INTEGER,
+                  codice TEXT, isbn TEXT, note TEXT, stato TEXT, formato TEXT, storage_box TEXT,
+                  frequenza TEXT, colore TEXT, pagine INTEGER)''')
+    columns = [column[1] for column in c.execute("PRAGMA table_info(comics)").fetchall()]
+    cols_to_check = ['stato', 'codice', 'isbn', 'note', 'formato', 'editore', 'variante', 'storage_box',
+                     'giorno_uscita', 'mese_uscita', 'frequenza', 'colore', 'pagine', 'valuta']
+    for col in cols_to_check:
+        if col not in columns:
+            c.execute(f"ALTER TABLE comics ADD COLUMN {col} TEXT")
+
+    c.execute('''CREATE TABLE IF NOT EXISTS series (id INTEGER PRIMARY KEY AUTOINCREMENT, nome_serie TEXT UNIQUE)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS subseries
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, nome_subserie TEXT, serie_id INTEGER,
+                  FOREIGN KEY(serie_id) REFERENCES series(id))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS list_options (id INTEGER PRIMARY KEY AUTOINCREMENT, tipo TEXT, valore TEXT, UNIQUE(tipo, valore))''')
+    defaults = [('frequenza', 'Mensile'), ('frequenza', 'Bimestrale'), ('frequenza', 'Settimanale')]
+    c.executemany("INSERT OR IGNORE INTO list_options (tipo, valore) VALUES (?,?)", defaults)
+
+
+def _conserva_sequenza(c, seq):
+    """Riporta il contatore AUTOINCREMENT di comics (seq: la sua riga in sqlite_sequence prima della ricostruzione).
+
+    DROP TABLE toglie la riga e l'INSERT della copia la ricrea solo se ci sono albi: con comics vuota
+    gli id degli albi eliminati verrebbero riassegnati, confondendo giornale e sincronizzazione.
+    """
+    if seq is None:
+        return
+    if c.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'comics'", (seq[0],)).rowcount == 0:
+        c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('comics', ?)", (seq[0],))
+
+
+def _v2_comics_tipizzata(c):
+    """Ricostruisce comics con i tipi corretti (le colonne aggiunte con ALTER erano tutte TEXT) e crea gli indici."""
+    seq = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'comics'").fetchone()
+    c.execute(f"CREATE TABLE comics_new ({COLONNE_COMICS})")
+    colonne = ", ".join(NOMI_COLONNE_COMICS)
+    # L'affinità INTEGER/REAL della nuova tabella converte i numeri salvati come testo
+    c.execute(f"INSERT INTO comics_new ({colonne}) SELECT {colonne} FROM comics")
+    c.execute("DROP TABLE comics")
+    c.execute("ALTER TABLE comics_new RENAME TO comics")
+    _conserva_sequenza(c, seq)
+
+    c.execute("""CREATE INDEX idx_comics_chiave ON comics
+                 (lower(serie), numero, lower(variante), lower(codice), lower(subserie), lower(titolo))""")
+    c.execute("CREATE INDEX idx_comics_serie ON comics (serie, subserie, numero)")
+    c.execute("CREATE INDEX idx_comics_stato ON comics (stato)")
+    c.execute("CREATE INDEX idx_comics_box ON comics (storage_box)")
+    c.execute("CREATE INDEX idx_comics_anno ON comics (anno_uscita)")
+    c.execute("CREATE INDEX idx_comics_editore ON comics (editore)")
+
+
+def _v3_chiavi_ordinamento(c):
+    """Niente NULL nelle colonne di ordinamento: il cursore (serie, subserie, numero, id) li salterebbe."""
+    c.execute("UPDATE comics SET serie = '' WHERE serie IS NULL")
+    c.execute("UPDATE comics SET subserie = '' WHERE subserie IS NULL")
+    c.execute("UPDATE comics SET numero = 0 WHERE numero IS NULL")
+
+
+COLONNE_FTS = ["serie", "subserie", "titolo", "editore", "codice", "isbn", "note", "storage_box"]
+
+
+def crea_trigger_fts(c, calcolate=None):
+    """Trigger che tengono comics_fts (tabella FTS5 a contenuto esterno) allineata a comics.
+
+    calcolate: {colonna fts: (colonna di comics, espressione con {r})} per le colonne che non sono
+    copiate tali e quali da comics (dalla v9 i nomi di serie e sottoserie).
+    """
+    calcolate = calcolate or {}
+
+    def valori(r):
+        return ", ".join(calcolate[col][1].format(r=r) if col in calcolate else f"{r}.{col}" for col in COLONNE_FTS)
+
+    colonne = ", ".join(COLONNE_FTS)
+    sorgenti = ", ".join(calcolate[col][0] if col in calcolate else col for col in COLONNE_FTS)
+    nuovi, vecchi = valori("new"), valori("old")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS comics_fts_ai AFTER INSERT ON comics BEGIN
+                      INSERT INTO comics_fts (rowid, {colonne}) VALUES (new.id, {nuovi});
+                  END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS comics_fts_ad AFTER DELETE ON comics BEGIN
+                      INSERT INTO comics_fts (comics_fts, rowid, {colonne}) VALUES ('delete', old.id, {vecchi});
+                  END""")
+    c.execute(f"""CREATE TRIGGER IF NOT EXISTS comics_fts_au AFTER UPDATE OF {sorgenti} ON comics BEGIN
+                      INSERT INTO comics_fts (comics_fts, rowid, {colonne}) VALUES ('delete', old.id, {vecchi});
+                      INSERT INTO comics_fts (rowid, {colonne}) VALUES (new.id, {nuovi});
+                  END""")
+
+
+def _v4_ricerca_fts(c):
+    """Indice full-text FTS5 per la ricerca testuale dell'Archivio, con indici di prefisso."""
+    c.execute(f"""CREATE VIRTUAL TABLE comics_fts USING fts5
+                  ({', '.join(COLONNE_FTS)}, content='comics', content_rowid='id',
+                   tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    crea_trigger_fts(c)
+    c.execute("INSERT INTO comics_fts (comics_fts) VALUES ('rebuild')")
+
+
+TABELLE_VERSIONATE = ["comics", "series", "subseries", "list_options"]
+
+
+def crea_trigger_versione(c, tabella):
+    """Ogni scrittura su tabella incrementa versione_dati (invalida le cache lato app)."""
+    for evento, sigla in (("INSERT", "ai"), ("UPDATE", "au"), ("DELETE", "ad")):
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {tabella}_versione_{sigla} AFTER {evento} ON {tabella} BEGIN
+                          UPDATE versione_dati SET versione = versione + 1;
+                      END""")
+
+
+def _v5_versione_dati(c):
+    """Contatore delle scritture mantenuto dai trigger, usato come chiave delle cache."""
+    c.execute("CREATE TABLE versione_dati (id INTEGER PRIMARY KEY CHECK (id = 1), versione INTEGER NOT NULL)")
+    c.execute("INSERT INTO versione_dati (id, versione) VALUES (1, 0)")
+    for tabella in TABELLE_VERSIONATE:
+        crea_trigger_versione(c, tabella)
+
+
+# Tabelle riepilogative -> colonne del raggruppamento (per nome fino alla v8, per id dalla v9)
+TABELLE_STATISTICHE_V6 = {"stat_serie": ["serie"], "stat_subserie": ["serie", "subserie"]}
+TABELLE_STATISTICHE = {"stat_serie": ["serie_id"], "stat_subserie": ["serie_id", "subserie_id"]}
+
+
+def crea_trigger_statistiche(c, tabelle=TABELLE_STATISTICHE):
+    """Trigger che aggiornano in modo incrementale stat_serie e stat_subserie a ogni scrittura su comics."""
+    raggruppate = ", ".join(dict.fromkeys(col for gruppo in tabelle.values() for col in gruppo))
+    for tabella, gruppo in tabelle.items():
+        chiave = ", ".join(gruppo)
+
+        def aggiungi(r):
+            valori = ", ".join(f"IFNULL({r}.{col}, '')" for col in gruppo)
+            return f"""INSERT INTO {tabella} ({chiave}, totale, in_stock, valore_euro)
+                       VALUES ({valori}, 1, {r}.stato IS 'stock',
+                               CASE WHEN {r}.valuta IS 'Euro' THEN IFNULL({r}.prezzo_copertina, 0) ELSE 0 END)
+                       ON CONFLICT ({chiave}) DO UPDATE SET
+                           totale = totale + excluded.totale,
+                           in_stock = in_stock + excluded.in_stock,
+                           valore_euro = valore_euro + excluded.valore_euro;"""
+
+        def togli(r):
+            filtro = " AND ".join(f"{col} = IFNULL({r}.{col}, '')" for col in gruppo)
+            return f"""UPDATE {tabella} SET
+                           totale = totale - 1,
+                           in_stock = in_stock - ({r}.stato IS 'stock'),
+                           valore_euro = valore_euro
+                               - CASE WHEN {r}.valuta IS 'Euro' THEN IFNULL({r}.prezzo_copertina, 0) ELSE 0 END
+                       WHERE {filtro};
+                       DELETE FROM {tabella} WHERE {filtro} AND totale <= 0;"""
+
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {tabella}_ai AFTER INSERT ON comics BEGIN
+                          {aggiungi('new')}
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {tabella}_ad AFTER DELETE ON comics BEGIN
+                          {togli('old')}
+                      END""")
+        c.execute(f"""CREATE TRIGGER IF NOT EXISTS {tabella}_au
+                      AFTER UPDATE OF {raggruppate}, stato, valuta, prezzo_copertina ON comics BEGIN
+                          {togli('old')}
+                          {aggiungi('new')}
+                      END""")
+
+
+def ricostruisci_statistiche(c, tabelle=TABELLE_STATISTICHE):
+    """Ricalcola da zero le tabelle riepilogative (database esistenti o dopo interventi manuali)."""
+    for tabella, gruppo in tabelle.items():
+        chiave = ", ".join(gruppo)
+        valori = ", ".join(f"IFNULL({col}, '')" for col in gruppo)
+        c.execute(f"DELETE FROM {tabella}")
+        c.execute(f"""INSERT INTO {tabella} ({chiave}, totale, in_stock, valore_euro)
+                      SELECT {valori}, COUNT(*), SUM(stato IS 'stock'),
+                             TOTAL(CASE WHEN valuta IS 'Euro' THEN IFNULL(prezzo_copertina, 0) ELSE 0 END)
+                      FROM comics GROUP BY {valori}""")
+
+
+def _v6_statistiche(c):
+    """Riepiloghi per serie e per (serie, subserie) mantenuti dai trigger."""
+    c.execute("""CREATE TABLE stat_serie
+                 (serie TEXT PRIMARY KEY, totale INTEGER NOT NULL, in_stock INTEGER NOT NULL,
+                  valore_euro REAL NOT NULL) WITHOUT ROWID""")
+    c.execute("""CREATE TABLE stat_subserie
+                 (serie TEXT, subserie TEXT, totale INTEGER NOT NULL, in_stock INTEGER NOT NULL,
+                  valore_euro REAL NOT NULL, PRIMARY KEY (serie, subserie)) WITHOUT ROWID""")
+    crea_trigger_statistiche(c, TABELLE_STATISTICHE_V6)
+    ricostruisci_statistiche(c, TABELLE_STATISTICHE_V6)
+
+
+# Tabelle sorvegliate dal giornale delle modifiche (base dei backup incrementali)
+TABELLE_GIORNALE = ["comics", "series", "subseries", "list_options"]
+
+# Istante corrente in secondi Unix con decimali (unixepoch('subsec') richiede SQLite 3.42)
+ADESSO = "((julianday('now') - 2440587.5) * 86400.0)"
+
+
+def crea_trigger_giornale(c, tabella):
+    """Trigger che registrano in giornale ogni scrittura su tabella.
+
+    INSERT e DELETE salvano la riga intera, UPDATE solo le colonne cambiate (un UPDATE che non
+    cambia nulla non lascia traccia). Le colonne sono lette dallo schema: una migrazione che
+    cambia le colonne di tabella deve richiamare questa funzione.
+    """
+    colonne = [r[1] for r in c.execute(f"PRAGMA table_info({tabella})")]
+
+    def riga(r):
+        return "json_object(" + ", ".join(f"'{col}', {r}.{col}" for col in colonne) + ")"
+
+    cambiate = " UNION ALL ".join(
+        f"SELECT '{col}' AS k, new.{col} AS v WHERE old.{col} IS NOT new.{col}" for col in colonne)
+    diverse = " OR ".join(f"old.{col} IS NOT new.{col}" for col in colonne)
+    inserisci = f"INSERT INTO giornale (tabella, operazione, riga, dati, istante) VALUES ('{tabella}'"
+    for sigla in ("ai", "au", "ad"):
+        c.execute(f"DROP TRIGGER IF EXISTS {tabella}_giornale_{sigla}")
+    c.execute(f"""CREATE TRIGGER {tabella}_giornale_ai AFTER INSERT ON {tabella} BEGIN
+                      {inserisci}, 'I', new.id, {riga('new')}, {ADESSO});
+                  END""")
+    c.execute(f"""CREATE TRIGGER {tabella}_giornale_au AFTER UPDATE ON {tabella} WHEN {diverse} BEGIN
+                      {inserisci}, 'U', old.id, (SELECT json_group_object(k, v) FROM ({cambiate})), {ADESSO});
+                  END""")
+    c.execute(f"""CREATE TRIGGER {tabella}_giornale_ad AFTER DELETE ON {tabella} BEGIN
+                      {inserisci}, 'D', old.id, {riga('old')}, {ADESSO});
+                  END""")
+
+
+def _v7_giornale(c):
+    """Giornale append-only delle scritture e punti di controllo dei backup."""
+    c.execute("""CREATE TABLE giornale
+                 (seq INTEGER PRIMARY KEY AUTOINCREMENT, tabella TEXT NOT NULL,
+                  operazione TEXT NOT NULL CHECK (operazione IN ('I', 'U', 'D')),
+                  riga INTEGER NOT NULL, dati TEXT NOT NULL, istante REAL NOT NULL)""")
+    c.execute("""CREATE TABLE checkpoint_backup
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, seq INTEGER NOT NULL,
+                  tipo TEXT NOT NULL, istante REAL NOT NULL)""")
+    for tabella in TABELLE_GIORNALE:
+        crea_trigger_giornale(c, tabella)
+
+
+def _v8_versione_righe(c):
+    """Versione per riga di comics (la incrementano gli UPDATE dell'app): riconosce le modifiche fatte su dati vecchi."""
+    c.execute("ALTER TABLE comics ADD COLUMN versione INTEGER NOT NULL DEFAULT 1")
+    crea_trigger_giornale(c, "comics")
+
+
+# Dalla v9 comics tiene gli id di serie e sottoserie: i nomi arrivano dalle viste
+NOMI_FTS = {"serie": ("serie_id", "(SELECT nome_serie FROM series WHERE id = {r}.serie_id)"),
+            "subserie": ("subserie_id", "(SELECT nome_subserie FROM subseries WHERE id = {r}.subserie_id)")}
+
+
+COLONNE_EXTRA_VISTA_V9 = ["versione", "serie_id", "subserie_id"]
+
+
+def crea_viste(c, extra=COLONNE_EXTRA_VISTA_V9):
+    """vista_comics e vista_comics_ordinata: le colonne di NOMI_COLONNE_COMICS più quelle in extra."""
+    nomi = {"serie": "s.nome_serie AS serie", "subserie": "ss.nome_subserie AS subserie"}
+    colonne = ", ".join([nomi.get(col, f"c.{col}") for col in NOMI_COLONNE_COMICS] + [f"c.{col}" for col in extra])
+    c.execute("DROP VIEW IF EXISTS vista_comics")
+    c.execute("DROP VIEW IF EXISTS vista_comics_ordinata")
+    c.execute(f"""CREATE VIEW vista_comics AS SELECT {colonne}
+                  FROM comics c
+                  JOIN series s ON s.id = c.serie_id
+                  JOIN subseries ss ON ss.id = c.subserie_id""")
+    c.execute(f"""CREATE VIEW vista_comics_ordinata AS SELECT {colonne}
+                  FROM series s
+                  CROSS JOIN subseries ss ON ss.serie_id = s.id
+                  CROSS JOIN comics c ON c.serie_id = s.id AND c.subserie_id = ss.id""")
+
+
+def _unisci_varianti_maiuscole(c):
+    """Unisce le serie che differiscono solo per le maiuscole, e le sottoserie di una stessa serie.
+
+    Resta la riga con l'id più basso: comics e subseries vengono spostati su quella e i doppioni tolti.
+    Gli albi spostati cambiano versione, così un editor aperto prima dell'unione va in conflitto.
+    """
+    c.execute("""CREATE TEMP TABLE unione_subserie AS
+                 SELECT ss.id, ss.nome_subserie AS nome,
+                        (SELECT MIN(t.id) FROM series t WHERE lower(t.nome_serie) = lower(s.nome_serie)) AS serie
+                 FROM subseries ss JOIN series s ON s.id = ss.serie_id""")
+    c.execute("""CREATE TEMP TABLE mappa_subserie AS
+                 SELECT u.id AS vecchia, u.serie,
+                        (SELECT MIN(v.id) FROM unione_subserie v WHERE v.serie = u.serie AND lower(v.nome) = lower(u.nome)) AS nuova
+                 FROM unione_subserie u""")
+    c.execute("""UPDATE comics SET serie_id = m.serie, subserie_id = m.nuova, versione = versione + 1
+                 FROM mappa_subserie m
+                 WHERE comics.subserie_id = m.vecchia AND (comics.serie_id <> m.serie OR m.nuova <> m.vecchia)""")
+    c.execute("""UPDATE subseries SET serie_id = m.serie FROM mappa_subserie m
+                 WHERE subseries.id = m.vecchia AND m.nuova = m.vecchia AND subseries.serie_id <> m.serie""")
+    c.execute("DELETE FROM subseries WHERE id IN (SELECT vecchia FROM mappa_subserie WHERE nuova <> vecchia)")
+    c.execute("DELETE FROM series WHERE id NOT IN (SELECT MIN(id) FROM series GROUP BY lower(nome_serie))")
+    c.execute("DROP TABLE unione_subserie")
+    c.execute("DROP TABLE mappa_subserie")
+
+
+def _v9_serie_normalizzate(c):
+    """serie e subserie di comics diventano chiavi esterne su series e subseries.
+
+    Ogni nome presente in comics ottiene la sua riga; le sottoserie doppie o senza serie vengono tolte
+    prima dell'indice univoco (serie_id, nome_subserie). I nomi che differiscono solo per le maiuscole
+    finiscono poi in una sola riga, la prima: l'app risolve i nomi senza distinguere le maiuscole.
+    vista_comics rimette i nomi al posto degli id; vista_comics_ordinata fa lo stesso partendo dagli
+    indici sui nomi, così le letture ordinate per (serie, subserie, numero) non ordinano tutta la tabella.
+    """
+    # In ordine di primo albo: tra le varianti di maiuscole resta la grafia usata per prima
+    c.execute("""INSERT OR IGNORE INTO series (nome_serie)
+                 SELECT IFNULL(serie, '') FROM comics GROUP BY IFNULL(serie, '') ORDER BY MIN(id)""")
+    c.execute("""DELETE FROM subseries
+                 WHERE serie_id NOT IN (SELECT id FROM series) OR nome_subserie IS NULL
+                    OR id NOT IN (SELECT MIN(id) FROM subseries GROUP BY serie_id, nome_subserie)""")
+    c.execute("CREATE UNIQUE INDEX idx_subseries_nome ON subseries (serie_id, nome_subserie)")
+    # Per risolvere i nomi dell'import senza distinzione di maiuscole
+    c.execute("CREATE INDEX idx_series_lower ON series (lower(nome_serie))")
+    c.execute("CREATE INDEX idx_subseries_lower ON subseries (serie_id, lower(nome_subserie))")
+    c.execute("""INSERT OR IGNORE INTO subseries (serie_id, nome_subserie)
+                 SELECT s.id, IFNULL(c.subserie, '') FROM comics c JOIN series s ON s.nome_serie = IFNULL(c.serie, '')
+                 GROUP BY s.id, IFNULL(c.subserie, '') ORDER BY MIN(c.id)""")
+
+    seq = c.execute("SELECT seq FROM sqlite_sequence WHERE name = 'comics'").fetchone()
+    c.execute("DROP TABLE comics_fts")
+    c.execute("""CREATE TABLE comics_new (
+                      id INTEGER PRIMARY KEY AUTOINCREMENT,
+                      serie_id INTEGER NOT NULL REFERENCES series(id),
+                      subserie_id INTEGER NOT NULL REFERENCES subseries(id),
+                      numero INTEGER, variante TEXT, titolo TEXT, editore TEXT,
+                      formato TEXT, frequenza TEXT, colore TEXT, pagine INTEGER, prezzo_copertina REAL, valuta TEXT,
+                      giorno_uscita INTEGER, mese_uscita TEXT, anno_uscita INTEGER,
+                      codice TEXT, isbn TEXT, stato TEXT, storage_box TEXT, note TEXT,
+                      versione INTEGER NOT NULL DEFAULT 1)""")
+    altre = [col for col in NOMI_COLONNE_COMICS if col not in ("id", "serie", "subserie")] + ["versione"]
+    c.execute(f"""INSERT INTO comics_new (id, serie_id, subserie_id, {', '.join(altre)})
+                  SELECT c.id, s.id, ss.id, {', '.join(f'c.{col}' for col in altre)}
+                  FROM comics c
+                  JOIN series s ON s.nome_serie = IFNULL(c.serie, '')
+                  JOIN subseries ss ON ss.serie_id = s.id AND ss.nome_subserie = IFNULL(c.subserie, '')""")
+    c.execute("DROP TABLE comics")
+    c.execute("ALTER TABLE comics_new RENAME TO comics")
+    _conserva_sequenza(c, seq)
+    _unisci_varianti_maiuscole(c)
+
+    c.execute("""CREATE INDEX idx_comics_chiave ON comics
+                 (serie_id, numero, lower(variante), lower(codice), subserie_id, lower(titolo))""")
+    c.execute("CREATE INDEX idx_comics_serie ON comics (serie_id, subserie_id, numero)")
+    c.execute("CREATE INDEX idx_comics_stato ON comics (stato)")
+    c.execute("CREATE INDEX idx_comics_box ON comics (storage_box)")
+    c.execute("CREATE INDEX idx_comics_anno ON comics (anno_uscita)")
+    c.execute("CREATE INDEX idx_comics_editore ON comics (editore)")
+
+    crea_viste(c)
+
+    c.execute(f"""CREATE VIRTUAL TABLE comics_fts USING fts5
+                  ({', '.join(COLONNE_FTS)}, content='vista_comics', content_rowid='id',
+                   tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+    crea_trigger_fts(c, NOMI_FTS)
+    c.execute("INSERT INTO comics_fts (comics_fts) VALUES ('rebuild')")
+    crea_trigger_versione(c, "comics")
+    crea_trigger_giornale(c, "comics")
+    c.execute("DROP TABLE stat_serie")
+    c.execute("DROP TABLE stat_subserie")
+    c.execute("""CREATE TABLE stat_serie
+                 (serie_id INTEGER PRIMARY KEY, totale INTEGER NOT NULL, in_stock INTEGER NOT NULL,
+                  valore_euro REAL NOT NULL) WITHOUT ROWID""")
+    c.execute("""CREATE TABLE stat_subserie
+                 (serie_id INTEGER, subserie_id INTEGER, totale INTEGER NOT NULL, in_stock INTEGER NOT NULL,
+                  valore_euro REAL NOT NULL, PRIMARY KEY (serie_id, subserie_id)) WITHOUT ROWID""")
+    crea_trigger_statistiche(c)
+    ricostruisci_statistiche(c)
+    # Statistiche del planner ferme alle tabelle di prima: porterebbero a piani senza gli indici nuovi
+    if c.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+        c.execute("ANALYZE")
+
+
+def _v10_sincronizzazione_foglio(c):
+    """Stato della sincronizzazione con il foglio: l'ultimo contenuto concordato di ogni riga e i checkpoint."""
+    c.execute("""CREATE TABLE righe_foglio
+                 (foglio TEXT NOT NULL, id INTEGER NOT NULL, chiave TEXT NOT NULL, hash TEXT NOT NULL,
+                  riga INTEGER NOT NULL, PRIMARY KEY (foglio, id)) WITHOUT ROWID""")
+    c.execute("""CREATE TABLE checkpoint_foglio
+                 (id INTEGER PRIMARY KEY AUTOINCREMENT, foglio TEXT NOT NULL, revisione TEXT,
+                  seq INTEGER NOT NULL, righe INTEGER NOT NULL, istante REAL NOT NULL,
+                  inviate INTEGER NOT NULL, ricevute INTEGER NOT NULL, conflitti INTEGER NOT NULL)""")
+    c.execute("CREATE INDEX idx_checkpoint_foglio ON checkpoint_foglio (foglio, id)")
+
+
+# Data di uscita come intero AAAAMMGG, con 00 al posto di giorno o mese mancanti (anno mancante: NULL).
+# I nomi dei mesi sono fissati qui: la colonna deve restare quella creata dalla migrazione.
+_MESI_V11 = ["gennaio", "febbraio", "marzo", "aprile", "maggio", "giugno",
+             "luglio", "agosto", "settembre", "ottobre", "novembre", "dicembre"]
+DATA_USCITA = f"""CASE WHEN anno_uscita > 0 THEN anno_uscita * 10000
+    + (CASE lower(trim(mese_uscita)) {' '.join(f"WHEN '{m}' THEN {n}" for n, m in enumerate(_MESI_V11, start=1))} ELSE 0 END) * 100
+    + (CASE WHEN giorno_uscita BETWEEN 1 AND 31 THEN giorno_uscita ELSE 0 END) END"""
+
+
+def _v11_data_uscita(c):
+    """data_uscita: colonna generata e indicizzata, per ordinare e filtrare per intervalli di date.
+
+    Virtuale: la calcola SQLite a ogni scrittura, le righe esistenti la ricevono con la creazione
+    dell'indice. PRAGMA table_info non la mostra, quindi giornale e backup non la registrano.
+    L'indice parziale sugli albi in stock serve ai numeri mancanti calcolati solo su quelli.
+    """
+    c.execute(f"ALTER TABLE comics ADD COLUMN data_uscita INTEGER GENERATED ALWAYS AS ({DATA_USCITA}) VIRTUAL")
+    c.execute("CREATE INDEX idx_comics_data ON comics (data_uscita)")
+    c.execute("CREATE INDEX idx_comics_serie_stock ON comics (serie_id, subserie_id, numero) WHERE stato = 'stock'")
+    crea_viste(c, COLONNE_EXTRA_VISTA_V9 + ["data_uscita"])
+
+
+def _v12_serie_senza_varianti_maiuscole(c):
+    """Unisce le varianti di maiuscole lasciate dalla v9 nei database migrati prima che lo facesse."""
+    _unisci_varianti_maiuscole(c)
+    ricostruisci_statistiche(c)
+
+
+MIGRAZIONI = [
+    _v1_schema_iniziale,
+    _v2_comics_tipizzata,
+    _v3_chiavi_ordinamento,
+    _v4_ricerca_fts,
+    _v5_versione_dati,
+    _v6_statistiche,
+    _v7_giornale,
+    _v8_versione_righe,
+    _v9_serie_normalizzate,
+    _v10_sincronizzazione_foglio,
+    _v11_data_uscita,
+    _v12_serie_senza_varianti_maiuscole,
+]
+
+VERSIONE_SCHEMA = len(MIGRAZIONI)
+
+
+def versione(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migra(conn):
+    """Applica le migrazioni mancanti, ciascuna nella propria transazione."""
+    if versione(conn) >= VERSIONE_SCHEMA:
+        return
+    c = conn.cursor()
+    for numero, migrazione in enumerate(MIGRAZIONI, start=1):
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # Riletta sotto lock: un altro processo potrebbe averla già applicata
+            if versione(conn) < numero:
+                migrazione(c)
+                c.execute(f"PRAGMA user_version = {numero}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+    c.execute("PRAGMA optimize")
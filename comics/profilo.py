@@ -0,0 +1,123 @@
+import functools
+import json
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# --- PROFILO PER RERUN ---
+# Un Registro raccoglie i tempi di un'esecuzione dello script (sezioni, funzioni, istruzioni SQL).
+# È legato al thread che lo attiva: Streamlit esegue ogni rerun di una sessione in un thread,
+# così le sessioni non si mescolano e i thread in background (snapshot del foglio) non vengono misurati.
+# Senza un registro attivo sezione() e cronometrato() non fanno quasi nulla.
+SQL_IN_RIEPILOGO = 10
+LUNGHEZZA_SQL = 160
+
+_locale = threading.local()
+_lock_log = threading.Lock()
+
+# I valori legati compaiono nel testo tracciato: li tolgo per raggruppare le istruzioni uguali
+_LETTERALI = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPAZI = re.compile(r"\s+")
+
+
+def normalizza_sql(sql):
+    return _SPAZI.sub(" ", _LETTERALI.sub("?", sql)).strip()[:LUNGHEZZA_SQL]
+
+
+class Registro:
+    """Tempi di un rerun: sezioni nominate (tempi inclusivi, si possono annidare) e istruzioni SQL."""
+
+    def __init__(self, etichetta=""):
+        self.etichetta = etichetta
+        self.inizio = time.time()
+        self._partenza = time.perf_counter()
+        self.sezioni = {}   # nome -> [chiamate, secondi]
+        self.sql = {}       # istruzione normalizzata -> [chiamate, secondi]
+        self.righe = 0
+        self._sql_aperta = None
+
+    def aggiungi(self, nome, secondi):
+        voce = self.sezioni.setdefault(nome, [0, 0.0])
+        voce[0] += 1
+        voce[1] += secondi
+
+    # Callback di Connection.set_trace_callback: arriva solo l'inizio di ogni istruzione,
+    # la durata è misurata fino all'istruzione successiva o alla restituzione della connessione
+    # (comprende quindi anche il fetch delle righe).
+    def traccia_sql(self, sql):
+        self.fine_sql()
+        self._sql_aperta = (normalizza_sql(sql), time.perf_counter())
+
+    def fine_sql(self):
+        if self._sql_aperta is None:
+            return
+        sql, partenza = self._sql_aperta
+        self._sql_aperta = None
+        voce = self.sql.setdefault(sql, [0, 0.0])
+        voce[0] += 1
+        voce[1] += time.perf_counter() - partenza
+
+    def riepilogo(self, interrotto=False):
+        """Dizionario serializzabile in JSON, con le sezioni e le istruzioni più lente in testa."""
+        self.fine_sql()
+        sezioni = sorted(self.sezioni.items(), key=lambda x: -x[1][1])
+        istruzioni = sorted(self.sql.items(), key=lambda x: -x[1][1])
+        return {
+            "etichetta": self.etichetta,
+            "inizio": self.inizio,
+            "secondi": time.perf_counter() - self._partenza,
+            "interrotto": interrotto,
+            "sezioni": [{"nome": n, "chiamate": c, "secondi": s} for n, (c, s) in sezioni],
+            "query": sum(c for c, _ in self.sql.values()),
+            "secondi_sql": sum(s for _, s in self.sql.values()),
+            "righe": self.righe,
+            "sql": [{"sql": q, "chiamate": c, "secondi": s} for q, (c, s) in istruzioni[:SQL_IN_RIEPILOGO]],
+        }
+
+
+def attiva(registro):
+    """Rende registro quello corrente per il thread (None per disattivare il profilo)."""
+    _locale.registro = registro
+    return registro
+
+
+def corrente():
+    return getattr(_locale, "registro", None)
+
+
+@contextmanager
+def sezione(nome):
+    registro = corrente()
+    if registro is None:
+        yield
+        return
+    partenza = time.perf_counter()
+    try:
+        yield
+    finally:
+        registro.aggiungi(nome, time.perf_counter() - partenza)
+
+
+def cronometrato(fn):
+    """Decoratore: il tempo di ogni chiamata finisce nel registro corrente come sezione modulo.funzione."""
+    nome = f"{fn.__module__}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with sezione(nome):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def conta_righe(n):
+    registro = corrente()
+    if registro is not None:
+        registro.righe += n
+
+
+def scrivi_jsonl(percorso, riepilogo):
+    """Aggiunge il riepilogo come riga JSON al file di log."""
+    with _lock_log:
+        with open(percorso, "a", encoding="utf-8") as f:
+            f.write(json.dumps(riepilogo, ensure_ascii=False) + "\n")
@@ -0,0 +1,98 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from .db import connessione
+
+# --- SCRITTORE UNICO ---
+# Le scritture di tutte le sessioni passano da una coda servita da un solo thread: niente attese
+# sul lock di SQLite tra sessioni. Le richieste arrivate mentre una transazione è in corso vengono
+# scritte insieme nella successiva (group commit, un solo commit per gruppo). Ogni operazione gira
+# nel proprio SAVEPOINT: se fallisce annulla solo se stessa, non le altre del gruppo.
+# La manutenzione che non può stare in una transazione condivisa (ripristino del file, VACUUM) passa
+# dalla stessa coda con esegui_esclusiva: gira da sola, tra un gruppo e l'altro.
+
+MAX_GRUPPO = 64
+
+_coda = queue.Queue()
+_lock = threading.Lock()
+_thread = None
+
+
+def _avvia():
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_ciclo, name="comics-scrittore", daemon=True)
+            _thread.start()
+
+
+def esegui(operazione, *args):
+    """Esegue operazione(conn, *args) nel thread scrittore, dentro una transazione già aperta.
+
+    Restituisce il valore dell'operazione (a commit avvenuto) o ne rilancia l'eccezione.
+    """
+    return _accoda(operazione, args, False)
+
+
+def esegui_esclusiva(operazione, *args):
+    """Esegue operazione(*args) nel thread scrittore da sola, senza connessione né transazione aperte.
+
+    Nessuna scrittura delle altre sessioni è in corso mentre gira. Restituisce il valore dell'operazione.
+    """
+    return _accoda(operazione, args, True)
+
+
+def _accoda(operazione, args, esclusiva):
+    futuro = Future()
+    _coda.put((operazione, args, futuro, esclusiva))
+    _avvia()
+    # Nessun timeout: un'operazione in coda viene comunque scritta, un errore al chiamante direbbe il falso
+    return futuro.result()
+
+
+def _ciclo():
+    while True:
+        gruppo = [_coda.get()]
+        while len(gruppo) < MAX_GRUPPO and not gruppo[-1][3]:
+            try:
+                gruppo.append(_coda.get_nowait())
+            except queue.Empty:
+                break
+        esclusiva = gruppo.pop() if gruppo[-1][3] else None
+        if gruppo:
+            _scrivi(gruppo)
+        if esclusiva:
+            _esegui_da_sola(*esclusiva[:3])
+
+
+def _esegui_da_sola(operazione, args, futuro):
+    try:
+        futuro.set_result(operazione(*args))
+    except Exception as e:
+        futuro.set_exception(e)
+
+
+def _scrivi(gruppo):
+    esiti = []
+    try:
+        with connessione() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            for operazione, args, futuro, _ in gruppo:
+                conn.execute("SAVEPOINT operazione")
+                try:
+                    esiti.append((futuro, operazione(conn, *args), None))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO operazione")
+                    esiti.append((futuro, None, e))
+                conn.execute("RELEASE operazione")
+    except Exception as e:
+        # Transazione o commit falliti: nessuna operazione del gruppo è stata scritta
+        for _, _, futuro, _ in gruppo:
+            futuro.set_exception(e)
+        return
+    for futuro, valore, errore in esiti:
+        if errore is None:
+            futuro.set_result(valore)
+        else:
+            futuro.set_exception(errore)
@@ -0,0 +1,364 @@
+import bisect
+import hashlib
+import json
+
+import pandas as pd
+
+from .archivio import VUOTI_AMMESSI, _aggiorna_righe, _inserisci_albo
+from .collezione import COLONNE_DECIMALI, COLONNE_INTERE, applica_schema
+from .db import connessione
+from .importer import CHIAVE
+from .migrations import ADESSO, NOMI_COLONNE_COMICS
+from .profilo import cronometrato
+from .scrittore import esegui
+
+# --- SINCRONIZZAZIONE ARCHIVIO <-> FOGLIO ---
+# Confronto a tre vie per riga: il contenuto attuale nell'archivio, quello nel foglio e l'ultimo
+# concordato (righe_foglio: hash del contenuto e posizione nel foglio, per id di comics). Cambiato
+# da una sola parte: vince quella parte; cambiato da entrambe: conflitto, deciso da `vince`.
+# Le righe del foglio senza id (aggiunte a mano) si riconoscono dalla chiave naturale.
+# Al foglio arrivano solo le righe cambiate, raggruppate in intervalli contigui: se dall'ultimo
+# checkpoint il foglio non è cambiato (stessa revisione) non viene nemmeno riletto.
+
+COLONNE_DATI = NOMI_COLONNE_COMICS[1:]
+COLONNE_FOGLIO = NOMI_COLONNE_COMICS
+VINCE = ("archivio", "foglio")
+QUOTA_RILETTURA = 0.25  # oltre questa frazione di righe toccate conviene rileggere tutto l'archivio
+_SEP = "\x1f"
+
+
+def _canonica(df):
+    """Testo canonico di ogni cella: lo stesso albo dà gli stessi testi, letto da SQLite o dal foglio."""
+    tipizzato = applica_schema(df.reindex(columns=COLONNE_DATI))
+    colonne = {}
+    for col in COLONNE_DATI:
+        if col in COLONNE_DECIMALI:
+            colonne[col] = tipizzato[col].map(lambda v: "" if pd.isna(v) else f"{v:.10g}").astype(object)
+        else:
+            colonne[col] = tipizzato[col].astype("string").fillna("").astype(object)
+    return pd.DataFrame(colonne, index=df.index)
+
+
+def _impronte(canonica):
+    """(hash del contenuto, chiave naturale) di ogni riga canonica."""
+    if canonica.empty:
+        return [], []
+    testo = canonica[COLONNE_DATI[0]].str.cat([canonica[col] for col in COLONNE_DATI[1:]], sep=_SEP)
+    hash_righe = [hashlib.blake2b(t.encode(), digest_size=16).hexdigest() for t in testo]
+    chiavi = canonica[CHIAVE[0]].str.cat([canonica[col] for col in CHIAVE[1:]], sep=_SEP).str.lower()
+    return hash_righe, chiavi.tolist()
+
+
+def _valori_db(testi):
+    """Riga canonica del foglio -> {colonna: valore} da scrivere in comics."""
+    valori = {}
+    for col, v in zip(COLONNE_DATI, testi):
+        if v == "":
+            valori[col] = VUOTI_AMMESSI.get(col)
+        elif col in COLONNE_INTERE:
+            valori[col] = int(v)
+        elif col in COLONNE_DECIMALI:
+            valori[col] = float(v)
+        else:
+            valori[col] = v
+    return valori
+
+
+def _stesso_id(letto, record_id):
+    return letto is not pd.NA and letto == record_id
+
+
+def _intervalli(posizioni):
+    """Posizioni ordinate -> [(prima, ultima)] contigue."""
+    intervalli = []
+    for p in posizioni:
+        if intervalli and intervalli[-1][1] == p - 1:
+            intervalli[-1][1] = p
+        else:
+            intervalli.append([p, p])
+    return [tuple(i) for i in intervalli]
+
+
+# --- STATO ---
+def ultimo_checkpoint(nome):
+    with connessione() as conn:
+        riga = conn.execute("""SELECT revisione, seq, righe, istante, inviate, ricevute, conflitti
+                               FROM checkpoint_foglio WHERE foglio = ? ORDER BY id DESC LIMIT 1""", (nome,)).fetchone()
+    if riga is None:
+        return None
+    return dict(zip(["revisione", "seq", "righe", "istante", "inviate", "ricevute", "conflitti"], riga))
+
+
+class _Archivio:
+    """Gli albi dell'archivio come li vede la sincronizzazione.
+
+    Dopo un checkpoint si rileggono solo le righe toccate dal giornale (o mai sincronizzate): per
+    tutte le altre il contenuto è ancora quello concordato, di cui basta l'hash in righe_foglio.
+    Con una serie o sottoserie rinominata, o troppe righe toccate, si rilegge tutto.
+    """
+
+    def __init__(self, nome, da_seq=None):
+        self.righe, self.impronte = {}, {}
+        with connessione() as conn:
+            # Una sola transazione di lettura: albi, stato concordato e seq del giornale dello stesso istante
+            conn.execute("BEGIN")
+            self.seq = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM giornale").fetchone()[0]
+            self.base = {r[0]: r[1:] for r in conn.execute(
+                "SELECT id, chiave, hash, riga FROM righe_foglio WHERE foglio = ?", (nome,))}
+            self.versioni = dict(conn.execute("SELECT id, versione FROM comics").fetchall())
+            ids = None
+            if da_seq is not None and not conn.execute("""SELECT 1 FROM giornale WHERE seq > ?
+                                                          AND tabella IN ('series', 'subseries') LIMIT 1""",
+                                                       (da_seq,)).fetchone():
+                toccati = {r[0] for r in conn.execute(
+                    "SELECT DISTINCT riga FROM giornale WHERE seq > ? AND tabella = 'comics'", (da_seq,))}
+                ids = (toccati | (self.versioni.keys() - self.base.keys())) & self.versioni.keys()
+                if len(ids) > len(self.versioni) * QUOTA_RILETTURA:
+                    ids = None
+            self._leggi(conn, ids)
+
+    def _leggi(self, conn, ids):
+        sql = f"SELECT id, {', '.join(COLONNE_DATI)} FROM vista_comics"
+        if ids is None:
+            df = pd.read_sql_query(sql, conn)
+        elif ids:
+            df = pd.read_sql_query(f"{sql} WHERE id IN (SELECT value FROM json_each(?))", conn,
+                                   params=(json.dumps(list(ids)),))
+        else:
+            return
+        canonica = _canonica(df)
+        hash_righe, chiavi = _impronte(canonica)
+        for record_id, riga, h, chiave in zip(df["id"].tolist(), canonica.values.tolist(), hash_righe, chiavi):
+            self.righe[record_id] = riga
+            self.impronte[record_id] = (chiave, h)
+
+    def carica(self, ids):
+        """Legge il contenuto delle righe che servono e non sono state rilette all'inizio."""
+        mancanti = [record_id for record_id in ids if record_id not in self.righe]
+        if mancanti:
+            with connessione() as conn:
+                self._leggi(conn, mancanti)
+
+    def impronta(self, record_id):
+        """(chiave, hash) attuali della riga, None se non è (più) nell'archivio."""
+        if record_id in self.impronte:
+            return self.impronte[record_id]
+        if record_id in self.versioni:
+            return self.base[record_id][:2]
+        return None
+
+
+def _applica_archivio(conn, aggiorna, inserisci, elimina):
+    conflitti = _aggiorna_righe(conn, aggiorna)
+    nuovi = [_inserisci_albo(conn, valori) for valori in inserisci]
+    for record_id, versione in elimina:
+        if conn.execute("DELETE FROM comics WHERE id = ? AND versione = ?", (record_id, versione)).rowcount == 0:
+            conflitti.append(record_id)
+    return conflitti, nuovi
+
+
+def _registra(conn, nome, scrivi, togli, checkpoint):
+    conn.executemany("INSERT OR REPLACE INTO righe_foglio (foglio, id, chiave, hash, riga) VALUES (?, ?, ?, ?, ?)",
+                     [(nome, record_id, *valori) for record_id, valori in scrivi.items()])
+    conn.executemany("DELETE FROM righe_foglio WHERE foglio = ? AND id = ?", [(nome, record_id) for record_id in togli])
+    conn.execute(f"""INSERT INTO checkpoint_foglio (foglio, revisione, seq, righe, inviate, ricevute, conflitti, istante)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, {ADESSO})""", (nome, *checkpoint))
+
+
+# --- SINCRONIZZAZIONE ---
+@cronometrato
+def sincronizza(foglio, vince="archivio"):
+    """Porta archivio e foglio allo stesso contenuto scambiando solo le righe cambiate.
+
+    foglio: un backend di comics.foglio. vince: "archivio" o "foglio", chi prevale se una riga è
+    cambiata da entrambe le parti. Le righe del foglio non valide (senza serie) vengono
+    riscritte con quelle dell'archivio, o ignorate se nell'archivio non ci sono; quelle
+    dell'archivio modificate da altri durante la sincronizzazione restano per la volta successiva.
+    Restituisce il riepilogo delle operazioni e delle richieste fatte al foglio.
+    """
+    if vince not in VINCE:
+        raise ValueError(f"vince deve essere uno tra {VINCE}")
+    nome = foglio.nome
+    richieste = foglio.richieste
+    esito = {"inviate": 0, "eliminate_foglio": 0, "ricevute": 0, "eliminate_archivio": 0,
+             "conflitti": 0, "scartate": 0, "letto": False, "riscritto": False}
+
+    ultimo = ultimo_checkpoint(nome)
+    revisione = foglio.revisione()
+    foglio_fermo = ultimo is not None and revisione is not None and revisione == ultimo["revisione"]
+    with connessione() as conn:
+        seq = conn.execute("SELECT IFNULL(MAX(seq), 0) FROM giornale").fetchone()[0]
+    if foglio_fermo and seq == ultimo["seq"]:
+        esito["richieste"] = foglio.richieste - richieste
+        return esito
+
+    archivio = _Archivio(nome, ultimo["seq"] if ultimo else None)
+    base = archivio.base
+
+    # --- CONTENUTO DEL FOGLIO ---
+    # Foglio fermo e tutto tracciato: è ancora com'era alla fine dell'ultima sincronizzazione
+    if foglio_fermo and len(base) == ultimo["righe"]:
+        n_foglio = ultimo["righe"]
+        rem = {record_id: (riga, hash_b, False) for record_id, (_, hash_b, riga) in base.items()}
+        nuove, righe_r, id_r = [], None, None
+    else:
+        dati = foglio.leggi()
+        esito["letto"] = True
+        esito["riscritto"] = list(dati.columns) != COLONNE_FOGLIO
+        if esito["riscritto"] or dati.empty:
+            # Foglio nuovo, svuotato o con altre colonne: si ricollega da zero, senza leggere
+            # le righe mancanti come cancellazioni da riportare nell'archivio
+            archivio = _Archivio(nome)
+            base = archivio.base = {}
+        n_foglio = len(dati)
+        can_r = _canonica(dati)
+        righe_r = can_r.values.tolist()
+        hash_r, chiavi_r = _impronte(can_r)
+        id_r = (pd.to_numeric(dati["id"], errors="coerce").astype("Int64") if "id" in dati.columns
+                else pd.Series(pd.NA, index=dati.index, dtype="Int64")).tolist()
+        noti = {i for i in id_r if i is not pd.NA and (i in archivio.versioni or i in base)}
+        # Righe senza id valido: si cercano per chiave tra le righe concordate e poi tra quelle nuove dell'archivio
+        liberi_base = {}
+        for record_id, (chiave, _, _) in base.items():
+            if record_id not in noti:
+                liberi_base.setdefault(chiave, record_id)
+        liberi_loc = {}
+        for record_id in archivio.versioni.keys() - noti - base.keys():
+            liberi_loc.setdefault(archivio.impronte[record_id][0], record_id)
+        rem, nuove = {}, []
+        for pos, (record_id, chiave) in enumerate(zip(id_r, chiavi_r)):
+            if record_id is pd.NA or record_id not in noti or record_id in rem:
+                record_id = liberi_base.pop(chiave, None) or liberi_loc.pop(chiave, None)
+            if record_id is None:
+                nuove.append(pos)
+            else:
+                rem[record_id] = (pos, hash_r[pos], not _stesso_id(id_r[pos], record_id))
+
+    # --- CONFRONTO A TRE VIE ---
+    invia, aggiungi, togli_foglio = {}, [], []     # posizione -> id, id, posizioni
+    ricevi, togli_archivio = [], []                # (id, posizione), id
+    concordi = {}                                  # id -> posizione
+    for record_id in archivio.versioni.keys() | base.keys() | rem.keys():
+        impronta = archivio.impronta(record_id)
+        h_l = impronta[1] if impronta else None
+        h_b = base[record_id][1] if record_id in base else None
+        pos, h_r, scrivi_id = rem.get(record_id, (None, None, False))
+        if h_l is not None and h_r is not None:
+            if h_l == h_r:
+                concordi[record_id] = pos
+                if scrivi_id:
+                    invia[pos] = record_id
+            elif h_r == h_b:
+                invia[pos] = record_id
+            elif h_l == h_b:
+                ricevi.append((record_id, pos))
+            else:
+                esito["conflitti"] += 1
+                if vince == "archivio":
+                    invia[pos] = record_id
+                else:
+                    ricevi.append((record_id, pos))
+        elif h_l is not None:
+            # Tolta dal foglio: si cancella solo se nell'archivio è ancora quella concordata
+            if h_l == h_b:
+                togli_archivio.append(record_id)
+            else:
+                aggiungi.append(record_id)
+        elif h_r is not None:
+            if h_r == h_b:
+                togli_foglio.append(pos)
+            else:
+                nuove.append(pos)
+
+    # --- SCRITTURE NELL'ARCHIVIO ---
+    aggiorna = []
+    for record_id, pos in ricevi:
+        if righe_r[pos][0]:
+            aggiorna.append((record_id, archivio.versioni[record_id], _valori_db(righe_r[pos])))
+        else:
+            invia[pos] = record_id
+            esito["scartate"] += 1
+    inserisci = [pos for pos in sorted(nuove) if righe_r[pos][0]]
+    esito["scartate"] += len(nuove) - len(inserisci)
+    elimina = [(record_id, archivio.versioni[record_id]) for record_id in togli_archivio]
+    conflitti, nuovi_id = [], []
+    if aggiorna or inserisci or elimina:
+        conflitti, nuovi_id = esegui(_applica_archivio, aggiorna, [_valori_db(righe_r[pos]) for pos in inserisci], elimina)
+    conflitti = set(conflitti)
+    esito["conflitti"] += len(conflitti)
+
+    # Righe ricevute: nel foglio va riportato l'id (se nuove) e il contenuto come l'ha salvato l'archivio
+    posizioni_r = {record_id: pos for record_id, pos in ricevi}
+    ricevute = [(record_id, posizioni_r[record_id], valori) for record_id, _, valori in aggiorna
+                if record_id not in conflitti]
+    ricevute += [(record_id, pos, _valori_db(righe_r[pos])) for record_id, pos in zip(nuovi_id, inserisci)]
+    scritte = {}                                   # id -> (posizione, riga canonica, chiave, hash)
+    if ricevute:
+        can_scritte = _canonica(pd.DataFrame([valori for _, _, valori in ricevute], columns=COLONNE_DATI))
+        hash_s, chiavi_s = _impronte(can_scritte)
+        for (record_id, pos, _), riga, h, chiave in zip(ricevute, can_scritte.values.tolist(), hash_s, chiavi_s):
+            scritte[record_id] = (pos, riga, chiave, h)
+            if riga != righe_r[pos] or not _stesso_id(id_r[pos], record_id):
+                invia[pos] = record_id
+    esito["ricevute"] = len(scritte)
+    esito["eliminate_archivio"] = len(set(togli_archivio) - conflitti)
+
+    # --- SCRITTURE NEL FOGLIO ---
+    invia = {pos: record_id for pos, record_id in invia.items() if record_id not in conflitti}
+    archivio.carica([record_id for record_id in invia.values() if record_id not in scritte] + aggiungi)
+    aggiungi.sort(key=lambda record_id: (*(v.lower() for v in archivio.righe[record_id][:2]),
+                                         int(archivio.righe[record_id][2] or 0), record_id))
+
+    def riga_foglio(record_id):
+        riga = scritte[record_id][1] if record_id in scritte else archivio.righe[record_id]
+        return [str(record_id)] + riga
+
+    togli_foglio.sort()
+    if esito["riscritto"]:
+        # Intestazione diversa (primo collegamento o colonne cambiate a mano): si riscrive tutto una volta
+        eliminate = set(togli_foglio)
+        righe = [riga_foglio(invia[pos]) if pos in invia else ["" if id_r[pos] is pd.NA else str(id_r[pos])] + righe_r[pos]
+                 for pos in range(n_foglio) if pos not in eliminate]
+        righe += [riga_foglio(record_id) for record_id in aggiungi]
+        foglio.riscrivi(COLONNE_FOGLIO, righe)
+    else:
+        if invia:
+            foglio.aggiorna([(prima, [riga_foglio(invia[p]) for p in range(prima, ultima + 1)])
+                             for prima, ultima in _intervalli(sorted(invia))])
+        if togli_foglio:
+            foglio.elimina(list(reversed(_intervalli(togli_foglio))))
+        if aggiungi:
+            foglio.accoda([riga_foglio(record_id) for record_id in aggiungi])
+    esito["inviate"] = len(invia) + len(aggiungi)
+    esito["eliminate_foglio"] = len(togli_foglio)
+
+    # --- NUOVO STATO CONCORDATO ---
+    def sposta(pos):
+        return pos - bisect.bisect_left(togli_foglio, pos)
+
+    stato = {}
+    for record_id, pos in concordi.items():
+        stato[record_id] = (*archivio.impronta(record_id), sposta(pos))
+    for pos, record_id in invia.items():
+        if record_id not in scritte:
+            stato[record_id] = (*archivio.impronta(record_id), sposta(pos))
+    for record_id, (pos, _, chiave, h) in scritte.items():
+        stato[record_id] = (chiave, h, sposta(pos))
+    # Righe rimaste indietro (conflitti di versione): stesso stato concordato, posizione aggiornata.
+    # Non quelle tolte o ricevute come albi nuovi: la loro posizione non appartiene più a quell'id
+    occupate = set(togli_foglio) | set(nuove)
+    for record_id, (pos, _, _) in rem.items():
+        if record_id not in stato and record_id in base and pos not in occupate:
+            stato[record_id] = (*base[record_id][:2], sposta(pos))
+    inizio = n_foglio - len(togli_foglio)
+    for n, record_id in enumerate(aggiungi):
+        stato[record_id] = (*archivio.impronta(record_id), inizio + n)
+
+    scrivi = {record_id: valori for record_id, valori in stato.items() if base.get(record_id) != valori}
+    togli = [record_id for record_id in base if record_id not in stato]
+    if esito["inviate"] or esito["eliminate_foglio"]:
+        revisione = foglio.revisione()
+    esegui(_registra, nome, scrivi, togli,
+           (revisione, archivio.seq, inizio + len(aggiungi), esito["inviate"], esito["ricevute"], esito["conflitti"]))
+    esito["richieste"] = foglio.richieste - richieste
+    return esito
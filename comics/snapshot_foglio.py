@@ -0,0 +1,193 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from . import colonnare
+
+# --- SNAPSHOT LOCALE DEL FOGLIO ---
+# L'ultimo foglio letto con successo resta su disco (file SQLite) e in memoria: le pagine
+# vengono servite subito da lì, mentre l'aggiornamento dalla rete gira in un thread separato
+# (stale-while-revalidate). Se il foglio è lento o irraggiungibile si continua con lo snapshot.
+# Con una funzione di revisione il foglio viene riscaricato solo se è cambiato dall'ultimo download.
+# Lo snapshot è un file SQLite (.db) oppure, con pyarrow, un file .arrow/.parquet già tipizzato e letto
+# in memory map (comics.colonnare): lì la data del download è la data di modifica del file.
+TTL_DEFAULT = 300
+
+
+def leggi_file_locale(percorso):
+    """Sorgente sostitutiva del foglio (test, uso offline): un CSV, uno snapshot .db o un file .arrow/.parquet."""
+    if percorso.endswith(".db") or colonnare.formato_percorso(percorso):
+        return _leggi_snapshot(percorso)[0]
+    return pd.read_csv(percorso, sep=None, engine="python", dtype=str)
+
+
+def _leggi_snapshot(percorso):
+    if colonnare.formato_percorso(percorso):
+        dati, metadati = colonnare.leggi(percorso)
+        return dati, os.stat(percorso).st_mtime, metadati.get("revisione")
+    conn = sqlite3.connect(percorso)
+    try:
+        dati = pd.read_sql_query("SELECT * FROM foglio", conn)
+        meta = conn.execute("SELECT * FROM meta").fetchone()
+    finally:
+        conn.close()
+    # Gli snapshot scritti prima della revisione hanno solo la colonna aggiornato
+    return dati, meta[0], meta[1] if len(meta) > 1 else None
+
+
+def _rinnova_snapshot(percorso, aggiornato):
+    if colonnare.formato_percorso(percorso):
+        os.utime(percorso, (aggiornato, aggiornato))
+        return
+    conn = sqlite3.connect(percorso)
+    try:
+        conn.execute("UPDATE meta SET aggiornato = ?", (aggiornato,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _scrivi_snapshot(percorso, dati, aggiornato, revisione=None):
+    # Scrittura su file temporaneo + rename: chi legge vede sempre uno snapshot completo
+    tmp = f"{percorso}.tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    formato = colonnare.formato_percorso(percorso)
+    if formato:
+        colonnare.scrivi(tmp, [dati], list(dati.columns), formato,
+                         {"revisione": revisione} if revisione is not None else None)
+        os.utime(tmp, (aggiornato, aggiornato))
+        os.replace(tmp, percorso)
+        return
+    conn = sqlite3.connect(tmp)
+    try:
+        dati.astype("string").to_sql("foglio", conn, index=False)
+        conn.execute("CREATE TABLE meta (aggiornato REAL, revisione TEXT)")
+        conn.execute("INSERT INTO meta VALUES (?, ?)", (aggiornato, revisione))
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, percorso)
+
+
+class CacheFoglio:
+    """Snapshot del foglio condiviso dalle sessioni, aggiornato in background allo scadere del TTL.
+
+    leggi: funzione senza argomenti che scarica il foglio e restituisce un DataFrame.
+    prepara: trasformazione applicata una sola volta per snapshot (tipi, colonne derivate).
+    revisione: funzione senza argomenti che restituisce una marca della versione del foglio
+    (es. Foglio.revisione di comics.foglio); se è quella dello snapshot il download viene saltato.
+    """
+
+    def __init__(self, leggi, percorso, ttl=TTL_DEFAULT, prepara=None, revisione=None):
+        self._leggi = leggi
+        self._revisione = revisione
+        self._revisione_corrente = None
+        self._percorso = percorso
+        self._prepara = prepara or (lambda df: df)
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._thread = None
+        # (versione, dati preparati, timestamp del download): sostituita con un'unica assegnazione
+        self._corrente = None
+        self._ultimo_tentativo = 0.0
+        self.ultimo_errore = None
+
+    # --- LETTURA ---
+    def dati(self):
+        """Restituisce subito lo snapshot corrente; se è scaduto avvia l'aggiornamento in background."""
+        if self._corrente is None:
+            self._carica_iniziale()
+        if self._corrente is not None and self._scaduto():
+            self.aggiorna()
+        return self._corrente[1] if self._corrente is not None else None
+
+    @property
+    def versione(self):
+        return self._corrente[0] if self._corrente is not None else 0
+
+    @property
+    def aggiornato(self):
+        return self._corrente[2] if self._corrente is not None else None
+
+    def eta(self):
+        return time.time() - self._corrente[2] if self._corrente is not None else float("inf")
+
+    def _scaduto(self):
+        # Dopo un download fallito si riprova solo allo scadere del TTL successivo
+        return self.eta() > self.ttl and time.time() - self._ultimo_tentativo > self.ttl
+
+    def in_aggiornamento(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # --- AGGIORNAMENTO ---
+    def aggiorna(self, attendi=False, forza=False):
+        """Avvia (se non già in corso) il download del foglio; con attendi=True aspetta la fine.
+
+        forza=True scarica tutto anche se la revisione del foglio risulta invariata; un aggiornamento
+        già in corso (che potrebbe saltare il download) viene prima lasciato finire.
+        """
+        while True:
+            with self._lock:
+                in_corso = self.in_aggiornamento()
+                if not in_corso:
+                    self._thread = threading.Thread(target=self._scarica, args=(forza,), name="aggiorna-foglio",
+                                                    daemon=True)
+                    self._thread.start()
+                thread = self._thread
+            if not (in_corso and forza):
+                break
+            thread.join()
+        if attendi:
+            thread.join()
+
+    def _carica_iniziale(self):
+        with self._lock:
+            if self._corrente is not None:
+                return
+            if os.path.exists(self._percorso):
+                try:
+                    grezzi, aggiornato, revisione = _leggi_snapshot(self._percorso)
+                    self._corrente = (1, self._prepara(grezzi), aggiornato)
+                    self._revisione_corrente = revisione
+                    return
+                except Exception as e:
+                    self.ultimo_errore = e
+        # Primo avvio senza snapshot: non c'è niente da mostrare, si scarica in primo piano
+        self.aggiorna(attendi=True)
+
+    def _scarica(self, forza=False):
+        self._ultimo_tentativo = time.time()
+        revisione = None
+        if self._revisione is not None:
+            try:
+                revisione = self._revisione()
+            except Exception:
+                pass  # senza revisione si scarica comunque tutto
+        if not forza and revisione is not None and revisione == self._revisione_corrente and self._corrente is not None:
+            # Foglio non cambiato: lo snapshot resta valido, si rinnova solo la data
+            versione, dati, _ = self._corrente
+            self._corrente = (versione, dati, time.time())
+            self.ultimo_errore = None
+            try:
+                _rinnova_snapshot(self._percorso, self._corrente[2])
+            except Exception as e:
+                self.ultimo_errore = e
+            return
+        try:
+            grezzi = self._leggi()
+            aggiornato = time.time()
+            preparati = self._prepara(grezzi)
+        except Exception as e:
+            self.ultimo_errore = e
+            return
+        self._corrente = (self.versione + 1, preparati, aggiornato)
+        self._revisione_corrente = revisione
+        self.ultimo_errore = None
+        try:
+            _scrivi_snapshot(self._percorso, grezzi, aggiornato, revisione)
+        except Exception as e:
+            self.ultimo_errore = e
@@ -0,0 +1,63 @@
+from .db import leggi_df, per_versione
+from .migrations import ricostruisci_statistiche
+from .profilo import cronometrato
+from .scrittore import esegui
+
+# --- RIEPILOGHI STATISTICHE ---
+# Letti da stat_serie / stat_subserie, mantenute dai trigger su comics: una riga per serie, non per albo.
+# Le tabelle sono raggruppate per id, i nomi arrivano dal join con series e subseries.
+
+
+def _completamento(df):
+    df['%_Completamento'] = (df['In_Stock'] / df['Totale_Albi'] * 100).round(1).astype(str) + '%'
+    return df
+
+
+@per_versione
+@cronometrato
+def riepilogo_serie():
+    df = leggi_df("""SELECT s.nome_serie AS serie, totale AS Totale_Albi, in_stock AS In_Stock
+                     FROM stat_serie st JOIN series s ON s.id = st.serie_id
+                     ORDER BY totale DESC, serie""")
+    return _completamento(df)
+
+
+@per_versione
+@cronometrato
+def riepilogo_subserie():
+    df = leggi_df("""SELECT s.nome_serie AS serie, ss.nome_subserie AS subserie, totale AS Totale_Albi, in_stock AS In_Stock
+                     FROM stat_subserie st
+                     JOIN series s ON s.id = st.serie_id JOIN subseries ss ON ss.id = st.subserie_id
+                     ORDER BY serie, totale DESC, subserie""")
+    return _completamento(df)
+
+
+# --- NUMERI MANCANTI ---
+# I buchi nella numerazione di tutte le (serie, sottoserie) in una sola scansione di idx_comics_serie, già in
+# ordine per (serie_id, subserie_id, numero): LAG confronta ogni numero con il precedente della stessa sottoserie.
+@per_versione
+@cronometrato
+def numeri_mancanti(solo_stock=False):
+    """Intervalli di numeri (da, a) che mancano tra il primo e l'ultimo presenti di ogni sottoserie.
+
+    Con solo_stock contano come presenti solo gli albi in stock (indice parziale idx_comics_serie_stock).
+    """
+    sorgente = ("comics INDEXED BY idx_comics_serie_stock WHERE stato = 'stock' AND" if solo_stock
+                else "comics WHERE")
+    return leggi_df(f"""SELECT s.nome_serie AS serie, ss.nome_subserie AS subserie, b.da, b.a, b.a - b.da + 1 AS mancanti
+                        FROM (SELECT serie_id, subserie_id, precedente + 1 AS da, numero - 1 AS a
+                              FROM (SELECT serie_id, subserie_id, numero,
+                                           LAG(numero) OVER (PARTITION BY serie_id, subserie_id ORDER BY numero) AS precedente
+                                    FROM {sorgente} numero > 0)
+                              WHERE numero - precedente > 1) b
+                        JOIN series s ON s.id = b.serie_id JOIN subseries ss ON ss.id = b.subserie_id
+                        ORDER BY serie, subserie, da""")
+
+
+def _ricostruisci(conn):
+    ricostruisci_statistiche(conn.cursor())
+
+
+def ricostruisci():
+    """Ricalcola i riepiloghi da comics in un'unica transazione dello scrittore unico."""
+    esegui(_ricostruisci)
@@ -1,8 +1,15 @@
 import streamlit as st
 from streamlit_gsheets import GSheetsConnection
 import pandas as pd
+import io
+import os
 from datetime import datetime
 
+from comics import colonnare
+from comics.collezione import CHIAVE_RICERCA, aggiungi_chiave_ricerca, applica_schema, maschera_testo, opzioni
+from comics.foglio import FoglioGoogle, apri_foglio
+from comics.snapshot_foglio import TTL_DEFAULT, CacheFoglio, leggi_file_locale
+
 # --- 1. CONFIGURAZIONE PAGINA ---
 st.set_page_config(page_title="Comic Manager Pro Cloud", page_icon="📖", layout="wide")
 
@@ -15,11 +22,7 @@ def format_it_comma(valore):
 
 def get_safe_options(df, column):
     """Estrae opzioni uniche, rimuove i vuoti e ordina senza errori di tipo"""
-    if df.empty or column not in df.columns:
-        return []
-    options = df[column].astype(str).replace('nan', '').replace('None', '')
-    options = [opt for opt in options.unique() if opt.strip() != '']
-    return sorted(options)
+    return opzioni(df, column)
 
 # --- 3. COSTANTI ---
 COLUMNS_ORDER = [
@@ -31,6 +34,7 @@ COLUMNS_ORDER = [
 
 LISTA_FORMATO = ["Brossurato", "Cartonato", "Spillato", "Pocket", "Graphic Novel", "Albo", "Altro"]
 LISTA_STATO = ["stock", "wish list"]
+COLONNE_FACET = ["serie", "editore", "storage_box"]
 
 # --- 4. CSS ---
 st.markdown("""
@@ -42,24 +46,75 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
-# --- 5. CONNESSIONE (SOLO LETTURA) ---
-conn = st.connection("gsheets", type=GSheetsConnection)
+# --- 5. CONNESSIONE (SOLO LETTURA) CON SNAPSHOT LOCALE ---
+# [snapshot] nei secrets: ttl (secondi), percorso (file .db dello snapshot, oppure .arrow/.parquet),
+# file_locale (CSV, .db o .arrow/.parquet da usare al posto del foglio, per test e uso offline).
+# Con pyarrow lo snapshot predefinito è Arrow: si ricarica in memory map, già con i tipi dello schema.
+SNAPSHOT_DEFAULT = "fumetti_snapshot.arrow" if colonnare.disponibile() else "fumetti_snapshot.db"
+BLOCCO_EXPORT = 5000
+
+def config_snapshot():
+    try:
+        return dict(st.secrets.get("snapshot", {}))
+    except Exception:
+        return {}
+
+def prepara_dati(data):
+    """Eseguita una volta per snapshot: tipi, colonna di ricerca e opzioni dei filtri."""
+    if data.empty:
+        data = pd.DataFrame(columns=COLUMNS_ORDER)
+    for col in COLUMNS_ORDER:
+        if col not in data.columns:
+            data[col] = ""
+    data = aggiungi_chiave_ricerca(applica_schema(data), COLUMNS_ORDER)
+    return {"df": data, "opzioni": {col: get_safe_options(data, col) for col in COLONNE_FACET}}
+
+@st.cache_resource
+def cache_foglio():
+    cfg = config_snapshot()
+    file_locale = cfg.get("file_locale") or os.environ.get("FUMETTI_FILE_LOCALE")
+    if file_locale:
+        leggi = lambda: leggi_file_locale(file_locale)
+        revisione = apri_foglio(file_locale).revisione
+    else:
+        conn = st.connection("gsheets", type=GSheetsConnection)
+        credenziali = dict(st.secrets["connections"]["gsheets"])
+        url = credenziali["spreadsheet"]
+        leggi = lambda: conn.read(spreadsheet=url, ttl="0")
+        # Con un service account si chiede prima la data di modifica: il foglio si riscarica solo se è cambiato
+        revisione = FoglioGoogle(url, credenziali).revisione if "private_key" in credenziali else None
+    return CacheFoglio(leggi, cfg.get("percorso", SNAPSHOT_DEFAULT),
+                       ttl=int(cfg.get("ttl", TTL_DEFAULT)), prepara=prepara_dati, revisione=revisione)
 
 def carica_dati():
     try:
-        url = st.secrets["connections"]["gsheets"]["spreadsheet"]
-        data = conn.read(spreadsheet=url, ttl="0")
-        if data.empty:
-            return pd.DataFrame(columns=COLUMNS_ORDER)
-        for col in COLUMNS_ORDER:
-            if col not in data.columns:
-                data[col] = ""
-        return data
+        cache = cache_foglio()
+        data = cache.dati()
+        if cache.ultimo_errore is not None:
+            if data is None:
+                st.error(f"Errore Sincronizzazione: {cache.ultimo_errore}")
+            else:
+                quando = datetime.fromtimestamp(cache.aggiornato).strftime("%d/%m/%Y %H:%M")
+                st.warning(f"Aggiornamento non riuscito, dati dallo snapshot del {quando}: {cache.ultimo_errore}")
+        if data is not None:
+            return data
     except Exception as e:
         st.error(f"Errore Sincronizzazione: {e}")
-        return pd.DataFrame(columns=COLUMNS_ORDER)
-
-df = carica_dati()
+    return prepara_dati(pd.DataFrame(columns=COLUMNS_ORDER))
+
+@st.cache_data(max_entries=3, show_spinner=False)
+def esporta_snapshot(versione, formato, _df):
+    """File di esportazione (bytes) generato al click e tenuto per versione dello snapshot e formato."""
+    dati = _df.drop(columns=[CHIAVE_RICERCA])
+    if formato == "csv":
+        return dati.to_csv(index=False, sep=';').encode('utf-8')
+    out = io.BytesIO()
+    blocchi = (dati.iloc[i:i + BLOCCO_EXPORT] for i in range(0, len(dati), BLOCCO_EXPORT))
+    colonnare.scrivi(out, blocchi, list(dati.columns), formato)
+    return out.getvalue()
+
+snapshot = carica_dati()
+df, opzioni_filtri = snapshot["df"], snapshot["opzioni"]
 
 # --- 6. SIDEBAR ---
 st.sidebar.title("📖 Comic Manager")
@@ -72,16 +127,13 @@ if menu == "📚 Archivio":
     
     if not df.empty:
         # --- CALCOLO METRICHE SICURO ---
-        df_calc = df.copy()
-        df_calc['prezzo_copertina'] = pd.to_numeric(df_calc['prezzo_copertina'], errors='coerce').fillna(0)
-        
-        # Filtro flessibile: Euro, euro, EURO sono tutti validi
-        mask_euro = df_calc['valuta'].astype(str).str.contains('Euro', case=False, na=False)
-        val_tot = df_calc[mask_euro]['prezzo_copertina'].sum()
+        # Filtro flessibile: Euro, euro, EURO sono tutti validi (calcolato sulle sole categorie)
+        mask_euro = df['valuta'].str.contains('Euro', case=False, na=False).astype(bool)
+        val_tot = df.loc[mask_euro, 'prezzo_copertina'].sum()
 
         m1, m2, m3 = st.columns(3)
         m1.metric("Albi Totali", len(df))
-        m2.metric("In Stock", len(df[df['stato'].astype(str).str.lower() == 'stock']))
+        m2.metric("In Stock", int((df['stato'].str.lower() == 'stock').sum()))
         m3.metric("Valore (Euro)", f"€ {format_it_comma(val_tot)}")
 
         st.divider()
@@ -90,23 +142,23 @@ if menu == "📚 Archivio":
         with st.expander("🔍 Filtri Avanzati", expanded=True):
             f1, f2, f3 = st.columns(3)
             search_text = f1.text_input("Cerca testo (Serie, Titolo, ISBN...)")
-            f_serie = f2.selectbox("Filtra Serie", ["Tutte"] + get_safe_options(df, 'serie'))
-            f_editore = f3.selectbox("Filtra Editore", ["Tutti"] + get_safe_options(df, 'editore'))
+            f_serie = f2.selectbox("Filtra Serie", ["Tutte"] + opzioni_filtri['serie'])
+            f_editore = f3.selectbox("Filtra Editore", ["Tutti"] + opzioni_filtri['editore'])
             
             f4, f5, f6 = st.columns(3)
-            f_box = f4.selectbox("Filtra Box", ["Tutti"] + get_safe_options(df, 'storage_box'))
+            f_box = f4.selectbox("Filtra Box", ["Tutti"] + opzioni_filtri['storage_box'])
             f_stato = f5.selectbox("Filtra Stato", ["Tutti"] + LISTA_STATO)
             f_formato = f6.selectbox("Filtra Formato", ["Tutti"] + LISTA_FORMATO)
 
-        # Logica di filtraggio
-        filt_df = df.copy()
-        if search_text:
-            filt_df = filt_df[filt_df.astype(str).apply(lambda r: search_text.lower() in r.str.lower().values, axis=1)]
-        if f_serie != "Tutte": filt_df = filt_df[filt_df['serie'].astype(str) == f_serie]
-        if f_editore != "Tutti": filt_df = filt_df[filt_df['editore'].astype(str) == f_editore]
-        if f_box != "Tutti": filt_df = filt_df[filt_df['storage_box'].astype(str) == f_box]
-        if f_stato != "Tutti": filt_df = filt_df[filt_df['stato'].astype(str) == f_stato]
-        if f_formato != "Tutti": filt_df = filt_df[filt_df['formato'].astype(str) == f_formato]
+        # Logica di filtraggio: un'unica maschera booleana, poi una sola selezione
+        mask = pd.Series(True, index=df.index)
+        if search_text: mask &= maschera_testo(df, search_text)
+        if f_serie != "Tutte": mask &= df['serie'] == f_serie
+        if f_editore != "Tutti": mask &= df['editore'] == f_editore
+        if f_box != "Tutti": mask &= df['storage_box'] == f_box
+        if f_stato != "Tutti": mask &= df['stato'] == f_stato
+        if f_formato != "Tutti": mask &= df['formato'] == f_formato
+        filt_df = df[mask]
 
         # Visualizzazione tabella estesa
         st.dataframe(
@@ -132,7 +184,7 @@ elif menu == "📊 Statistiche":
             
         st.divider()
         st.subheader("Riepilogo Editori")
-        ed_stats = df.groupby('editore').size().reset_index(name='Albi')
+        ed_stats = df.groupby('editore', observed=True).size().reset_index(name='Albi')
         st.table(ed_stats.sort_values(by='Albi', ascending=False))
     else:
         st.warning("Nessun dato disponibile per generare statistiche.")
@@ -141,10 +193,21 @@ elif menu == "📊 Statistiche":
 elif menu == "⚙️ Configurazione":
     st.title("⚙️ Gestione Sistema")
     st.info("App in modalità sola lettura sincronizzata con Google Sheets.")
+    cache = cache_foglio()
+    if cache.aggiornato:
+        quando = datetime.fromtimestamp(cache.aggiornato).strftime("%d/%m/%Y %H:%M:%S")
+        stato = " · aggiornamento in corso..." if cache.in_aggiornamento() else ""
+        st.caption(f"Snapshot del {quando} (versione {cache.versione}, aggiornamento automatico ogni {cache.ttl} s){stato}")
     if st.button("🔄 Forza Aggiornamento Dati"):
-        st.cache_data.clear()
+        with st.spinner("Aggiornamento dal foglio..."):
+            cache.aggiorna(attendi=True, forza=True)
         st.rerun()
     
     st.divider()
-    csv = df.to_csv(index=False, sep=';').encode('utf-8')
-    st.download_button("📥 Esporta Backup CSV", data=csv, file_name="collezione_fumetti.csv", mime="text/csv")
+    versione = cache.versione
+    st.download_button("📥 Esporta Backup CSV", data=lambda: esporta_snapshot(versione, "csv", df),
+                       file_name="collezione_fumetti.csv", mime="text/csv")
+    if colonnare.disponibile():
+        for formato, estensione in colonnare.FORMATI.items():
+            st.download_button(f"📥 Esporta {formato.capitalize()}", data=lambda f=formato: esporta_snapshot(versione, f, df),
+                               file_name=f"collezione_fumetti{estensione}", mime=colonnare.MIME[formato])
@@ -0,0 +1,12 @@
+import pytest
+
+from comics import db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Un database vuoto in tmp_path al posto di comics_pro.db: restituisce il percorso del file."""
+    monkeypatch.setattr(db, "DB_NAME", str(tmp_path / "comics.db"))
+    db.chiudi_connessioni()
+    yield db.DB_NAME
+    db.chiudi_connessioni()
@@ -0,0 +1,99 @@
+import pytest
+
+from comics import db
+from comics.archivio import aggiungi_albo, elimina_albo, leggi_pagina, salva_modifiche, svuota_serie
+from comics.statistiche import ricostruisci
+
+
+# --- PREPARAZIONE ---
+@pytest.fixture
+def albi(database):
+    valori = [("Tex", "", 1, "stock", 3.5), ("Tex", "", 2, "wish list", 3.5), ("Tex", "Speciale", 1, "stock", 6.0),
+              ("Zagor", "", 1, "stock", 2.9)]
+    return [aggiungi_albo({"serie": s, "subserie": ss, "numero": n, "titolo": f"{s} {ss} {n}", "stato": stato,
+                           "prezzo_copertina": prezzo, "valuta": "Euro"})
+            for s, ss, n, stato, prezzo in valori]
+
+
+def _pagina():
+    df, _ = leggi_pagina("1", [])
+    return df
+
+
+def _posizione(df, record_id):
+    return int(df.index[df["id"] == record_id][0])
+
+
+def _titolo(record_id):
+    return db.leggi_df("SELECT titolo FROM comics WHERE id = ?", (record_id,))["titolo"].iloc[0]
+
+
+# --- MODIFICHE DALL'EDITOR ---
+def test_secondo_salvataggio_su_dati_vecchi_in_conflitto(albi):
+    # Due sessioni leggono la stessa pagina e modificano lo stesso albo
+    prima, seconda = _pagina(), _pagina()
+    record_id = albi[0]
+    assert salva_modifiche(prima, {_posizione(prima, record_id): {"titolo": "Prima"}}) == (1, [])
+    assert salva_modifiche(seconda, {_posizione(seconda, record_id): {"titolo": "Seconda"}}) == (0, [record_id])
+    assert _titolo(record_id) == "Prima"
+    # La pagina della seconda sessione resta com'era: la modifica persa si vede
+    assert seconda.loc[seconda["id"] == record_id, "titolo"].iloc[0] != "Seconda"
+
+
+def test_salvataggi_successivi_dalla_stessa_pagina(albi):
+    # La pagina è aggiornata sul posto (versione compresa): la stessa sessione può salvare ancora
+    pagina = _pagina()
+    posizione = _posizione(pagina, albi[1])
+    assert salva_modifiche(pagina, {posizione: {"titolo": "Uno"}}) == (1, [])
+    assert salva_modifiche(pagina, {posizione: {"titolo": "Due"}}) == (1, [])
+    assert _titolo(albi[1]) == "Due"
+
+
+def test_conflitto_solo_per_le_righe_cambiate(albi):
+    vecchia = _pagina()
+    elimina_albo(albi[3])
+    modifiche = {_posizione(vecchia, albi[2]): {"note": "ok"}, _posizione(vecchia, albi[3]): {"note": "perso"}}
+    assert salva_modifiche(vecchia, modifiche) == (1, [albi[3]])
+
+
+# --- RIEPILOGHI MANTENUTI DAI TRIGGER ---
+def _statistiche():
+    serie = db.leggi_df("SELECT * FROM stat_serie ORDER BY serie_id")
+    subserie = db.leggi_df("SELECT * FROM stat_subserie ORDER BY serie_id, subserie_id")
+    return serie, subserie
+
+
+def _coerenti_con_comics():
+    """I riepiloghi tenuti dai trigger coincidono con quelli ricalcolati da zero."""
+    serie, subserie = _statistiche()
+    ricostruisci()
+    ricalcolate = _statistiche()
+    assert serie.equals(ricalcolate[0]) and subserie.equals(ricalcolate[1])
+
+
+def _serie(nome):
+    return db.leggi_df("""SELECT totale, in_stock, valore_euro FROM stat_serie st
+                          JOIN series s ON s.id = st.serie_id WHERE s.nome_serie = ?""", (nome,)).values.tolist()
+
+
+def test_statistiche_dopo_inserimenti(albi):
+    assert _serie("Tex") == [[3, 2, 13.0]]
+    _coerenti_con_comics()
+
+
+def test_statistiche_dopo_modifiche(albi):
+    pagina = _pagina()
+    salva_modifiche(pagina, {_posizione(pagina, albi[1]): {"stato": "stock", "prezzo_copertina": 4.0},
+                             _posizione(pagina, albi[2]): {"serie": "Zagor"}})
+    assert _serie("Tex") == [[2, 2, 7.5]]
+    assert _serie("Zagor") == [[2, 2, 8.9]]
+    _coerenti_con_comics()
+
+
+def test_statistiche_dopo_cancellazioni(albi):
+    elimina_albo(albi[0])
+    assert _serie("Tex") == [[2, 1, 9.5]]
+    svuota_serie("zagor")
+    # Una serie senza più albi esce dal riepilogo
+    assert _serie("Zagor") == []
+    _coerenti_con_comics()
@@ -0,0 +1,107 @@
+import gzip
+import json
+import sqlite3
+
+import pytest
+
+from comics import db
+from comics.archivio import aggiungi_albo, elimina_albo
+from comics.backup import crea_backup, crea_delta, modifiche_in_sospeso, pota_giornale, riapplica, ultimo_checkpoint
+
+
+# --- PREPARAZIONE ---
+def _salva(backup, percorso, conferma=True):
+    """Scrive il backup in un file, come il comando backup della CLI."""
+    with backup, open(percorso, "wb") as out:
+        out.write(backup.read())
+    if conferma:
+        backup.conferma()
+    return percorso
+
+
+def _voci_giornale():
+    return db.leggi_df("SELECT COUNT(*) AS n FROM giornale")["n"].iloc[0]
+
+
+def _albi(percorso):
+    conn = sqlite3.connect(percorso)
+    try:
+        return sorted(r[0] for r in conn.execute("SELECT titolo FROM vista_comics"))
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def albi(database):
+    return [aggiungi_albo({"serie": "Tex", "subserie": "", "numero": n, "titolo": f"Titolo {n}"}) for n in (1, 2, 3)]
+
+
+# --- BASE + DELTA + RIAPPLICA ---
+def test_cancellazioni_recuperate_da_base_e_delta(albi, tmp_path):
+    base = _salva(crea_backup(comprimi=True), tmp_path / "base.db.gz")
+    elimina_albo(albi[0])
+    elimina_albo(albi[2])
+    delta = _salva(crea_delta(comprimi=True), tmp_path / "delta.jsonl.gz")
+
+    # Tutto il giornale: le cancellazioni vengono riapplicate
+    assert riapplica(base, [delta], str(tmp_path / "tutto.db")) == 2
+    assert _albi(tmp_path / "tutto.db") == ["Titolo 2"]
+
+    # Fermandosi prima della prima cancellazione gli albi tornano
+    with gzip.open(delta, "rt", encoding="utf-8") as f:
+        next(f)
+        prima = min(json.loads(linea)["seq"] for linea in f)
+    assert riapplica(base, [delta], str(tmp_path / "prima.db"), fino_a=prima - 1) == 0
+    assert _albi(tmp_path / "prima.db") == ["Titolo 1", "Titolo 2", "Titolo 3"]
+
+
+def test_riapplica_rifiuta_il_database_in_uso(albi, tmp_path):
+    base = _salva(crea_backup(), tmp_path / "base.db")
+    with pytest.raises(ValueError):
+        riapplica(base, [], db.DB_NAME)
+
+
+# --- CHECKPOINT ---
+def test_backup_non_confermato_non_sposta_il_checkpoint(albi, tmp_path):
+    voci = _voci_giornale()
+    _salva(crea_backup(), tmp_path / "perso.db", conferma=False)
+    assert ultimo_checkpoint() == 0
+    assert modifiche_in_sospeso() == voci
+    # Il backup non accorcia il giornale: le cancellazioni restano recuperabili
+    _salva(crea_backup(), tmp_path / "base.db")
+    assert _voci_giornale() == voci
+    assert modifiche_in_sospeso() == 0
+
+
+def test_delta_non_confermato_riparte_dallo_stesso_punto(albi, tmp_path):
+    _salva(crea_backup(), tmp_path / "base.db")
+    elimina_albo(albi[1])
+    primo = _salva(crea_delta(comprimi=False), tmp_path / "d1.jsonl", conferma=False)
+    secondo = _salva(crea_delta(comprimi=False), tmp_path / "d2.jsonl")
+    with open(primo) as f1, open(secondo) as f2:
+        assert f1.read() == f2.read()
+    assert modifiche_in_sospeso() == 0
+
+
+def test_delta_vuoto_non_registra_checkpoint(albi, tmp_path):
+    _salva(crea_backup(), tmp_path / "base.db")
+    checkpoint = db.leggi_df("SELECT COUNT(*) AS n FROM checkpoint_backup")["n"].iloc[0]
+    _salva(crea_delta(), tmp_path / "vuoto.jsonl.gz")
+    assert db.leggi_df("SELECT COUNT(*) AS n FROM checkpoint_backup")["n"].iloc[0] == checkpoint
+
+
+# --- POTATURA ---
+def test_pota_solo_voci_in_un_backup_completo(albi, tmp_path):
+    voci = _voci_giornale()
+    with pytest.raises(ValueError):
+        pota_giornale(voci)
+    _salva(crea_backup(), tmp_path / "base.db")
+    fino_a = ultimo_checkpoint()
+    # Resta l'ultima voce: da lì riapplica riconosce il punto di partenza delle basi successive
+    assert pota_giornale(fino_a) == voci - 1
+    elimina_albo(albi[0])
+    base = _salva(crea_backup(), tmp_path / "base2.db")
+    elimina_albo(albi[1])
+    delta = _salva(crea_delta(), tmp_path / "delta.jsonl.gz")
+    assert riapplica(base, [delta], str(tmp_path / "ricostruito.db")) == 1
+    assert _albi(tmp_path / "ricostruito.db") == ["Titolo 3"]
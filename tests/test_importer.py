@@ -0,0 +1,80 @@
+import os
+
+import pytest
+
+from comics import db
+from comics.importer import importa_file
+
+# --- PREPARAZIONE ---
+INTESTAZIONE = "serie;subserie;numero;titolo;prezzo_copertina;stato"
+RIGHE = [
+    "Tex;;1;La valle;3,50;stock",
+    "Tex;Speciale;1;Speciale uno;6,00;wish list",
+    # Stessa chiave della prima riga (maiuscole comprese): nello stesso file aggiorna, vince l'ultima
+    "tex;;1;la valle;3,90;stock",
+]
+
+
+def _scrivi_csv(percorso, righe):
+    percorso.write_text("\n".join([INTESTAZIONE] + righe) + "\n", encoding="utf-8")
+    return str(percorso)
+
+
+def _importa(percorso):
+    (esito,) = importa_file([percorso], processi=1)
+    with open(esito["log"], encoding="utf-8") as f:
+        log = f.read().splitlines()
+    os.remove(esito["log"])
+    return esito, log
+
+
+def _albi():
+    return db.leggi_df("""SELECT id, serie, subserie, numero, titolo, prezzo_copertina, versione
+                          FROM vista_comics ORDER BY id""")
+
+
+@pytest.fixture
+def csv(database, tmp_path):
+    return _scrivi_csv(tmp_path / "albi.csv", RIGHE)
+
+
+# --- UPSERT SULLA CHIAVE NATURALE ---
+def test_primo_import_aggiunge_e_unisce_le_righe_ripetute(csv):
+    esito, log = _importa(csv)
+    assert esito["ok"] and (esito["added"], esito["updated"], esito["skipped"]) == (2, 1, 0)
+    assert [r.split(":")[0] for r in log] == ["✅ Riga 2", "✅ Riga 3", "🔄 Riga 4"]
+    albi = _albi()
+    assert albi["titolo"].tolist() == ["La valle", "Speciale uno"]
+    assert albi["prezzo_copertina"].tolist() == [3.9, 6.0]
+    assert db.leggi_df("SELECT COUNT(*) AS n FROM series")["n"].iloc[0] == 1
+
+
+def test_stesso_file_due_volte_aggiorna_senza_duplicare(csv):
+    _importa(csv)
+    prima = _albi()
+    esito, log = _importa(csv)
+    assert (esito["added"], esito["updated"]) == (0, 3)
+    assert all(r.startswith("🔄") for r in log)
+    # Stessi albi, stessi id; il contenuto non cambia quindi nemmeno la versione
+    assert _albi().equals(prima)
+
+
+def test_reimport_con_valori_cambiati_incrementa_la_versione(csv, tmp_path):
+    _importa(csv)
+    prima = _albi().set_index("id")
+    cambiato = _scrivi_csv(tmp_path / "cambiato.csv", ["TEX;speciale;1;SPECIALE UNO;7,00;stock"])
+    esito, _ = _importa(cambiato)
+    assert (esito["added"], esito["updated"]) == (0, 1)
+    dopo = _albi().set_index("id")
+    speciale = prima.index[prima["titolo"] == "Speciale uno"][0]
+    assert dopo.loc[speciale, "prezzo_copertina"] == 7.0
+    assert dopo.loc[speciale, "versione"] == prima.loc[speciale, "versione"] + 1
+    # I nomi restano quelli già in archivio
+    assert dopo.loc[speciale, ["serie", "subserie", "titolo"]].tolist() == ["Tex", "Speciale", "Speciale uno"]
+
+
+def test_righe_senza_serie_saltate(database, tmp_path):
+    esito, log = _importa(_scrivi_csv(tmp_path / "vuote.csv", [";;3;Senza serie;1;stock", "Zagor;;1;Uno;1;stock"]))
+    assert (esito["added"], esito["skipped"]) == (1, 1)
+    assert log[0].startswith("❌ Riga 2")
+    assert _albi()["serie"].tolist() == ["Zagor"]
@@ -0,0 +1,129 @@
+import sqlite3
+
+import pytest
+
+from comics import db
+from comics.archivio import aggiungi_albo, get_series_list, get_subseries_list, svuota_serie
+from comics.migrations import VERSIONE_SCHEMA, _v1_schema_iniziale
+
+# --- DATABASE DI PARTENZA ---
+# Come li lasciava init_db dell'app prima delle migrazioni: comics creata con poche colonne e le altre
+# aggiunte poi con ALTER TABLE come TEXT, user_version 0.
+ALBI_STORICI = [
+    # id, serie, subserie, numero, titolo, prezzo, anno, pagine, mese, giorno, stato
+    (1, "Tex", "", 12, "La valle", 3.5, 1990, "96", "Marzo", "5", "stock"),
+    (2, "Tex", "Speciale", 1, "Speciale uno", 6.0, 1991, "160", "aprile", "", "wish list"),
+    (3, "Zagor", None, 7, "Darkwood", 2.9, None, "", "", "", "stock"),
+    (4, "Zagor", None, 8, "Il ritorno", 2.9, 1975, "98", "Luglio", "12", "stock"),
+]
+
+
+def crea_storico(percorso, albi, eliminati=()):
+    conn = sqlite3.connect(percorso)
+    c = conn.cursor()
+    c.execute("""CREATE TABLE comics (id INTEGER PRIMARY KEY AUTOINCREMENT, serie TEXT, subserie TEXT,
+                 numero INTEGER, titolo TEXT, prezzo_copertina REAL, anno_uscita INTEGER)""")
+    # Lo schema storico di init_db: aggiunge come TEXT le colonne mancanti e crea le altre tabelle
+    _v1_schema_iniziale(c)
+    c.executemany("""INSERT INTO comics (id, serie, subserie, numero, titolo, prezzo_copertina, anno_uscita,
+                                         pagine, mese_uscita, giorno_uscita, stato)
+                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", albi)
+    c.executemany("DELETE FROM comics WHERE id = ?", [(i,) for i in eliminati])
+    conn.commit()
+    conn.close()
+
+
+def _uno(sql, params=()):
+    with db.connessione() as conn:
+        return conn.execute(sql, params).fetchone()
+
+
+@pytest.fixture
+def storico(database):
+    crea_storico(database, ALBI_STORICI)
+    return database
+
+
+# --- MIGRAZIONE COMPLETA ---
+def test_migrazione_conserva_gli_albi(storico):
+    assert _uno("PRAGMA user_version")[0] == VERSIONE_SCHEMA
+    with db.connessione() as conn:
+        albi = conn.execute("""SELECT id, serie, subserie, numero, titolo, prezzo_copertina, anno_uscita,
+                                      pagine, mese_uscita, giorno_uscita, stato
+                               FROM vista_comics ORDER BY id""").fetchall()
+    # I numeri salvati come testo diventano interi, il resto resta com'era (subserie NULL: '')
+    attesi = [(i, serie, subserie or "", numero, titolo, prezzo, anno, int(pagine) if pagine else pagine,
+               mese, int(giorno) if giorno else giorno, stato)
+              for i, serie, subserie, numero, titolo, prezzo, anno, pagine, mese, giorno, stato in ALBI_STORICI]
+    assert albi == attesi
+
+
+def test_migrazione_tipizza_le_colonne_aggiunte(storico):
+    # pagine e giorno_uscita erano TEXT: dopo la v2 sono numeri, quindi la data di uscita si calcola
+    assert _uno("SELECT typeof(pagine), data_uscita FROM comics WHERE id = 1") == ("integer", 19900305)
+    assert _uno("SELECT data_uscita FROM comics WHERE id = 3") == (None,)
+
+
+def test_migrazione_prepara_ricerca_e_statistiche(storico):
+    assert _uno("SELECT rowid FROM comics_fts WHERE comics_fts MATCH 'darkwood'") == (3,)
+    assert _uno("""SELECT st.totale, st.in_stock FROM stat_serie st JOIN series s ON s.id = st.serie_id
+                   WHERE s.nome_serie = 'Tex'""") == (2, 1)
+
+
+def test_nuovi_id_dopo_l_ultimo_assegnato(database):
+    crea_storico(database, ALBI_STORICI + [(5, "Tex", "", 13, "Eliminato", 3.5, 1990, "", "", "", "")], eliminati=[5])
+    assert aggiungi_albo({"serie": "Tex", "numero": 14, "titolo": "Nuovo"}) == 6
+
+
+def test_nuovi_id_dopo_un_archivio_svuotato(database):
+    crea_storico(database, ALBI_STORICI, eliminati=[1, 2, 3, 4])
+    assert aggiungi_albo({"serie": "Tex", "numero": 14, "titolo": "Nuovo"}) == 5
+
+
+# --- VARIANTI DI MAIUSCOLE ---
+VARIANTI = [
+    (5, "tex", "speciale", 2, "Speciale due", 6.0, 1992, "160", "", "", "stock"),
+    (6, "TEX", "", 13, "Il ritorno di Tex", 3.5, 1990, "96", "", "", "stock"),
+]
+
+
+def _nomi(record_ids):
+    with db.connessione() as conn:
+        return [tuple(r) for r in conn.execute(
+            f"SELECT serie, subserie FROM vista_comics WHERE id IN ({', '.join('?' * len(record_ids))}) ORDER BY id",
+            record_ids)]
+
+
+def _verifica_unione():
+    # Una sola serie e una sola sottoserie per nome, con la grafia della prima riga
+    assert get_series_list() == ["Tex", "Zagor"]
+    assert get_subseries_list("tex") == ["", "Speciale"]
+    assert _nomi([5, 6]) == [("Tex", "Speciale"), ("Tex", "")]
+    assert _uno("""SELECT st.totale FROM stat_serie st JOIN series s ON s.id = st.serie_id
+                   WHERE s.nome_serie = 'Tex'""") == (4,)
+    assert _uno("SELECT COUNT(*) FROM stat_serie") == (2,)
+    # Il filtro per nome trova tutti gli albi, con qualunque maiuscola
+    assert svuota_serie("tex") == 4
+    assert _uno("SELECT COUNT(*), MIN(serie) FROM vista_comics") == (2, "Zagor")
+
+
+def test_migrazione_unisce_le_varianti_di_maiuscole(database):
+    crea_storico(database, ALBI_STORICI + VARIANTI)
+    _verifica_unione()
+
+
+def test_unione_delle_varianti_in_un_database_gia_migrato(storico):
+    # Un database passato dalla v9 quando le varianti restavano righe distinte
+    with db.connessione() as conn:
+        serie = conn.execute("INSERT INTO series (nome_serie) VALUES ('tex')").lastrowid
+        speciale = conn.execute("INSERT INTO subseries (serie_id, nome_subserie) VALUES (?, 'speciale')",
+                                (serie,)).lastrowid
+        vuota = conn.execute("INSERT INTO subseries (serie_id, nome_subserie) VALUES (?, '')", (serie,)).lastrowid
+        conn.executemany("""INSERT INTO comics (id, serie_id, subserie_id, numero, titolo, stato)
+                            VALUES (?, ?, ?, ?, ?, 'stock')""",
+                         [(5, serie, speciale, 2, "Speciale due"), (6, serie, vuota, 13, "Il ritorno di Tex")])
+        conn.execute(f"PRAGMA user_version = {VERSIONE_SCHEMA - 1}")
+    db.chiudi_connessioni()
+    assert _uno("PRAGMA user_version")[0] == VERSIONE_SCHEMA
+    assert _uno("SELECT versione FROM comics WHERE id = 5") == (2,)
+    _verifica_unione()
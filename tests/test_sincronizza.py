@@ -0,0 +1,189 @@
+import pytest
+
+from comics import db
+from comics.archivio import _aggiorna_righe, aggiungi_albo, elimina_albo
+from comics.foglio import FoglioCSV
+from comics.scrittore import esegui
+from comics.sincronizza import COLONNE_FOGLIO, sincronizza
+
+
+# --- PREPARAZIONE ---
+# Ogni test ha il suo database (fixture database di conftest.py) e il suo foglio CSV in tmp_path
+@pytest.fixture
+def percorso_foglio(database, tmp_path):
+    return str(tmp_path / "foglio.csv")
+
+
+@pytest.fixture
+def collegati(percorso_foglio):
+    """Tre albi già sincronizzati con il foglio: restituisce i loro id."""
+    ids = [aggiungi_albo({"serie": "Tex", "subserie": "", "numero": n, "titolo": f"Titolo {n}"}) for n in (1, 2, 3)]
+    sincronizza(FoglioCSV(percorso_foglio))
+    return ids
+
+
+def _albi():
+    return db.leggi_df("SELECT id, versione, serie, numero, titolo FROM vista_comics ORDER BY id").set_index("id")
+
+
+def _foglio(percorso):
+    return FoglioCSV(percorso).leggi()
+
+
+def _modifica_foglio(percorso, modifica):
+    """Applica modifica(DataFrame) -> DataFrame al foglio, riscrivendolo come farebbe un utente."""
+    foglio = FoglioCSV(percorso)
+    dati = modifica(foglio.leggi())
+    foglio.riscrivi(list(dati.columns), dati.values.tolist())
+
+
+def _riga(dati, record_id):
+    return dati[dati["id"] == str(record_id)].iloc[0]
+
+
+def _aggiorna(record_id, valori):
+    versione = int(_albi().loc[record_id, "versione"])
+    assert esegui(_aggiorna_righe, [(record_id, versione, valori)]) == []
+
+
+# --- PRIMO COLLEGAMENTO ---
+def test_primo_collegamento_scrive_tutto_il_foglio(percorso_foglio):
+    ids = [aggiungi_albo({"serie": "Tex", "subserie": "", "numero": n, "titolo": f"Titolo {n}"}) for n in (1, 2)]
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["riscritto"] and esito["inviate"] == 2
+    dati = _foglio(percorso_foglio)
+    assert list(dati.columns) == COLONNE_FOGLIO
+    assert dati["id"].tolist() == [str(i) for i in ids]
+
+
+def test_senza_modifiche_non_rilegge_il_foglio(percorso_foglio, collegati):
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert not esito["letto"]
+    assert esito["richieste"] == 0
+
+
+def test_vince_non_valido(percorso_foglio):
+    with pytest.raises(ValueError):
+        sincronizza(FoglioCSV(percorso_foglio), vince="nessuno")
+
+
+# --- MODIFICHE DA UNA SOLA PARTE ---
+def test_modifica_nel_foglio_arriva_nell_archivio(percorso_foglio, collegati):
+    def cambia(dati):
+        dati.loc[dati["id"] == str(collegati[0]), "titolo"] = "Dal foglio"
+        return dati
+    _modifica_foglio(percorso_foglio, cambia)
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["ricevute"] == 1 and esito["inviate"] == 0
+    assert _albi().loc[collegati[0], "titolo"] == "Dal foglio"
+
+
+def test_modifica_nell_archivio_arriva_nel_foglio(percorso_foglio, collegati):
+    _aggiorna(collegati[1], {"titolo": "Dall'archivio"})
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["inviate"] == 1 and esito["ricevute"] == 0
+    assert _riga(_foglio(percorso_foglio), collegati[1])["titolo"] == "Dall'archivio"
+
+
+# --- CONFLITTI ---
+@pytest.mark.parametrize("vince, atteso", [("archivio", "Archivio"), ("foglio", "Foglio")])
+def test_conflitto_deciso_da_vince(percorso_foglio, collegati, vince, atteso):
+    record_id = collegati[0]
+    _aggiorna(record_id, {"titolo": "Archivio"})
+
+    def cambia(dati):
+        dati.loc[dati["id"] == str(record_id), "titolo"] = "Foglio"
+        return dati
+    _modifica_foglio(percorso_foglio, cambia)
+
+    esito = sincronizza(FoglioCSV(percorso_foglio), vince=vince)
+    assert esito["conflitti"] == 1
+    assert _albi().loc[record_id, "titolo"] == atteso
+    assert _riga(_foglio(percorso_foglio), record_id)["titolo"] == atteso
+    assert sincronizza(FoglioCSV(percorso_foglio))["conflitti"] == 0
+
+
+# --- CANCELLAZIONI ---
+def test_riga_tolta_dal_foglio_elimina_l_albo(percorso_foglio, collegati):
+    _modifica_foglio(percorso_foglio, lambda dati: dati[dati["id"] != str(collegati[1])])
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["eliminate_archivio"] == 1
+    assert collegati[1] not in _albi().index
+
+
+def test_albo_eliminato_toglie_la_riga_dal_foglio(percorso_foglio, collegati):
+    elimina_albo(collegati[1])
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["eliminate_foglio"] == 1
+    assert _foglio(percorso_foglio)["id"].tolist() == [str(collegati[0]), str(collegati[2])]
+
+
+def test_riga_tolta_dal_foglio_ma_cambiata_nell_archivio_torna(percorso_foglio, collegati):
+    # La cancellazione vale solo per il contenuto concordato: la modifica più recente non si perde
+    _aggiorna(collegati[1], {"titolo": "Cambiato"})
+    _modifica_foglio(percorso_foglio, lambda dati: dati[dati["id"] != str(collegati[1])])
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["eliminate_archivio"] == 0 and esito["inviate"] == 1
+    assert _riga(_foglio(percorso_foglio), collegati[1])["titolo"] == "Cambiato"
+
+
+# --- RIGHE SENZA ID ---
+def test_righe_senza_id_ricollegate_per_chiave(percorso_foglio, collegati):
+    def togli_id(dati):
+        dati["id"] = ""
+        return dati
+    _modifica_foglio(percorso_foglio, togli_id)
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["ricevute"] == 0 and esito["eliminate_archivio"] == 0
+    assert len(_albi()) == 3
+    # Gli id tornano nel foglio, nelle stesse righe
+    assert _foglio(percorso_foglio)["id"].tolist() == [str(i) for i in collegati]
+
+
+def test_riga_nuova_senza_id_diventa_un_albo(percorso_foglio, collegati):
+    def aggiungi(dati):
+        nuova = {col: "" for col in dati.columns}
+        nuova.update(serie="Zagor", numero="7", titolo="Aggiunta a mano")
+        dati.loc[len(dati)] = nuova
+        return dati
+    _modifica_foglio(percorso_foglio, aggiungi)
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["ricevute"] == 1
+    albi = _albi()
+    nuovo_id = int(albi.index[albi["titolo"] == "Aggiunta a mano"][0])
+    assert _foglio(percorso_foglio)["id"].tolist()[-1] == str(nuovo_id)
+
+
+def test_riga_senza_serie_scartata(percorso_foglio, collegati):
+    def aggiungi(dati):
+        nuova = {col: "" for col in dati.columns}
+        nuova.update(titolo="Senza serie")
+        dati.loc[len(dati)] = nuova
+        return dati
+    _modifica_foglio(percorso_foglio, aggiungi)
+    esito = sincronizza(FoglioCSV(percorso_foglio))
+    assert esito["scartate"] == 1 and esito["ricevute"] == 0
+    assert len(_albi()) == 3
+
+
+# --- VERSIONI ---
+def test_ricezione_incrementa_la_versione(percorso_foglio, collegati):
+    record_id = collegati[2]
+    letta = int(_albi().loc[record_id, "versione"])
+
+    def cambia(dati):
+        dati.loc[dati["id"] == str(record_id), "titolo"] = "Nuovo"
+        return dati
+    _modifica_foglio(percorso_foglio, cambia)
+    sincronizza(FoglioCSV(percorso_foglio))
+    assert int(_albi().loc[record_id, "versione"]) == letta + 1
+    # Un editor con la versione letta prima della sincronizzazione va in conflitto
+    assert esegui(_aggiorna_righe, [(record_id, letta, {"titolo": "Vecchio"})]) == [record_id]
+    assert _albi().loc[record_id, "titolo"] == "Nuovo"
+
+
+def test_invio_non_cambia_la_versione(percorso_foglio, collegati):
+    versioni = _albi()["versione"].tolist()
+    _modifica_foglio(percorso_foglio, lambda dati: dati.assign(id=""))
+    sincronizza(FoglioCSV(percorso_foglio))
+    assert _albi()["versione"].tolist() == versioni